@@ -0,0 +1,241 @@
+"""
+end-to-end crawl benchmark against a local synthetic webchain.
+
+    uv run python -m benchmarks --nodes 1000 --out results.json
+    uv run python -m benchmarks --nodes 1000 --baseline results.json
+
+runs `crawl` and `enrich_with_metadata` against the server in `synthetic.py`,
+first with an empty cache (cold) and then again reusing it (warm). to compare
+http clients, pass `--transport` more than once:
+
+    uv run python -m benchmarks --transport aiohttp --transport httpx --http2
+
+every client runs in a process of its own. the server speaks http/1.1 only,
+unless `--http2` serves it over tls, with http/2 to the clients that
+negotiate it, as most sites do. without it httpx can't multiplex requests,
+and the comparison only measures the overhead of each client. `--http2`
+needs the `http2` extra and openssl to make a certificate with.
+
+`--workers N` crawls with N worker processes instead, which only helps once
+the nodes are spread over `--hosts`.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, fields
+from datetime import datetime, timezone
+
+import click
+
+from benchmarks.phases import run_transport
+from benchmarks.synthetic import SyntheticChain, loopback_hosts, serve
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_certificate(directory: str, hosts: list[str]) -> tuple[str, str]:
+    """
+    a self-signed certificate for `hosts`, as the certificate to trust and a
+    pem file with the certificate and its key for the server
+    """
+    key = os.path.join(directory, "key.pem")
+    certificate = os.path.join(directory, "certificate.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"]
+        + ["-nodes", "-days", "1", "-subj", "/CN=webchain benchmark"]
+        + ["-addext", "subjectAltName=" + ",".join(f"IP:{host}" for host in hosts)]
+        + ["-keyout", key, "-out", certificate],
+        check=True,
+        capture_output=True,
+    )
+    server = os.path.join(directory, "server.pem")
+    with open(server, "w") as f:
+        f.write(open(certificate).read() + open(key).read())
+    return certificate, server
+
+
+def wait_for_server(base: str, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(f"{base}/_stats", timeout=1).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_ms(x: float | None) -> str:
+    return "-" if x is None else f"{x * 1000:.1f}ms"
+
+
+def print_report(results: list[dict], baseline: dict | None) -> None:
+    baseline_by_key = {
+        (r.get("transport", "aiohttp"), r["phase"], r["cache"]): r
+        for r in (baseline or {}).get("results", [])
+    }
+    print(
+        f"{'client':<9}{'http':<10}{'phase':<8}{'cache':<7}{'nodes':>7}{'time':>10}{'nodes/s':>10}"
+        f"{'p50':>10}{'p99':>10}{'requests':>10}{'rss':>9}"
+    )
+    for r in results:
+        line = (
+            f"{r['transport']:<9}{r.get('protocol', 'http/1.1'):<10}{r['phase']:<8}{r['cache']:<7}{r['nodes']:>7}{r['duration']:>9.2f}s"
+            f"{r['nodes_per_sec'] or 0:>10.1f}{format_ms(r['p50_node_latency']):>10}"
+            f"{format_ms(r['p99_node_latency']):>10}{r['requests']['requests']:>10}"
+            f"{r['peak_rss_mb']:>7.1f}MB"
+        )
+        previous = baseline_by_key.get((r["transport"], r["phase"], r["cache"]))
+        if previous and previous["duration"]:
+            line += f"  ({r['duration'] / previous['duration']:.2f}x baseline time)"
+        print(line)
+
+
+def chain_options(func):
+    for f in reversed(fields(SyntheticChain)):
+        func = click.option(
+            "--" + f.name.replace("_", "-"),
+            f.name,
+            default=f.default,
+            show_default=True,
+            type=type(f.default),
+        )(func)
+    return func
+
+
+@click.command()
+@chain_options
+@click.option("--attempts", default=2, show_default=True, help="network attempts per request")
+@click.option("--robots-txt/--no-robots-txt", default=True)
+@click.option(
+    "--transport",
+    "transports",
+    type=click.Choice(["aiohttp", "httpx"]),
+    multiple=True,
+    default=["aiohttp"],
+    show_default=True,
+    help="http client to crawl with, each one in turn with a cache of its own",
+)
+@click.option(
+    "--http2",
+    is_flag=True,
+    default=False,
+    help="serve over tls, with http/2 to the clients that negotiate it",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="crawl with this many worker processes, 0 to crawl in this one",
+)
+@click.option("--out", type=click.Path(dir_okay=False), help="write results as json")
+@click.option(
+    "--baseline", type=click.File(), help="results json from an earlier run to compare against"
+)
+def main(
+    attempts: int,
+    robots_txt: bool,
+    transports: tuple[str, ...],
+    http2: bool,
+    workers: int,
+    out: str | None,
+    baseline,
+    **chain_kwargs,
+) -> None:
+    chain = SyntheticChain(**chain_kwargs)
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    certificate_dir = tempfile.TemporaryDirectory()
+    certificate, h2_port = None, None
+    if http2:
+        trusted, certificate = make_certificate(certificate_dir.name, loopback_hosts(chain))
+        # trusted by both clients, and by every process started from here on
+        os.environ["SSL_CERT_FILE"] = trusted
+        h2_port = free_port()
+        base = f"https://127.0.0.1:{port}"
+
+    # run the server in its own process so that it doesn't compete with the
+    # crawler for the event loop
+    context = multiprocessing.get_context("spawn")
+    server = context.Process(
+        target=serve, args=(chain, "127.0.0.1", port, certificate, h2_port), daemon=True
+    )
+    server.start()
+
+    os.environ["WEBCHAIN_NETWORK_ATTEMPTS"] = str(attempts)
+    os.environ.pop("WEBCHAIN_NO_CACHE", None)
+    no_proxy = os.environ.get("NO_PROXY", "")
+    os.environ["NO_PROXY"] = ",".join(filter(None, [no_proxy, *loopback_hosts(chain)]))
+
+    results = []
+    try:
+        wait_for_server(base)
+        for transport in transports:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                os.environ["WEBCHAIN_CACHE_DB"] = os.path.join(cache_dir, "http-cache.sqlite")
+                os.environ["WEBCHAIN_EXTRACTION_CACHE_DB"] = os.path.join(
+                    cache_dir, "extraction-cache.sqlite"
+                )
+                os.environ["WEBCHAIN_TRANSPORT"] = transport
+                # aiohttp only speaks http/1.1, so it crawls the http/1.1 server
+                crawl_base = (
+                    f"https://127.0.0.1:{h2_port}" if http2 and transport == "httpx" else base
+                )
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    results += pool.submit(
+                        run_transport, crawl_base, base, robots_txt, transport, workers
+                    ).result()
+    finally:
+        server.terminate()
+        server.join()
+        certificate_dir.cleanup()
+
+    report = {
+        "revision": git_revision(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "chain": asdict(chain),
+        "attempts": attempts,
+        "robots_txt": robots_txt,
+        "transports": list(transports),
+        "http2": http2,
+        "workers": workers,
+        "results": results,
+    }
+
+    baseline_report = json.load(baseline) if baseline else None
+    if baseline_report and baseline_report.get("chain") != report["chain"]:
+        print("warning: baseline was run against a different synthetic chain", file=sys.stderr)
+    print_report(results, baseline_report)
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent="\t")
+
+
+if __name__ == "__main__":
+    main()
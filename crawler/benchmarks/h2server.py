@@ -0,0 +1,82 @@
+"""
+the synthetic webchain over http/2, so that clients that multiplex requests
+over one connection per host can be measured doing so.
+
+aiohttp's server only speaks http/1.1, so this is a minimal server on the h2
+protocol library httpx uses, serving the same `SyntheticSite`. it handles
+GET requests and flow control, and nothing else.
+"""
+
+import asyncio
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+from multidict import CIMultiDict
+
+from benchmarks.synthetic import SyntheticSite
+
+
+async def serve_h2(
+    site: SyntheticSite, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """serve the requests of one http/2 connection, each stream as its own task"""
+    conn = h2.connection.H2Connection(
+        config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+    )
+    conn.initiate_connection()
+    writer.write(conn.data_to_send())
+    window_updated = asyncio.Event()
+    streams: set[asyncio.Task] = set()
+
+    async def flush() -> None:
+        writer.write(conn.data_to_send())
+        await writer.drain()
+
+    async def respond(stream_id: int, headers: CIMultiDict) -> None:
+        base = f"https://{headers[':authority']}"
+        reply = await site.handle(headers[":path"].partition("?")[0], headers, base)
+        site.stats["http2"] += 1
+        response_headers = [
+            (":status", str(reply.status)),
+            *((name.lower(), value) for name, value in reply.headers.items()),
+            ("content-length", str(len(reply.body))),
+        ]
+        try:
+            conn.send_headers(stream_id, response_headers, end_stream=not reply.body)
+            await flush()
+            body = memoryview(reply.body)
+            while body:
+                window = min(
+                    conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size
+                )
+                if window <= 0:
+                    window_updated.clear()
+                    await window_updated.wait()
+                    continue
+                chunk, body = body[:window], body[window:]
+                conn.send_data(stream_id, bytes(chunk), end_stream=not body)
+                await flush()
+        except (h2.exceptions.StreamClosedError, ConnectionError):
+            # the client reset the stream, or went away
+            pass
+
+    try:
+        while data := await reader.read(65536):
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    task = asyncio.create_task(respond(event.stream_id, CIMultiDict(event.headers)))
+                    streams.add(task)
+                    task.add_done_callback(streams.discard)
+                elif isinstance(event, (h2.events.WindowUpdated, h2.events.StreamReset)):
+                    window_updated.set()
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            await flush()
+    except (h2.exceptions.ProtocolError, ConnectionError):
+        pass
+    finally:
+        for task in streams:
+            task.cancel()
+        writer.close()
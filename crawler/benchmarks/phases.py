@@ -0,0 +1,110 @@
+"""
+one http client's run of the benchmark, in a process of its own so that its
+peak rss is its own, and it is started with the environment it runs in.
+"""
+
+import asyncio
+import json
+import resource
+import sys
+import time
+import urllib.request
+
+
+def server_stats(base: str) -> dict:
+    with urllib.request.urlopen(f"{base}/_stats", timeout=5) as response:
+        return json.load(response)
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def run_phases(
+    base: str, stats_base: str, robots_txt: bool, transport: str, workers: int
+) -> list[dict]:
+    # imported late so that the cache location set in the environment is used
+    from spider.crawl import crawl
+    from spider.metadata import enrich_with_metadata
+    from spider.shard import crawl_sharded
+
+    results = []
+
+    for cache_state in ("cold", "warm"):
+        started: dict[str, float] = {}
+        latencies: list[float] = []
+
+        def on_node_start(at: str, parent: str | None, depth: int) -> None:
+            started[at] = time.perf_counter()
+
+        def on_node_complete(node, nominations_limit: int) -> None:
+            latencies.append(time.perf_counter() - started[node.at])
+
+        before = server_stats(stats_base)
+        t0 = time.perf_counter()
+        callbacks = dict(on_node_start=on_node_start, on_node_complete=on_node_complete)
+        if workers:
+            crawled = await crawl_sharded(base, workers, check_robots_txt=robots_txt, **callbacks)
+        else:
+            crawled = await crawl(base, check_robots_txt=robots_txt, **callbacks)
+        crawl_duration = time.perf_counter() - t0
+        after_crawl = server_stats(stats_base)
+
+        t0 = time.perf_counter()
+        await enrich_with_metadata(crawled, check_robots_txt=robots_txt)
+        enrich_duration = time.perf_counter() - t0
+        after_enrich = server_stats(stats_base)
+
+        indexed = sum(node.indexed for node in crawled.nodes)
+        for phase, duration, stats_before, stats_after, node_latencies in (
+            ("crawl", crawl_duration, before, after_crawl, latencies),
+            ("enrich", enrich_duration, after_crawl, after_enrich, []),
+        ):
+            http2 = stats_after.get("http2", 0) - stats_before.get("http2", 0)
+            results.append(
+                {
+                    "transport": transport,
+                    "protocol": "h2" if http2 else "http/1.1",
+                    "workers": workers,
+                    "phase": phase,
+                    "cache": cache_state,
+                    "nodes": len(crawled.nodes),
+                    "indexed": indexed,
+                    "duration": duration,
+                    "nodes_per_sec": len(crawled.nodes) / duration if duration else None,
+                    "p50_node_latency": percentile(node_latencies, 50),
+                    "p99_node_latency": percentile(node_latencies, 99),
+                    "requests": {
+                        k: stats_after.get(k, 0) - stats_before.get(k, 0)
+                        for k in (
+                            "requests",
+                            "pages",
+                            "feeds",
+                            "robots",
+                            "not_modified",
+                            "errors",
+                            "http2",
+                            "bytes",
+                        )
+                    },
+                    "peak_rss_mb": peak_rss_mb(),
+                }
+            )
+
+    return results
+
+
+def run_transport(
+    base: str, stats_base: str, robots_txt: bool, transport: str, workers: int
+) -> list[dict]:
+    return asyncio.run(run_phases(base, stats_base, robots_txt, transport, workers))
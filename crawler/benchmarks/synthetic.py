@@ -0,0 +1,273 @@
+"""
+a local server that generates a synthetic webchain on the fly.
+
+node 0 is the seed and is served at `/`, every other node `i` at `/n/{i}`.
+nodes are laid out breadth-first: node `i` nominates `fanout * i + 1` up to
+`fanout * i + fanout`, stopping at `nodes` total or `depth` levels. pages are
+modelled after the documents in `examples/`.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import random
+import re
+import ssl
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Mapping
+
+import brotli
+import zstandard
+from aiohttp import web
+
+COMPRESSORS = {"gzip": gzip.compress, "br": brotli.compress, "zstd": zstandard.compress}
+
+NODE_PATH = re.compile(r"/(?:n/(\d+))?")
+FEED_PATH = re.compile(r"/n/(\d+)/feed\.xml")
+ROBOTS_TXT = b"User-agent: *\nAllow: /\n"
+
+
+@dataclass
+class SyntheticChain:
+    nodes: int = 500
+    fanout: int = 3
+    depth: int = 20
+    page_size: int = 4096
+    """approximate size in bytes of each html page, padded in the body"""
+    latency_median: float = 0.02
+    """median response latency in seconds"""
+    latency_sigma: float = 0.5
+    """sigma of the lognormal latency distribution, 0 for constant latency"""
+    error_rate: float = 0.0
+    """fraction of nodes that always respond with `error_status`"""
+    error_status: int = 503
+    caching: str = "etag"
+    """one of none, etag, max-age or both"""
+    feed_rate: float = 0.25
+    """fraction of nodes that link an rss feed"""
+    compression: str = "none"
+    """content coding of responses, one of none, gzip, br, zstd, or any for the best one accepted"""
+    hosts: int = 1
+    """loopback addresses the nodes are spread over, from 127.0.0.1 up, as if they were separate sites"""
+    seed: int = 0
+
+    def children(self, i: int) -> list[int]:
+        if self.level(i) >= self.depth:
+            return []
+        first = self.fanout * i + 1
+        return [c for c in range(first, first + self.fanout) if c < self.nodes]
+
+    def level(self, i: int) -> int:
+        level = 0
+        while i > 0:
+            i = (i - 1) // self.fanout
+            level += 1
+        return level
+
+    def is_error(self, i: int) -> bool:
+        return i != 0 and random.Random(f"{self.seed}:error:{i}").random() < self.error_rate
+
+    def has_feed(self, i: int) -> bool:
+        return random.Random(f"{self.seed}:feed:{i}").random() < self.feed_rate
+
+
+def node_url(base: str, i: int, hosts: int = 1) -> str:
+    if hosts > 1:
+        scheme, _, authority = base.partition("://")
+        port = authority.rpartition(":")[2]
+        base = f"{scheme}://127.0.0.{1 + i % hosts}:{port}"
+    return base if i == 0 else f"{base}/n/{i}"
+
+
+def loopback_hosts(chain: SyntheticChain) -> list[str]:
+    return [f"127.0.0.{k}" for k in range(1, chain.hosts + 1)]
+
+
+def render_page(chain: SyntheticChain, base: str, i: int) -> str:
+    head = [
+        '\t<meta charset="UTF-8">',
+        f'\t<link rel="webchain" href="{node_url(base, 0, chain.hosts)}">',
+        *(
+            f'\t<link rel="webchain-nomination" href="{node_url(base, c, chain.hosts)}">'
+            for c in chain.children(i)
+        ),
+        f"\t<title>synthetic node {i}</title>",
+        f'\t<meta name="description" content="synthetic webchain node {i}">',
+    ]
+    if i == 0:
+        head.append(f'\t<meta name="webchain-nominations-limit" content="{chain.fanout}">')
+    if chain.has_feed(i):
+        head.append(
+            f'\t<link rel="alternate" type="application/rss+xml" href="{node_url(base, i, chain.hosts)}/feed.xml">'
+        )
+
+    page = (
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n'
+        + "\n".join(head)
+        + "\n</head>\n<body>\n\tsynthetic webchain document\n"
+    )
+    padding = max(0, chain.page_size - len(page) - len("</body>\n</html>\n"))
+    filler = "lorem ipsum dolor sit amet "
+    page += "\t<p>" + (filler * math.ceil(padding / len(filler)))[:padding] + "</p>\n"
+    return page + "</body>\n</html>\n"
+
+
+def render_feed(base: str, i: int) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0"><channel>'
+        f"<title>synthetic feed {i}</title>"
+        f"<link>{node_url(base, i)}</link>"
+        f"<description>feed of synthetic node {i}</description>"
+        "</channel></rss>\n"
+    )
+
+
+@dataclass
+class Reply:
+    status: int
+    headers: dict[str, str]
+    body: bytes = b""
+
+
+class SyntheticSite:
+    """
+    the responses of the synthetic webchain, whichever server sends them, and
+    the counters served at `/_stats`
+    """
+
+    def __init__(self, chain: SyntheticChain):
+        self.chain = chain
+        self.stats: Counter[str] = Counter()
+        self.rng = random.Random(chain.seed)
+
+    async def delay(self) -> None:
+        chain = self.chain
+        if chain.latency_median <= 0:
+            return
+        if chain.latency_sigma <= 0:
+            await asyncio.sleep(chain.latency_median)
+        else:
+            await asyncio.sleep(
+                self.rng.lognormvariate(math.log(chain.latency_median), chain.latency_sigma)
+            )
+
+    def compress(self, request_headers: Mapping[str, str], body: bytes, headers: dict) -> bytes:
+        accepted = {
+            coding.split(";")[0].strip()
+            for coding in request_headers.get("Accept-Encoding", "").split(",")
+        }
+        compression = self.chain.compression
+        codings = ("br", "zstd", "gzip") if compression == "any" else (compression,)
+        for coding in codings:
+            if coding in accepted and coding in COMPRESSORS:
+                headers["Content-Encoding"] = coding
+                return COMPRESSORS[coding](body)
+        return body
+
+    def respond(self, request_headers: Mapping[str, str], body: str, content_type: str) -> Reply:
+        headers = {"Content-Type": f"{content_type}; charset=utf-8"}
+        etag = '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+        if self.chain.caching in ("etag", "both"):
+            headers["ETag"] = etag
+            if request_headers.get("If-None-Match") == etag:
+                self.stats["not_modified"] += 1
+                return Reply(304, {"ETag": etag})
+        if self.chain.caching in ("max-age", "both"):
+            headers["Cache-Control"] = "max-age=3600"
+        data = self.compress(request_headers, body.encode(), headers)
+        self.stats["bytes"] += len(data)
+        return Reply(200, headers, data)
+
+    async def handle(self, path: str, request_headers: Mapping[str, str], base: str) -> Reply:
+        """the reply to a GET of `path`, on the site at `base`"""
+        chain = self.chain
+        if path == "/_stats":
+            body = json.dumps({"chain": asdict(chain), **self.stats}).encode()
+            return Reply(200, {"Content-Type": "application/json"}, body)
+
+        self.stats["requests"] += 1
+        if path == "/robots.txt":
+            self.stats["robots"] += 1
+            await self.delay()
+            return Reply(200, {"Content-Type": "text/plain; charset=utf-8"}, ROBOTS_TXT)
+        if match := FEED_PATH.fullmatch(path):
+            i = int(match[1])
+            self.stats["feeds"] += 1
+            await self.delay()
+            return self.respond(request_headers, render_feed(base, i), "application/rss+xml")
+        if match := NODE_PATH.fullmatch(path):
+            i = int(match[1] or 0)
+            self.stats["pages"] += 1
+            await self.delay()
+            if i >= chain.nodes:
+                self.stats["errors"] += 1
+                return Reply(404, {"Content-Type": "text/plain"}, b"404: Not Found")
+            if chain.is_error(i):
+                self.stats["errors"] += 1
+                return Reply(chain.error_status, {})
+            return self.respond(request_headers, render_page(chain, base, i), "text/html")
+        return Reply(404, {"Content-Type": "text/plain"}, b"404: Not Found")
+
+
+def make_app(site: SyntheticSite) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        reply = await site.handle(
+            request.path, request.headers, f"{request.scheme}://{request.host}"
+        )
+        return web.Response(status=reply.status, headers=reply.headers, body=reply.body)
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle)
+    return app
+
+
+def server_certificate(certificate: str) -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certificate)
+    return context
+
+
+async def run_servers(
+    chain: SyntheticChain, host: str, port: int, certificate: str | None, h2_port: int | None
+) -> None:
+    site = SyntheticSite(chain)
+    hosts = loopback_hosts(chain) if host == "127.0.0.1" and chain.hosts > 1 else [host]
+
+    runner = web.AppRunner(make_app(site), access_log=None)
+    await runner.setup()
+    http1 = None
+    if certificate is not None:
+        http1 = server_certificate(certificate)
+        http1.set_alpn_protocols(["http/1.1"])
+    for h in hosts:
+        await web.TCPSite(runner, h, port, ssl_context=http1).start()
+
+    if h2_port is not None:
+        from benchmarks.h2server import serve_h2
+
+        http2 = server_certificate(certificate)
+        http2.set_alpn_protocols(["h2"])
+        await asyncio.start_server(
+            lambda reader, writer: serve_h2(site, reader, writer), hosts, h2_port, ssl=http2
+        )
+    await asyncio.Future()
+
+
+def serve(
+    chain: SyntheticChain,
+    host: str,
+    port: int,
+    certificate: str | None = None,
+    h2_port: int | None = None,
+) -> None:
+    """
+    serve `chain` at `port`, over tls with `certificate`, a pem file with the
+    key and the certificate. with `h2_port` the same site is also served over
+    http/2 at that port, which needs a certificate since clients only
+    negotiate http/2 over tls.
+    """
+    asyncio.run(run_servers(chain, host, port, certificate, h2_port))
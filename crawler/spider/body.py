@@ -0,0 +1,182 @@
+import codecs
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Mapping, Protocol
+
+import aiohttp
+from lxml import etree
+
+from spider.contracts import RequestTiming
+from spider.metrics import metrics
+
+CHUNK_SIZE = 16 * 1024
+
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+
+class IncompleteBodyError(aiohttp.ClientPayloadError):
+    """
+    a truncated body was served from the cache, but the reader needs more of
+    it than was stored
+    """
+
+
+class BodyStream(Protocol):
+    def iter_chunked(self, n: int) -> AsyncIterator[bytes]: ...
+
+
+class StreamedResponse(Protocol):
+    headers: Mapping[str, str]
+
+    @property
+    def content(self) -> BodyStream: ...
+
+
+class StoredBody:
+    """
+    a body that is already in memory, read like aiohttp's StreamReader.
+    chunks are views into it, not copies.
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, n: int) -> AsyncIterator[memoryview]:
+        view = memoryview(self.body)
+        for i in range(0, len(self.body), n):
+            yield view[i : i + n]
+
+
+@dataclass
+class BodyLimit:
+    """
+    how much of a response body to read. `max_bytes` caps the download, and
+    with `until_head_end` it also stops as soon as the document's <head> is
+    closed, which is all of it the crawl needs unless members put their
+    webchain links in the <body>.
+    """
+
+    max_bytes: int | None = MAX_BODY_BYTES
+    until_head_end: bool = False
+
+    @classmethod
+    def from_env(cls, html: bool = True) -> "BodyLimit":
+        """the limit of the run. with `html` False the body isn't html, so only the cap applies."""
+        max_bytes = int(os.environ.get("WEBCHAIN_MAX_BODY_BYTES", str(MAX_BODY_BYTES)))
+        return cls(
+            max_bytes=max_bytes if max_bytes > 0 else None,
+            until_head_end=html and bool(os.environ.get("WEBCHAIN_HEAD_ONLY")),
+        )
+
+
+class HeadScanner:
+    """
+    incremental html parser that notices where the <head> ends: at its end
+    tag, or wherever the parser decides it was implicitly closed. a "</head>"
+    inside a script or a comment doesn't count.
+    """
+
+    def __init__(self):
+        self.parser = etree.HTMLPullParser(events=("start", "end"))
+        self.closed = False
+
+    def feed(self, chunk: bytes | memoryview) -> bool:
+        """feed the next chunk of the document, returning True once the head has been closed"""
+        if self.closed:
+            return True
+        self.parser.feed(bytes(chunk))
+        for event, element in self.parser.read_events():
+            if (event, element.tag) in (("end", "head"), ("start", "body")):
+                self.closed = True
+                break
+        return self.closed
+
+
+def charset(content_type: str) -> str | None:
+    """the charset parameter of a Content-Type header, if it names a known encoding"""
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            encoding = value.strip().strip('"')
+            try:
+                return codecs.lookup(encoding).name
+            except LookupError:
+                return None
+    return None
+
+
+def received(
+    response: StreamedResponse, wire: int, decoded: int, timing: RequestTiming | None
+) -> None:
+    """count the bytes of a body read from the network, before and after decompression"""
+    encoding = response.headers.get("Content-Encoding", "").strip().lower() or None
+    metrics.inc("webchain_bytes_received_total", wire)
+    metrics.inc("webchain_bytes_decoded_total", decoded)
+    metrics.inc("webchain_responses_by_encoding_total", encoding=encoding or "identity")
+    if timing is not None:
+        timing.bytes_received += wire
+        timing.bytes_decoded += decoded
+        timing.content_encoding = encoding
+
+
+@dataclass
+class Body:
+    data: bytes
+    truncated: str | None = None
+    """why the rest of the body wasn't read, "head" or "cap", or None if it was read in full"""
+    encoding: str | None = None
+    """the charset of the Content-Type header. the body isn't decoded, parsers do that."""
+
+
+async def read_body(
+    response: StreamedResponse,
+    limit: BodyLimit | None = None,
+    timing: RequestTiming | None = None,
+) -> Body:
+    """
+    read the body of `response` in chunks, stopping as soon as `limit` is
+    reached. the rest is never downloaded, since releasing a response that
+    wasn't read to the end closes its connection.
+
+    aiohttp only traces the chunks `read` receives, so the bytes read here
+    from the network are counted here, and added to `timing` if given.
+    """
+    stored = response.content if isinstance(response.content, StoredBody) else None
+    network = stored is None
+    if limit is None:
+        limit = BodyLimit(max_bytes=None)
+    scanner = HeadScanner() if limit.until_head_end else None
+    chunks: list[bytes | memoryview] = []
+    size = 0
+    decoded = 0
+    truncated = None
+
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        decoded += len(chunk)
+        # a body of exactly max_bytes is complete, it's only cut if there is more
+        if limit.max_bytes is not None and size + len(chunk) > limit.max_bytes:
+            chunks.append(chunk[: limit.max_bytes - size])
+            truncated = "cap"
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if scanner is not None and scanner.feed(chunk):
+            truncated = "head"
+            break
+
+    if network:
+        # aiohttp decompresses as it receives, and keeps count of the
+        # compressed bytes. older versions don't, and count as uncompressed.
+        wire = getattr(response.content, "total_raw_bytes", decoded)
+        received(response, wire, decoded, timing)
+
+    if truncated is None and getattr(response, "complete", True) is False:
+        # the cache only has the start of the body, and it wasn't enough
+        raise IncompleteBodyError("truncated body in cache")
+    if truncated is not None:
+        metrics.inc("webchain_bodies_truncated_total", reason=truncated)
+    encoding = charset(response.headers.get("Content-Type", ""))
+    if stored is not None and truncated is None:
+        # handed back as is, whatever size it is
+        return Body(stored.body, None, encoding)
+    return Body(b"".join(chunks), truncated, encoding)
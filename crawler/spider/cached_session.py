@@ -3,24 +3,31 @@ import time
 import logging
 import os
 import json
-from typing import Optional, Dict, Any, Union
+from typing import AsyncIterator, Optional, Dict, Any, Union
 import re
 from pathlib import Path
 
-import aiohttp
 import aiosqlite
+from multidict import CIMultiDict
 from contextlib import asynccontextmanager
 from typing import AsyncContextManager
 import platformdirs
 
+from spider.body import StoredBody, charset
+from spider.metrics import metrics
+from spider.transport import Response, Transport
+
 logger = logging.getLogger(__name__)
-db_path = Path(
-    os.environ.get(
-        "WEBCHAIN_CACHE_DB",
+
+
+def get_db_path() -> Path:
+    """location of the cache db, resolved (and its directory created) on first use"""
+    if "WEBCHAIN_CACHE_DB" in os.environ:
+        return Path(os.environ["WEBCHAIN_CACHE_DB"])
+    return (
         Path(platformdirs.user_cache_dir("webchain-spider", ensure_exists=True))
-        / "http-cache.sqlite",
+        / "http-cache.sqlite"
     )
-)
 
 
 logging.getLogger("aiosqlite").setLevel(logging.WARNING)  # noisy otherwise
@@ -71,42 +78,103 @@ def parse_cache_control(header: str) -> Dict[str, Optional[Union[int, bool]]]:
 
 
 class CachedResponse:
-    def __init__(self, status: int, headers: Dict[str, str], body: bytes, from_cache: bool = False):
+    def __init__(
+        self,
+        status: int,
+        headers: Dict[str, str],
+        body: bytes,
+        from_cache: bool = False,
+        not_modified: bool = False,
+        complete: bool = True,
+    ):
         self.status = status
-        self.headers = headers
+        # header names are case-insensitive, whatever case the server sent them in
+        self.headers = CIMultiDict(headers)
         self.body = body
         self.from_cache = from_cache
+        self.not_modified = not_modified
+        self.complete = complete
+        """false if only the start of the body was stored"""
+
+    @property
+    def content(self) -> StoredBody:
+        return StoredBody(self.body)
 
     async def text(self, encoding: Optional[str] = None) -> str:
         if encoding is None:
-            ct = self.headers.get("Content-Type", "")
-            if "charset=" in ct:
-                encoding = ct.split("charset=")[-1].strip()
-            else:
-                encoding = "utf-8"
+            encoding = charset(self.headers.get("Content-Type", "")) or "utf-8"
         return self.body.decode(encoding, errors="replace")
 
     async def read(self) -> bytes:
         return self.body
 
 
+class RecordingBody:
+    """passes the body of a response through, keeping what was read"""
+
+    def __init__(self, response: Response):
+        self.response = response
+        self.chunks: list[bytes] = []
+
+    async def iter_chunked(self, n: int) -> AsyncIterator[bytes]:
+        async for chunk in self.response.content.iter_chunked(n):
+            self.chunks.append(chunk)
+            yield chunk
+
+    @property
+    def complete(self) -> bool:
+        return self.response.content.at_eof()
+
+    @property
+    def total_raw_bytes(self) -> int:
+        return self.response.content.total_raw_bytes
+
+
+class NetworkResponse(CachedResponse):
+    """
+    a response still coming in from the network. its body is only read as far
+    as the caller reads it, which is what gets cached.
+    """
+
+    def __init__(self, response: Response, headers: CIMultiDict):
+        super().__init__(response.status, headers, b"")
+        self.stream = RecordingBody(response)
+
+    @property
+    def content(self) -> RecordingBody:
+        return self.stream
+
+    async def read(self) -> bytes:
+        async for _ in self.stream.iter_chunked(64 * 1024):
+            pass
+        return b"".join(self.stream.chunks)
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        self.body = await self.read()
+        return await super().text(encoding)
+
+
 class CachedClientSession:
     """
-    drop-in replacement for aiohttp.ClientSession
+    drop-in replacement for aiohttp.ClientSession, making requests with
+    `session`, any transport
 
     persists GET responses in sqlite, honoring Cache-Control and ETag headers
     """
 
-    def __init__(self, *args, **kwargs):
-        self.session = aiohttp.ClientSession(*args, **kwargs)
+    def __init__(self, session: Transport):
+        self.session = session
         self.db: Optional[aiosqlite.Connection] = None
-        self.db_path = db_path
+        self.db_path = get_db_path()
         self.lock = asyncio.Lock()
 
     async def ensure_db(self) -> None:
         if self.db is not None:
             return
         self.db = await aiosqlite.connect(self.db_path)
+        # the workers of a sharded crawl share the cache. in wal mode their
+        # reads don't block each other's writes.
+        await self.db.execute("PRAGMA journal_mode=WAL")
         await self.db.execute(
             """
             CREATE TABLE IF NOT EXISTS cache (
@@ -119,27 +187,36 @@ class CachedClientSession:
             )
             """
         )
+        async with self.db.execute("PRAGMA table_info(cache)") as cur:
+            columns = [row[1] async for row in cur]
+        if "complete" not in columns:
+            # caches from before bodies could be cut short only hold complete ones
+            await self.db.execute(
+                "ALTER TABLE cache ADD COLUMN complete INTEGER NOT NULL DEFAULT 1"
+            )
         await self.db.commit()
         logger.debug(f"using cache db at {self.db_path}")
 
     async def get_cached(self, url: str) -> Optional[Dict[str, Any]]:
         await self.ensure_db()
-        async with self.db.execute(
-            "SELECT body, headers, etag, expiry, cached_at FROM cache WHERE url = ?",
+        # read in one go, so that the read is over before another request's
+        # write runs on the connection, which another process may be waiting on
+        rows = await self.db.execute_fetchall(
+            "SELECT body, headers, etag, expiry, cached_at, complete FROM cache WHERE url = ?",
             (url,),
-        ) as cur:
-            row = await cur.fetchone()
-            if not row:
-                return None
-            body, headers_json, etag, expiry, cached_at = row
-            headers = json.loads(headers_json) if headers_json else {}
-            return {
-                "body": body,
-                "headers": headers,
-                "etag": etag,
-                "expiry": expiry,
-                "cached_at": cached_at,
-            }
+        )
+        if not rows:
+            return None
+        body, headers_json, etag, expiry, cached_at, complete = rows[0]
+        headers = CIMultiDict(json.loads(headers_json) if headers_json else {})
+        return {
+            "body": body,
+            "headers": headers,
+            "etag": etag,
+            "expiry": expiry,
+            "cached_at": cached_at,
+            "complete": bool(complete),
+        }
 
     async def save_cached(
         self,
@@ -148,13 +225,14 @@ class CachedClientSession:
         headers: Dict[str, str],
         etag: Optional[str],
         expiry: Optional[float],
+        complete: bool = True,
     ) -> None:
         await self.ensure_db()
-        headers_json = json.dumps(headers)
+        headers_json = json.dumps(dict(headers))
         cached_at = time.time()
         await self.db.execute(
-            "INSERT OR REPLACE INTO cache (url, body, headers, etag, expiry, cached_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (url, body, headers_json, etag, expiry, cached_at),
+            "INSERT OR REPLACE INTO cache (url, body, headers, etag, expiry, cached_at, complete) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, body, headers_json, etag, expiry, cached_at, complete),
         )
         await self.db.commit()
 
@@ -169,13 +247,23 @@ class CachedClientSession:
         headers = dict((kwargs.pop("headers") or {}) if kwargs.get("headers") is not None else {})
 
         async with self.lock:
-            entry = await self.get_cached(url)
+            # like a browser's hard reload, "no-cache" ignores the stored
+            # response altogether, rather than revalidating it
+            reload = "no-cache" in headers.get("Cache-Control", "")
+            entry = None if reload else await self.get_cached(url)
 
             # fresh cache hit: if max-age hasn't elapsed, serve the stored response
             # directly without hitting the network at all (RFC 9111 §4).
             if entry and entry["expiry"] is not None and time.time() < entry["expiry"]:
                 logger.debug(f"cache hit: {url}")
-                yield CachedResponse(200, entry["headers"], entry["body"], from_cache=True)
+                metrics.inc("webchain_cache_requests_total", result="hit")
+                yield CachedResponse(
+                    200,
+                    entry["headers"],
+                    entry["body"],
+                    from_cache=True,
+                    complete=entry["complete"],
+                )
                 return
 
             # conditional request: if the cached entry has a validator, attach it so
@@ -187,13 +275,12 @@ class CachedClientSession:
             elif entry and entry.get("headers", {}).get("Last-Modified"):
                 headers.setdefault("If-Modified-Since", entry.get("headers").get("Last-Modified"))
 
-        resp = await self.session.get(url, headers=headers, **kwargs)
-        try:
+        async with self.session.get(url, headers=headers, **kwargs) as resp:
             # 304 not modified: the server confirmed the cached copy is still current.
             # refresh the stored entry (updating expiry if a new max-age was given)
             # and return the cached body — no body was sent by the server.
             if resp.status == 304 and entry:
-                resp_headers = {k: v for k, v in resp.headers.items()}
+                resp_headers = CIMultiDict(resp.headers)
                 cc = parse_cache_control(resp_headers.get("Cache-Control", ""))
                 if cc.get("no-store"):
                     # server changed its mind — it no longer wants this response stored.
@@ -213,15 +300,34 @@ class CachedClientSession:
                         if cc.get("max-age") is not None:
                             expiry = time.time() + int(cc["max-age"])
                         await self.save_cached(
-                            url, entry["body"], entry["headers"], entry.get("etag"), expiry
+                            url,
+                            entry["body"],
+                            entry["headers"],
+                            entry.get("etag"),
+                            expiry,
+                            entry["complete"],
                         )
                 logger.debug(f"304 for {url}, returning cached body")
-                yield CachedResponse(200, entry["headers"], entry["body"], from_cache=True)
+                metrics.inc("webchain_cache_requests_total", result="revalidated")
+                yield CachedResponse(
+                    200,
+                    entry["headers"],
+                    entry["body"],
+                    from_cache=True,
+                    not_modified=True,
+                    complete=entry["complete"],
+                )
                 return
 
-            # 2xx response: the server sent a fresh body.
-            body = await resp.read()
-            resp_headers = {k: v for k, v in resp.headers.items()}
+            # 2xx response: the server sent a fresh body. the caller reads as
+            # much of it as it needs, and that much is cached, marked as
+            # incomplete if the caller stopped early.
+            resp_headers = CIMultiDict(resp.headers)
+            metrics.inc("webchain_cache_requests_total", result="miss")
+            response = NetworkResponse(resp, resp_headers)
+            yield response
+            body = b"".join(response.stream.chunks)
+            complete = response.stream.complete
 
             cc = parse_cache_control(resp_headers.get("Cache-Control", ""))
             etag = resp_headers.get("ETag")
@@ -245,20 +351,16 @@ class CachedClientSession:
                 or resp_headers.get("ETag")
                 or resp_headers.get("Last-Modified")
             )
-            if resp.status >= 200 and resp.status < 300:
+            if resp.status >= 200 and resp.status < 300 and (body or complete):
                 async with self.lock:
                     if not cc.get("no-store") and has_cache_header:
-                        await self.save_cached(url, body, resp_headers, etag, expiry)
-                    elif entry:
+                        await self.save_cached(url, body, resp_headers, etag, expiry, complete)
+                    elif entry or reload:
                         # server previously sent caching headers but no longer does.
                         # drop the stale entry so we don't keep sending validators
                         # (e.g. If-None-Match) to a server that will ignore them.
                         await self.delete_cached(url)
 
-            yield CachedResponse(resp.status, resp_headers, body)
-        finally:
-            await resp.release()
-
     async def close(self):
         await self.session.close()
         if self.db is not None:
@@ -0,0 +1,143 @@
+"""
+checkpoints of a crawl in progress, so that a crawl that was killed can be
+resumed instead of starting over from the seed.
+
+a checkpoint is a json lines file: a header with the seed, the start time and
+the recursion limit, then a line for every node as it completes. the
+frontier and the claimed urls aren't written down, they follow from the
+completed nodes: every child of a completed node was claimed, and the ones
+that didn't complete yet are the frontier. resuming replays the completed
+nodes in the order the traversal reaches them, without fetching them again,
+and crawls the rest.
+
+lines are buffered and written out every `interval` seconds, so a crash
+loses at most that much progress. a half written last line is ignored.
+"""
+
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+
+from spider.contracts import CrawledNode
+from spider.serialize import deserialize_node, safe_asdict
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+class CheckpointError(Exception):
+    pass
+
+
+@dataclass
+class Progress:
+    """what a checkpoint says a crawl had done"""
+
+    start: float
+    nominations_limit: int | None
+    nodes: dict[str, CrawledNode]
+
+
+class Checkpoint:
+    """the checkpoint file at `path`, read with `load` and written with `open` and `record`"""
+
+    def __init__(self, path: str | os.PathLike, interval: float = 5.0):
+        self.path = Path(path)
+        self.interval = interval
+        self.file: TextIO | None = None
+        self.flushed = time.monotonic()
+
+    @classmethod
+    def from_env(cls, path: str | os.PathLike) -> "Checkpoint":
+        return cls(path, float(os.environ.get("WEBCHAIN_CHECKPOINT_INTERVAL", "5")))
+
+    def load(self, seed_url: str, recursion_limit: int) -> Progress | None:
+        """
+        the progress of an earlier run crawling `seed_url` as deep as
+        `recursion_limit`, None if there is no checkpoint
+        """
+        try:
+            lines = self.path.read_text().splitlines()
+        except FileNotFoundError:
+            return None
+        if not lines:
+            return None
+
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            # the run died before it got anywhere
+            return None
+        if header.get("version") != VERSION:
+            raise CheckpointError(f"{self.path} is from another version of the crawler")
+        if header["seed"] != seed_url:
+            raise CheckpointError(f"{self.path} is a crawl of {header['seed']}, not {seed_url}")
+        if header["recursion_limit"] != recursion_limit:
+            # the nodes it has done were qualified for a traversal of another shape
+            raise CheckpointError(
+                f"{self.path} is a crawl with a recursion limit of {header['recursion_limit']},"
+                f" not {recursion_limit}"
+            )
+
+        progress = Progress(start=header["start"], nominations_limit=None, nodes={})
+        for i, line in enumerate(lines[1:], start=2):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                if i == len(lines):
+                    # cut short by the crash that ended the run
+                    break
+                raise CheckpointError(f"{self.path}:{i} is not valid json")
+            node = deserialize_node(entry["node"])
+            progress.nodes[node.at] = node
+            if node.depth == 0:
+                progress.nominations_limit = entry["nominations_limit"]
+        logger.info(f"resuming from {self.path} with {len(progress.nodes)} nodes done")
+        return progress
+
+    def open(self, seed_url: str, start: float, recursion_limit: int, resume: bool) -> None:
+        """start writing, after the progress of the run being resumed if `resume`"""
+        if resume:
+            with self.path.open("rb+") as f:
+                # drop a half written last line, the next one goes in its place
+                f.truncate(f.read().rfind(b"\n") + 1)
+            self.file = self.path.open("a")
+            return
+        self.file = self.path.open("w")
+        header = {
+            "version": VERSION,
+            "seed": seed_url,
+            "start": start,
+            "recursion_limit": recursion_limit,
+        }
+        self.file.write(json.dumps(header) + "\n")
+        self.flush()
+
+    def record(self, node: CrawledNode, nominations_limit: int) -> None:
+        """note down that `node` completed"""
+        if self.file is None:
+            return
+        entry = {"node": safe_asdict(node), "nominations_limit": nominations_limit}
+        self.file.write(json.dumps(entry) + "\n")
+        if time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.flushed = time.monotonic()
+
+    def close(self, done: bool = False) -> None:
+        """stop writing. a checkpoint of a crawl that is `done` has no use and is removed."""
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+        if done:
+            self.path.unlink(missing_ok=True)
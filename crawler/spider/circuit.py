@@ -0,0 +1,126 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable
+from urllib.parse import urlparse
+
+import tenacity
+
+from spider.error import HostUnavailableError
+from spider.metrics import metrics
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def backoff() -> tenacity.wait.wait_base:
+    """
+    exponential backoff between attempts with full jitter, so that requests
+    that failed together don't retry together, capped at
+    WEBCHAIN_RETRY_MAX_WAIT seconds
+    """
+    return tenacity.wait_random_exponential(
+        multiplier=0.5, max=float(os.environ.get("WEBCHAIN_RETRY_MAX_WAIT", "10"))
+    )
+
+
+@dataclass
+class _Circuit:
+    failures: int = 0
+    """consecutive failed requests"""
+    opened_at: float | None = None
+    probing: bool = False
+    """a request is testing whether the host recovered"""
+
+
+class CircuitBreaker:
+    """
+    stops sending requests to hosts that keep failing.
+
+    after `threshold` consecutive failed requests to a host its circuit opens,
+    and requests to it fail fast with HostUnavailableError for `cooldown`
+    seconds. after that a single request is let through: if it succeeds the
+    circuit closes again, if it fails it stays open for another cooldown.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 5,
+        cooldown: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.circuits: dict[str, _Circuit] = {}
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            threshold=int(os.environ.get("WEBCHAIN_BREAKER_THRESHOLD", "5")),
+            cooldown=float(os.environ.get("WEBCHAIN_BREAKER_COOLDOWN", "60")),
+        )
+
+    def before_request(self, url: str) -> bool:
+        """
+        raise HostUnavailableError if requests to the host of `url` should fail
+        fast, true if the request is the probe and has to be recorded or released
+        """
+        if self.threshold <= 0:
+            return False
+        host = host_of(url)
+        circuit = self.circuits.get(host)
+        if circuit is None or circuit.opened_at is None:
+            return False
+        if circuit.probing or self.clock() - circuit.opened_at < self.cooldown:
+            metrics.inc("webchain_breaker_rejections_total")
+            raise HostUnavailableError(host, circuit.failures)
+        circuit.probing = True
+        return True
+
+    def release(self, url: str) -> None:
+        """let another request probe the host of `url`, the probe ended without an outcome"""
+        circuit = self.circuits.get(host_of(url))
+        if circuit is not None:
+            circuit.probing = False
+
+    def record(self, url: str, failed: bool) -> None:
+        """record the outcome of a request. any answer from the host counts as a success."""
+        if not failed:
+            self.circuits.pop(host_of(url), None)
+            return
+        if self.threshold <= 0:
+            return
+        circuit = self.circuits.setdefault(host_of(url), _Circuit())
+        circuit.failures += 1
+        if circuit.probing or circuit.failures >= self.threshold:
+            if circuit.opened_at is None:
+                metrics.inc("webchain_breaker_opened_total")
+            circuit.opened_at = self.clock()
+            circuit.probing = False
+
+
+class RetryBudget:
+    """
+    retries allowed across every request of a run, so that a run with many
+    failing nodes doesn't spend its time retrying them all. None is unlimited.
+    """
+
+    def __init__(self, retries: int | None = None):
+        self.remaining = retries
+
+    @classmethod
+    def from_env(cls) -> "RetryBudget":
+        retries = os.environ.get("WEBCHAIN_RETRY_BUDGET")
+        return cls(int(retries) if retries else None)
+
+    def stop(self, retry_state: tenacity.RetryCallState) -> bool:
+        """tenacity stop condition, which takes a retry out of the budget if one is left"""
+        if self.remaining is None:
+            return False
+        if self.remaining <= 0:
+            metrics.inc("webchain_retry_budget_exhausted_total")
+            return True
+        self.remaining -= 1
+        return False
@@ -1,16 +1,18 @@
-import asyncio
 import io
 import os
 import sys
+from contextlib import ExitStack, contextmanager
 from functools import wraps
 import logging
 import click
 
-from spider.crawl import crawl
+# only modules needed by every command are imported here. the network and ui
+# stacks (aiohttp, bs4, lxml, feedparser, urwid) are imported by the commands
+# that use them, so that offline commands like `patch` start quickly
 from spider.state import patch_state
-from spider.metadata import enrich_with_metadata
 from spider.serialize import deserialize, serialize
-from spider.tree import TreeCrawlUI, print_tree
+from spider.metrics import metrics
+from spider.trace import TraceRecorder
 
 
 def asyncio_click(func):
@@ -18,18 +20,62 @@ def asyncio_click(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
+        import asyncio
+
         return asyncio.run(func(*args, **kwargs))
 
     return wrapper
 
 
+@contextmanager
+def metrics_written_to(path: str):
+    """write the run's metrics to `path` when the command exits, however it exits"""
+    success = False
+    try:
+        yield
+        success = True
+    except SystemExit as e:
+        success = e.code in (None, 0)
+        raise
+    finally:
+        metrics.finish(click.get_current_context().info_name, success)
+        metrics.write(path)
+
+
 def common_options(func):
     @click.option("--verbose", "-v", is_flag=True, default=False, help="enable verbose logging")
+    @click.option(
+        "--metrics-out",
+        type=click.Path(dir_okay=False, writable=True),
+        default=None,
+        help="write run metrics to this file when done; json if it ends in .json, "
+        "otherwise the openmetrics text format for the node_exporter textfile collector",
+    )
+    @click.option(
+        "--profile",
+        "profile_prefix",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="sample the run's stacks and allocations, writing PREFIX.collapsed "
+        "(for flamegraph.pl or speedscope) and PREFIX.alloc.txt",
+    )
     @wraps(func)
-    def wrapper(*args, verbose: bool, **kwargs):
+    def wrapper(
+        *args, verbose: bool, metrics_out: str | None, profile_prefix: str | None, **kwargs
+    ):
         if verbose:
             logging.getLogger().setLevel(logging.DEBUG)
-        return func(*args, **kwargs)
+
+        with ExitStack() as stack:
+            if profile_prefix is not None:
+                from spider.profiling import profiled
+
+                stack.enter_context(profiled(profile_prefix))
+            if metrics_out is not None:
+                # for commands that also write them as they go
+                click.get_current_context().meta["metrics_out"] = metrics_out
+                stack.enter_context(metrics_written_to(metrics_out))
+            return func(*args, **kwargs)
 
     return wrapper
 
@@ -38,6 +84,38 @@ def network_options(func):
     @click.option(
         "--attempts", default=5, show_default=True, type=int, help="number of retry attempts"
     )
+    @click.option(
+        "--retry-budget",
+        type=click.IntRange(min=0),
+        default=None,
+        help="retries allowed across the whole run  [default: unlimited]",
+    )
+    @click.option(
+        "--breaker-threshold",
+        type=int,
+        default=None,
+        help="consecutive failures after which a host is skipped for a while, 0 to never skip"
+        "  [default: 5]",
+    )
+    @click.option(
+        "--max-body-bytes",
+        type=click.IntRange(min=0),
+        default=None,
+        help="stop downloading a response after this many bytes, 0 for no limit"
+        "  [default: 4194304]",
+    )
+    @click.option(
+        "--head-only",
+        is_flag=True,
+        default=False,
+        help="stop downloading a page once its <head> is closed, ignoring links in the <body>",
+    )
+    @click.option(
+        "--transport",
+        type=click.Choice(["aiohttp", "httpx"]),
+        default=None,
+        help="http client to make requests with, httpx speaks http/2  [default: aiohttp]",
+    )
     @click.option(
         "--no-cache", is_flag=True, default=False, help="disable disk cache from previous requests"
     )
@@ -47,19 +125,78 @@ def network_options(func):
     @click.option(
         "--robots-txt/--no-robots-txt", default=True, help="respect robots.txt files... or don't!"
     )
+    @click.option(
+        "--record",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="record every response, including errors, to a sqlite capture",
+    )
+    @click.option(
+        "--replay",
+        type=click.Path(dir_okay=False, exists=True),
+        default=None,
+        help="serve every request from a capture made with --record, without touching the network",
+    )
+    @click.option(
+        "--replay-latency",
+        is_flag=True,
+        default=False,
+        help="wait for the recorded response time when replaying",
+    )
     @wraps(func)
-    def wrapper(*args, attempts: int, no_cache: bool, v4: bool, **kwargs):
+    def wrapper(
+        *args,
+        attempts: int,
+        retry_budget: int | None,
+        breaker_threshold: int | None,
+        max_body_bytes: int | None,
+        head_only: bool,
+        transport: str | None,
+        no_cache: bool,
+        v4: bool,
+        record: str | None,
+        replay: str | None,
+        replay_latency: bool,
+        **kwargs,
+    ):
+        if record and replay:
+            raise click.UsageError("--record and --replay are mutually exclusive")
         if "WEBCHAIN_NETWORK_ATTEMPTS" not in os.environ:
             os.environ["WEBCHAIN_NETWORK_ATTEMPTS"] = str(attempts)
+        if retry_budget is not None:
+            os.environ["WEBCHAIN_RETRY_BUDGET"] = str(retry_budget)
+        if breaker_threshold is not None:
+            os.environ["WEBCHAIN_BREAKER_THRESHOLD"] = str(breaker_threshold)
+        if max_body_bytes is not None:
+            os.environ["WEBCHAIN_MAX_BODY_BYTES"] = str(max_body_bytes)
+        if head_only:
+            os.environ["WEBCHAIN_HEAD_ONLY"] = "1"
+        if transport is not None:
+            os.environ["WEBCHAIN_TRANSPORT"] = transport
         if no_cache:
             os.environ["WEBCHAIN_NO_CACHE"] = "1"
         if v4:
             os.environ["WEBCHAIN_IPV4"] = "1"
+        if record:
+            os.environ["WEBCHAIN_RECORD"] = record
+        if replay:
+            os.environ["WEBCHAIN_REPLAY"] = replay
+        if replay_latency:
+            os.environ["WEBCHAIN_REPLAY_LATENCY"] = "1"
         return func(*args, **kwargs)
 
     return wrapper
 
 
+trace_option = click.option(
+    "--trace",
+    "trace_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write a timeline of the crawl as a chrome trace event file, for ui.perfetto.dev",
+)
+
+
 @click.group()
 def webchain():
     log_level = logging._nameToLevel.get(os.environ.get("LOG_LEVEL", "").upper(), logging.INFO)
@@ -67,7 +204,7 @@ def webchain():
 
 
 @webchain.command
-@click.argument("url", required=True)
+@click.argument("url", required=False)
 @click.option(
     "--print",
     "print_output",
@@ -75,78 +212,347 @@ def webchain():
     default=False,
     help="print tree to stdout instead of paging",
 )
+@click.option(
+    "--refresh-rate",
+    type=click.FloatRange(min=0),
+    default=30,
+    show_default=True,
+    help="redraws per second at most while crawling, 0 for no limit",
+)
+@click.option(
+    "--from",
+    "saved",
+    type=click.File(),
+    default=None,
+    help="show a saved crawl, such as current.json, instead of crawling URL",
+)
+@trace_option
 @common_options
 @network_options
-def tree(url: str, robots_txt: bool, print_output: bool):
+def tree(
+    url: str | None,
+    robots_txt: bool,
+    print_output: bool,
+    refresh_rate: float,
+    saved: io.TextIOWrapper | None,
+    trace_path: str | None,
+):
+    if (url is None) == (saved is None):
+        raise click.UsageError("give either URL or --from")
+
     logging.getLogger().setLevel(logging.WARNING)
 
-    ui = TreeCrawlUI(url, robots_txt, exit_when_done=print_output)
-    ui.run()
+    if saved is not None:
+        with metrics.phase("parse"):
+            try:
+                response = deserialize(saved.read())
+            except Exception as e:
+                print(f"{saved.name} not valid crawl json: {e}")
+                sys.exit(1)
+
+        if print_output:
+            from spider.render import render_response
+
+            render_response(response)
+        else:
+            from spider.tree import TreeCrawlUI
 
-    if ui.error:
-        print(f"error: {ui.error}")
+            TreeCrawlUI(
+                response.nodes[0].at if response.nodes else saved.name,
+                robots_txt,
+                response=response,
+            ).run()
+        return
+
+    trace = TraceRecorder() if trace_path else None
+    try:
+        with metrics.phase("crawl"):
+            if print_output:
+                error = print_tree(url, robots_txt, trace)
+            else:
+                from spider.tree import TreeCrawlUI
+
+                ui = TreeCrawlUI(url, robots_txt, trace=trace, refresh_rate=refresh_rate)
+                ui.run()
+                error = ui.error
+    finally:
+        if trace is not None:
+            trace.write(trace_path)
+
+    if error:
+        print(f"error: {error}")
         sys.exit(1)
 
-    if print_output:
-        print_tree(ui)
+
+def print_tree(url: str, robots_txt: bool, trace: TraceRecorder | None) -> Exception | None:
+    """crawl, streaming the tree to stdout without the terminal ui"""
+    import asyncio
+
+    from spider.crawl import crawl
+    from spider.render import TreeRenderer
+    from spider.trace import combine_callbacks
+
+    renderer = TreeRenderer()
+    callbacks = renderer.callbacks()
+    if trace is not None:
+        callbacks = combine_callbacks(callbacks, trace.callbacks())
+    try:
+        asyncio.run(crawl(url, check_robots_txt=robots_txt, **callbacks))
+    except Exception as e:
+        return e
+    renderer.finish()
+    return None
 
 
 @webchain.command
 @click.argument("url", required=True)
+@click.option(
+    "--previous",
+    "previous_file",
+    type=click.File(),
+    default=None,
+    help="previous crawl; its nodes are fetched up front instead of level by level",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="split the crawl by host over this many worker processes",
+)
+@click.option(
+    "--listen",
+    metavar="HOST:PORT",
+    default=None,
+    help="with --workers, start no workers and wait for them to connect here instead,"
+    " with `webchain worker HOST:PORT` and the same WEBCHAIN_COORDINATOR_TOKEN",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint_path",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="note down the progress of the crawl in this file, removed once the crawl is done",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="continue the crawl in --checkpoint where it stopped, if there is one",
+)
+@trace_option
 @common_options
 @network_options
 @asyncio_click
-async def json(url: str, robots_txt: bool):
+async def json(
+    url: str,
+    robots_txt: bool,
+    previous_file: io.TextIOWrapper | None,
+    workers: int | None,
+    listen: str | None,
+    checkpoint_path: str | None,
+    resume: bool,
+    trace_path: str | None,
+):
+    if listen is not None and workers is None:
+        raise click.UsageError("--listen needs --workers")
+    if listen is not None and not os.environ.get("WEBCHAIN_COORDINATOR_TOKEN"):
+        raise click.UsageError("--listen needs WEBCHAIN_COORDINATOR_TOKEN set")
+    if resume and checkpoint_path is None:
+        raise click.UsageError("--resume needs --checkpoint")
+    from spider.checkpoint import Checkpoint
+
+    checkpoint = Checkpoint.from_env(checkpoint_path) if checkpoint_path else None
+
+    previous = None
+    if previous_file is not None:
+        with metrics.phase("parse"):
+            try:
+                previous = deserialize(previous_file.read())
+            except Exception as e:
+                print(f"{previous_file.name} not valid crawl json: {e}")
+                sys.exit(1)
+
+    trace = TraceRecorder() if trace_path else None
     try:
-        crawled = await crawl(url, check_robots_txt=robots_txt)
+        with metrics.phase("crawl"):
+            if workers is not None:
+                from spider.shard import crawl_sharded
+
+                # only the nodes are traced, the requests happen in the workers
+                crawled = await crawl_sharded(
+                    url,
+                    workers,
+                    check_robots_txt=robots_txt,
+                    previous=previous,
+                    listen=listen,
+                    token=os.environ.get("WEBCHAIN_COORDINATOR_TOKEN"),
+                    checkpoint=checkpoint,
+                    resume=resume,
+                    on_node_start=trace.on_node_start if trace else None,
+                    on_node_complete=trace.on_node_complete if trace else None,
+                )
+            else:
+                from spider.crawl import crawl
+
+                crawled = await crawl(
+                    url,
+                    check_robots_txt=robots_txt,
+                    previous=previous,
+                    checkpoint=checkpoint,
+                    resume=resume,
+                    **(trace.callbacks() if trace else {}),
+                )
     except Exception as e:
         print(f"error: {e}")
         sys.exit(1)
+    finally:
+        if trace is not None:
+            trace.write(trace_path)
 
-    serialized = serialize(crawled, indent="\t")
+    with metrics.phase("serialize"):
+        serialized = serialize(crawled, indent="\t")
     print(serialized)
 
 
+@webchain.command
+@click.argument("address", required=True, metavar="HOST:PORT")
+@common_options
+@network_options
+@asyncio_click
+async def worker(address: str, robots_txt: bool) -> None:
+    """crawl for `webchain json --workers N --listen HOST:PORT` running elsewhere"""
+    from spider.shard import run_worker
+
+    ctx = click.get_current_context()
+    for name, flag in (("robots_txt", "--robots-txt"), ("retry_budget", "--retry-budget")):
+        if ctx.get_parameter_source(name) is click.core.ParameterSource.COMMANDLINE:
+            raise click.UsageError(f"{flag} is up to the coordinator, pass it to `webchain json`")
+    token = os.environ.get("WEBCHAIN_COORDINATOR_TOKEN")
+    if not token:
+        raise click.UsageError("WEBCHAIN_COORDINATOR_TOKEN must be set")
+    await run_worker(address, token)
+
+
 @webchain.command
 @click.argument("path1", required=True, type=click.File())
 @click.argument("path2", required=True, type=click.File())
 @common_options
 def patch(path1: io.TextIOWrapper, path2: io.TextIOWrapper) -> None:
-    try:
-        res1 = deserialize(path1.read())
-    except Exception as e:
-        print(f"{path1.name} not valid crawl json: {e}")
-        sys.exit(1)
+    with metrics.phase("parse"):
+        try:
+            res1 = deserialize(path1.read())
+        except Exception as e:
+            print(f"{path1.name} not valid crawl json: {e}")
+            sys.exit(1)
 
-    try:
-        res2 = deserialize(path2.read())
-    except Exception as e:
-        print(f"{path2.name} not valid crawl json: {e}")
-        sys.exit(1)
+        try:
+            res2 = deserialize(path2.read())
+        except Exception as e:
+            print(f"{path2.name} not valid crawl json: {e}")
+            sys.exit(1)
 
-    patched_crawl = patch_state(res1, res2)
+    with metrics.phase("patch"):
+        patched_crawl = patch_state(res1, res2)
 
     if not patched_crawl:
         # no changes
         print("no changes detected")
         sys.exit(1)
 
-    ret = serialize(patched_crawl, indent="\t")
+    with metrics.phase("serialize"):
+        ret = serialize(patched_crawl, indent="\t")
     print(ret)
 
 
 @webchain.command
 @click.argument("file", required=True, type=click.File())
+@click.option(
+    "--previous",
+    "previous_file",
+    type=click.File(),
+    default=None,
+    help="previously enriched crawl; metadata of unchanged pages is reused from it",
+)
 @common_options
 @network_options
 @asyncio_click
-async def enrich(file: io.TextIOWrapper, robots_txt: bool) -> None:
-    try:
-        webchain = deserialize(file.read())
-    except Exception as e:
-        print(f"error: {e}")
-        sys.exit(1)
+async def enrich(
+    file: io.TextIOWrapper, robots_txt: bool, previous_file: io.TextIOWrapper | None
+) -> None:
+    from spider.metadata import enrich_with_metadata
+
+    with metrics.phase("parse"):
+        try:
+            webchain = deserialize(file.read())
+        except Exception as e:
+            print(f"error: {e}")
+            sys.exit(1)
+
+        previous = None
+        if previous_file is not None:
+            try:
+                previous = deserialize(previous_file.read())
+            except Exception as e:
+                print(f"{previous_file.name} not valid crawl json: {e}")
+                sys.exit(1)
 
-    enriched = await enrich_with_metadata(webchain, check_robots_txt=robots_txt)
-    serialized = serialize(enriched, indent="\t")
+    with metrics.phase("enrich"):
+        enriched = await enrich_with_metadata(
+            webchain, check_robots_txt=robots_txt, previous=previous
+        )
+    with metrics.phase("serialize"):
+        serialized = serialize(enriched, indent="\t")
     print(serialized)
+
+
+@webchain.command
+@click.argument("url", required=True)
+@click.option(
+    "--out",
+    type=click.Path(dir_okay=False, writable=True),
+    required=True,
+    help="enriched crawl to keep up to date, patched like `webchain patch` and only"
+    " rewritten when it changes",
+)
+@click.option(
+    "--heartbeat",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="write the start and end of every crawl to this file, whether anything changed or not",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0),
+    default=600,
+    show_default=True,
+    help="seconds from the start of one crawl to the start of the next",
+)
+@common_options
+@network_options
+@asyncio_click
+async def watch(
+    url: str, robots_txt: bool, out: str, heartbeat: str | None, interval: float
+) -> None:
+    """
+    recrawl every --interval seconds, keeping the session, caches and current
+    crawl in memory in between. SIGHUP reopens them and rereads --out, SIGTERM
+    stops after the crawl in progress.
+    """
+    from spider.watch import Watch
+
+    watcher = Watch(
+        url,
+        out,
+        interval,
+        heartbeat=heartbeat,
+        check_robots_txt=robots_txt,
+        metrics_out=click.get_current_context().meta.get("metrics_out"),
+    )
+    with metrics.phase("parse"):
+        try:
+            watcher.load()
+        except Exception as e:
+            print(f"{out} not valid crawl json: {e}")
+            sys.exit(1)
+    async with watcher:
+        await watcher.run()
@@ -17,6 +17,37 @@ class SyndicationFeed:
     published: str | None = None
     updated: str | None = None
     version: str | None = None
+    content_hash: str | None = None
+    """fingerprint of the fetched feed document"""
+
+
+@dataclass
+class RequestTiming:
+    """where the time spent on a node went. durations are in seconds."""
+
+    robots: float | None = None
+    """checking robots.txt"""
+    queued: float | None = None
+    """waiting for a free connection in the pool"""
+    dns: float | None = None
+    connect: float | None = None
+    """establishing a connection, including the tls handshake for https"""
+    ttfb: float | None = None
+    """from sending the request until response headers arrived"""
+    transfer: float | None = None
+    """reading the response body"""
+    parse: float | None = None
+    bytes_received: int = 0
+    """body bytes as they came over the network, compressed if the server compressed them"""
+    bytes_decoded: int = 0
+    """body bytes after decompression"""
+    content_encoding: str | None = None
+    """the content coding the body was compressed with, None if it wasn't"""
+    attempts: int = 0
+    cache_hit: bool = False
+    """served from the local cache, either fresh or after revalidation"""
+    not_modified: bool = False
+    """the server answered 304 to a conditional request"""
 
 
 @dataclass
@@ -36,6 +67,22 @@ class CrawledNode:
     last_updated: str | None = None
     html_metadata: HtmlMetadata | None = None
     syndication_feeds: list[SyndicationFeed] = field(default_factory=list)
+    content_hash: str | None = None
+    """fingerprint of the fetched page body, used to skip re-extracting unchanged pages"""
+    timing: RequestTiming | None = None
+
+
+@dataclass
+class DocumentExtraction:
+    """everything extracted from a single html document"""
+
+    webchain_href: str | None
+    nominations: list[str]
+    """valid nomination hrefs, in document order, regardless of webchain"""
+    nominations_limit: int | None
+    html_metadata: HtmlMetadata | None
+    feed_hrefs: list[str] = field(default_factory=list)
+    """hrefs of rss and atom feeds, as written in the document"""
 
 
 class OnNodeStart(Protocol):
@@ -54,6 +101,12 @@ class OnCacheHit(Protocol):
     def __call__(self, url: str) -> None: ...
 
 
+class OnSpan(Protocol):
+    """a named step of processing `at` ran from `start` to `end`, in perf_counter() seconds"""
+
+    def __call__(self, at: str, name: str, start: float, end: float) -> None: ...
+
+
 @dataclass
 class CrawlResponse:
     nodes: list[CrawledNode]
@@ -1,20 +1,41 @@
+import hashlib
 import itertools
 import sys
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from time import time
+from time import perf_counter, time
 from logging import getLogger
+from typing import AsyncIterator
 from aiohttp import ClientSession
 
-from bs4 import BeautifulSoup, Tag
-from bs4.element import PageElement
 from ordered_set import OrderedSet
 
-from spider.error import RobotsExclusionError
+from spider.body import Body, BodyLimit
+from spider.checkpoint import Checkpoint
+from spider.circuit import CircuitBreaker, RetryBudget
+from spider.dead_hosts import DeadHosts, get_dead_hosts
+from spider.error import DeadHostError, RobotsExclusionError
+from spider.prefetch import Prefetcher
 from spider.http import UA, get_session, get
-from spider.contracts import CrawlResponse, CrawledNode, OnNodeStart, OnNodeComplete, OnRetry, OnCacheHit
-from spider.robots import allowed_by_robots_txt
+from spider.contracts import (
+    CrawlResponse,
+    CrawledNode,
+    DocumentExtraction,
+    OnNodeStart,
+    OnNodeComplete,
+    OnRetry,
+    OnCacheHit,
+    OnSpan,
+    RequestTiming,
+)
+from spider.robots import RobotsChecker
+from spider.extract import extract_document, nominations_for_seed
+from spider.extraction_cache import ExtractionCache, get_extraction_cache
+from spider.timing import format_timing_summary, summarize_timings
+from spider.metrics import metrics
 
 logger = getLogger(__name__)
 
@@ -23,104 +44,204 @@ class EmptyPageError(Exception):
     pass
 
 
-def validate_uri(x: str) -> bool:
-    """check if a string is a valid uri with both scheme (http/https) and netloc (domain)."""
-    try:
-        result = urlparse(x)
-        return all([result.scheme, result.netloc])
-    except AttributeError:
-        return False
+@dataclass
+class Fetched:
+    """the outcome of fetching a node's page"""
 
+    timing: RequestTiming
+    body: Body | None = None
+    index_error: Exception | None = None
+    fetch_duration: float | None = None
+    content_hash: str | None = None
 
-def is_valid_nomination(tag: Tag) -> bool:
-    if not isinstance(tag, Tag) or tag.name != "link":
-        return False
 
-    rel = tag.get("rel")
-    assert isinstance(rel, str)  # is always a string with multi_valued_attributes=None
-
-    if rel != "webchain-nomination":
-        return False
-
-    href = tag.get("href")
-
-    if isinstance(href, str) and validate_uri(href):
-        return True
-
-    return False
-
-
-def get_raw_nominations(html: str, seed: str) -> OrderedSet[str]:
+def get_raw_nominations(html: str | bytes, seed: str) -> OrderedSet[str]:
     """
     extract valid webchain nominations from html
     """
-    soup = BeautifulSoup(html, "lxml", multi_valued_attributes=None)
-
-    hrefs: OrderedSet[str] = OrderedSet([])
-
-    # look for the webchain declaration link in the html. we're permissive, so
-    # we search the entire document, not just the head.
-    webchain_tag = soup.find(name="link", attrs={"rel": "webchain"})
-    webchain_href = str(webchain_tag.get("href")) if isinstance(webchain_tag, Tag) else None
-
-    def normalize_url(url: str) -> str:
-        return url.rstrip("/")
-
-    if (
-        webchain_tag is None
-        or not isinstance(webchain_tag, Tag)
-        or webchain_href is None
-        or normalize_url(webchain_href) != normalize_url(seed)
-    ):
-        return hrefs
-
-    nominations = soup.find_all(is_valid_nomination)
-
-    for tag in nominations:
-        if not isinstance(tag, Tag):
-            continue
-        href = tag.get("href")
-        if isinstance(href, str):
-            hrefs.add(href)
-
-    return hrefs
+    return nominations_for_seed(extract_document(html), seed)
 
 
 def without_trailing_slash(url: str) -> str:
     return url.rstrip("/")
 
 
-def handle_meta_element(node: Tag | PageElement | None) -> str | None:
-    if isinstance(node, Tag) and node.get("content"):
-        content = str(node.get("content"))
-        return content.replace("\n", " ").strip()
-
-    return None
-
+def to_iso_timestamp(x: float) -> str:
+    return datetime.fromtimestamp(x, tz=timezone.utc).isoformat()
 
-def get_nominations_limit(html: str, default: int | None = None) -> int | None:
-    soup = BeautifulSoup(html, "lxml", multi_valued_attributes=None)
 
-    if not soup.head:
-        return default
+def content_fingerprint(body: str | bytes) -> str:
+    """stable fingerprint of a fetched document, used to detect unchanged pages"""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha256(body).hexdigest()
 
-    limit_element = soup.find("meta", attrs={"name": "webchain-nominations-limit"})
-    limit_str = handle_meta_element(limit_element)
 
-    if limit_str is None:
-        return default
+def node_nominations(doc: DocumentExtraction, seed_url: str) -> OrderedSet[str]:
+    """the nominations of a node's page, as node urls"""
+    return OrderedSet(map(without_trailing_slash, nominations_for_seed(doc, seed_url)))
 
-    try:
-        limit = int(limit_str)
-        if limit < 0:
-            return default
-        return limit
-    except ValueError:
-        return default
 
+def qualify(
+    nominations: OrderedSet[str], seen: set[str], nominations_limit: int
+) -> tuple[list[str], list[str]]:
+    """
+    split a node's nominations into its children, the ones not yet in the
+    graph up to the nominations limit, and the unqualified rest
+    """
+    fresh = list(nominations.difference(seen))
+    extra = fresh[nominations_limit:]
+    return fresh[:nominations_limit], list(nominations.intersection(seen).union(extra))
+
+
+def crawled_node(
+    at: str,
+    parent: str | None,
+    depth: int,
+    fetched: Fetched,
+    children: list[str],
+    unqualified: list[str],
+) -> CrawledNode:
+    node = CrawledNode(
+        at=at,
+        children=children,
+        unqualified=unqualified,
+        parent=parent,
+        depth=depth,
+        indexed=fetched.index_error is None,
+        index_error=fetched.index_error,
+        robots_ok=(not isinstance(fetched.index_error, RobotsExclusionError)),
+        fetch_duration=fetched.fetch_duration,
+        content_hash=fetched.content_hash,
+        timing=fetched.timing,
+    )
+    metrics.inc("webchain_nodes_total", indexed=str(node.indexed).lower())
+    if node.index_error is not None:
+        metrics.inc("webchain_errors_total", phase="crawl", error=type(node.index_error).__name__)
+    return node
+
+
+@dataclass
+class Resources:
+    """what a crawl keeps open while it runs, and a long running crawler between runs"""
+
+    session: ClientSession
+    extraction_cache: ExtractionCache
+    dead_hosts: DeadHosts
+    robots: RobotsChecker | None = None
+
+
+@asynccontextmanager
+async def open_resources(check_robots_txt: bool = False) -> AsyncIterator[Resources]:
+    async with (
+        get_session() as session,
+        get_extraction_cache() as extraction_cache,
+        get_dead_hosts() as dead_hosts,
+    ):
+        # robots.txt is fetched once per site, alongside the first page on it
+        robots = RobotsChecker(session, user_agent=UA) if check_robots_txt else None
+        try:
+            yield Resources(session, extraction_cache, dead_hosts, robots)
+        finally:
+            if robots is not None:
+                await robots.close()
+
+
+@dataclass
+class Fetcher:
+    """fetches and parses the pages of a crawl, sharing the run's limits between them"""
+
+    session: ClientSession
+    extraction_cache: ExtractionCache
+    dead_hosts: DeadHosts
+    robots: RobotsChecker | None = None
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker.from_env)
+    retry_budget: RetryBudget = field(default_factory=RetryBudget.from_env)
+    body_limit: BodyLimit = field(default_factory=BodyLimit.from_env)
+
+    async def fetch(
+        self,
+        url: str,
+        parent: str | None,
+        depth: int,
+        on_retry: OnRetry | None = None,
+        on_cache_hit: OnCacheHit | None = None,
+        on_span: OnSpan | None = None,
+    ) -> Fetched:
+        """
+        GET `url` and, with `robots`, check robots.txt at the same time. the
+        page is discarded if robots.txt turns out to disallow it.
+        """
+        at = without_trailing_slash(url)
+        fetched = Fetched(timing=RequestTiming())
+        timing = fetched.timing
+        robots = self.robots
+
+        # the seed is always tried, the crawl can't do without it
+        dead = await self.dead_hosts.check(url) if depth > 0 else None
+        if dead is not None:
+            logger.info(f"skipping {url}: {dead.describe()}")
+            metrics.inc("webchain_dead_hosts_skipped_total")
+            fetched.index_error = DeadHostError(dead.describe())
+            return fetched
+
+        if robots is not None:
+            robots.prefetch(url)
+
+        t0 = perf_counter()
+        try:
+            fetched.body = await get(
+                url,
+                referrer=parent,
+                session=self.session,
+                on_retry=on_retry,
+                on_cache_hit=on_cache_hit,
+                timing=timing,
+                on_span=on_span,
+                breaker=self.breaker,
+                retry_budget=self.retry_budget,
+                limit=self.body_limit,
+            )
+        except Exception as e:
+            logger.info(f"GET {url} failed after retries: {type(e).__name__} {e}")
+            fetched.index_error = e
+        fetched.fetch_duration = perf_counter() - t0
+        if on_span:
+            on_span(at, "fetch", t0, perf_counter())
+        await self.dead_hosts.record(url, fetched.index_error)
+
+        if robots is not None:
+            # only the time spent waiting on robots.txt after the page arrived
+            t0 = perf_counter()
+            allowed = await robots.allowed(url)
+            timing.robots = perf_counter() - t0
+            if on_span:
+                on_span(at, "robots", t0, perf_counter())
+            if not allowed:
+                logger.info(f"fetch from {UA} not allowed by {urljoin(url, 'robots.txt')}")
+                fetched.body = None
+                fetched.index_error = RobotsExclusionError(
+                    f"fetch from {UA} disallowed by page robots.txt"
+                )
 
-def to_iso_timestamp(x: float) -> str:
-    return datetime.fromtimestamp(x, tz=timezone.utc).isoformat()
+        return fetched
+
+    async def parse(
+        self, at: str, fetched: Fetched, on_span: OnSpan | None = None
+    ) -> DocumentExtraction | None:
+        """extract the fetched page, if there is one, filling in its fingerprint and timing"""
+        body = fetched.body
+        if body is None:
+            return None
+        fetched.content_hash = content_fingerprint(body.data)
+        if not body.data:
+            return None
+        t0 = perf_counter()
+        doc = await self.extraction_cache.extract(body.data, fetched.content_hash, body.encoding)
+        fetched.timing.parse = perf_counter() - t0
+        if on_span:
+            on_span(at, "parse", t0, perf_counter())
+        return doc
 
 
 async def crawl(
@@ -131,12 +252,24 @@ async def crawl(
     on_node_complete: OnNodeComplete | None = None,
     on_retry: OnRetry | None = None,
     on_cache_hit: OnCacheHit | None = None,
+    on_span: OnSpan | None = None,
+    previous: CrawlResponse | None = None,
+    checkpoint: Checkpoint | None = None,
+    resume: bool = False,
+    resources: Resources | None = None,
 ) -> CrawlResponse:
     """
     crawl the webchain nomination graph starting from `seed_url`.
 
     this performs a depth-first traversal of the webchain graph, following
-    nomination links from each valid webchain node.
+    nomination links from each valid webchain node. the nodes of a `previous`
+    crawl are prefetched, so that the traversal doesn't have to wait for them.
+
+    completed nodes are written to `checkpoint` as the crawl goes. with
+    `resume`, the nodes already in it aren't crawled again.
+
+    the session, caches and robots.txt are opened for the crawl unless
+    `resources` are given, which are left open for the next crawl.
 
     Parameters:
         seed_url: The starting URL for the crawl
@@ -147,47 +280,38 @@ async def crawl(
     """
     seen: set[str] = set()
     nominations_limit: int = sys.maxsize * 2 + 1
-    start = time()
-
-    async def process_node(
-        url: str, session: ClientSession, parent: str | None = None, depth=0
-    ) -> list[CrawledNode]:
+    progress = (
+        checkpoint.load(seed_url, recursion_limit) if checkpoint is not None and resume else None
+    )
+    restored = progress.nodes if progress is not None else {}
+
+    async def visit(
+        url: str,
+        fetcher: Fetcher,
+        prefetcher: Prefetcher[Fetched] | None,
+        parent: str | None,
+        depth: int,
+    ) -> CrawledNode:
         nonlocal nominations_limit
 
         at = without_trailing_slash(url)
-        seen.add(at)
-
-        if on_node_start:
-            on_node_start(at, parent, depth)
-
-        html: str | None = None
-        index_error: Exception | None = None
-        fetch_duration: float | None = None
-
-        if check_robots_txt is False or await allowed_by_robots_txt(
-            url, user_agent=UA, session=session
-        ):
-            t0 = time()
-            try:
-                html = await get(url, referrer=parent, session=session, on_retry=on_retry, on_cache_hit=on_cache_hit)
-                fetch_duration = time() - t0
-            except Exception as e:
-                fetch_duration = time() - t0
-                logger.info(f"GET {url} failed after retries: {type(e).__name__} {e}")
-                html = None
-                index_error = e
+        prefetched = prefetcher.take(at) if prefetcher is not None else None
+        if prefetched is not None:
+            t0 = perf_counter()
+            fetched = await prefetched
+            if on_span:
+                on_span(at, "prefetched", t0, perf_counter())
+            if on_cache_hit and fetched.timing.cache_hit:
+                on_cache_hit(url)
         else:
-            logger.info(f"fetch from {UA} not allowed by {urljoin(url, 'robots.txt')}")
-            index_error = RobotsExclusionError(f"fetch from {UA} disallowed by page robots.txt")
-
-        nominations: list[str] = []
-        unqualified: list[str] = []
+            fetched = await fetcher.fetch(url, parent, depth, on_retry, on_cache_hit, on_span)
+        doc = await fetcher.parse(at, fetched, on_span)
 
         if depth == 0:
-            if html is None:
+            if fetched.body is None:
                 raise ValueError(f"starting url {seed_url} is unreachable")
 
-            fetched_nominations_limit = get_nominations_limit(html)
+            fetched_nominations_limit = doc.nominations_limit if doc else None
             if fetched_nominations_limit is not None:
                 nominations_limit = fetched_nominations_limit
 
@@ -196,35 +320,58 @@ async def crawl(
                     f"starting url {seed_url} does not specify a nominations limit, using unlimited"
                 )
 
-        if html:
-            node_nominations = OrderedSet(
-                map(without_trailing_slash, get_raw_nominations(html, seed_url))
+        nominations: list[str] = []
+        unqualified: list[str] = []
+        if doc:
+            nominations, unqualified = qualify(
+                node_nominations(doc, seed_url), seen, nominations_limit
             )
-            nominations = list(node_nominations.difference(seen))
-            extra_nominations = nominations[nominations_limit:]
-            nominations = nominations[:nominations_limit]
-            unqualified = list(node_nominations.intersection(seen).union(extra_nominations))
-
-        node = CrawledNode(
-            at=at,
-            children=nominations,
-            unqualified=unqualified,
-            parent=parent,
-            depth=depth,
-            indexed=index_error is None,
-            index_error=index_error,
-            robots_ok=(not isinstance(index_error, RobotsExclusionError)),
-            fetch_duration=fetch_duration,
-        )
+
+        return crawled_node(at, parent, depth, fetched, nominations, unqualified)
+
+    async def process_node(
+        url: str,
+        fetcher: Fetcher,
+        prefetcher: Prefetcher[Fetched] | None = None,
+        parent: str | None = None,
+        depth=0,
+    ) -> list[CrawledNode]:
+        nonlocal nominations_limit
+
+        at = without_trailing_slash(url)
+        seen.add(at)
+
+        if on_node_start:
+            on_node_start(at, parent, depth)
+
+        node = restored.get(at)
+        if node is not None:
+            # done before the crawl was interrupted
+            metrics.inc("webchain_nodes_restored_total")
+            if depth == 0 and progress.nominations_limit is not None:
+                nominations_limit = progress.nominations_limit
+        else:
+            node = await visit(url, fetcher, prefetcher, parent, depth)
+            if checkpoint is not None:
+                checkpoint.record(node, nominations_limit)
 
         if on_node_complete:
             on_node_complete(node, nominations_limit)
 
         nodes = [node]
+        nominations = node.children
+        if prefetcher is not None:
+            prefetcher.settle(at, nominations if depth < recursion_limit else [])
 
         if nominations and depth < recursion_limit:
             tasks = [
-                process_node(url=child_url, session=session, parent=at, depth=depth + 1)
+                process_node(
+                    url=child_url,
+                    fetcher=fetcher,
+                    prefetcher=prefetcher,
+                    parent=at,
+                    depth=depth + 1,
+                )
                 for child_url in nominations
             ]
             results = await asyncio.gather(*tasks)
@@ -233,11 +380,41 @@ async def crawl(
 
         return nodes
 
-    async with get_session() as session:
-        start = time()
-        nodes = await process_node(seed_url, session=session)
+    async with AsyncExitStack() as stack:
+        if resources is None:
+            resources = await stack.enter_async_context(open_resources(check_robots_txt))
+        robots = resources.robots if check_robots_txt else None
+        fetcher = Fetcher(
+            resources.session, resources.extraction_cache, resources.dead_hosts, robots
+        )
+        prefetcher = None
+        if previous is not None:
+            prefetcher = Prefetcher.from_env(
+                lambda node: fetcher.fetch(node.at, node.parent, node.depth)
+            )
+            prefetcher.start(
+                node
+                for node in previous.nodes
+                if node.at not in restored and node.depth <= recursion_limit
+            )
+
+        # a resumed crawl started when the crawl it resumes did
+        start = progress.start if progress is not None else time()
+        if checkpoint is not None:
+            checkpoint.open(seed_url, start, recursion_limit, resume=progress is not None)
+        done = False
+        try:
+            nodes = await process_node(seed_url, fetcher=fetcher, prefetcher=prefetcher)
+            done = True
+        finally:
+            if prefetcher is not None:
+                await prefetcher.close()
+            if checkpoint is not None:
+                checkpoint.close(done)
         end = time()
 
+        logger.info("timing summary:\n" + format_timing_summary(summarize_timings(nodes)))
+
         return CrawlResponse(
             nodes=nodes,
             nominations_limit=nominations_limit,
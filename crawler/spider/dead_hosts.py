@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+import aiohttp
+import aiosqlite
+
+from spider.cached_session import get_db_path
+from spider.circuit import host_of
+from spider.error import HostUnavailableError, InvalidContentType, InvalidStatusCode
+
+logger = logging.getLogger(__name__)
+
+PROBE_INTERVAL = 60 * 60
+"""seconds until a host that failed is tried again, doubled by every further failure"""
+
+MAX_PROBE_INTERVAL = 60 * 60 * 24 * 7
+
+
+def is_dead_host_error(e: BaseException) -> bool:
+    """
+    true for failures that mean the host itself is unreachable: dns lookup
+    failures, refused connections, tls failures and requests that kept timing
+    out, as opposed to a host answering with an error
+    """
+    return isinstance(e, (aiohttp.ClientConnectorError, TimeoutError))
+
+
+def is_answer(e: BaseException | None) -> bool:
+    """
+    true if the host answered the request, so that it is reachable whatever
+    was wrong with the page. other failures, like a dead host skipped, say
+    nothing either way.
+    """
+    return e is None or isinstance(
+        e, (InvalidStatusCode, InvalidContentType, aiohttp.ClientResponseError)
+    )
+
+
+def probe_interval(failures: int) -> float:
+    return min(PROBE_INTERVAL * 2 ** (failures - 1), MAX_PROBE_INTERVAL)
+
+
+@dataclass
+class DeadHost:
+    host: str
+    reason: str
+    """exception class and message of the last failure"""
+    failures: int
+    """runs in a row in which the host couldn't be reached"""
+    since: float
+    retry_at: float
+
+    def describe(self) -> str:
+        def iso(t: float) -> str:
+            return datetime.fromtimestamp(t, tz=timezone.utc).isoformat(timespec="minutes")
+
+        return (
+            f"{self.host} unreachable since {iso(self.since)} ({self.reason}),"
+            f" next try after {iso(self.retry_at)}"
+        )
+
+
+class DeadHosts:
+    """
+    hosts that couldn't be reached in previous runs, persisted next to the http
+    cache so that later runs don't wait on them again.
+
+    a host is skipped until its next probe is due. the interval between probes
+    starts at PROBE_INTERVAL and doubles with every run in which the host is
+    still unreachable, up to MAX_PROBE_INTERVAL. a single successful request
+    forgets the host. with `path` None nothing is skipped or recorded.
+    """
+
+    def __init__(self, path: Optional[Path], clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self.db: Optional[aiosqlite.Connection] = None
+        self.hosts: dict[str, DeadHost] = {}
+        self.recorded: set[str] = set()
+        """hosts whose failure was already counted this run"""
+        self.lock = asyncio.Lock()
+
+    async def ensure_db(self) -> None:
+        if self.db is not None or self.path is None:
+            return
+        async with self.lock:
+            if self.db is None:
+                await self.connect()
+
+    async def connect(self) -> None:
+        self.db = await aiosqlite.connect(self.path)
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_hosts (
+                host TEXT PRIMARY KEY,
+                reason TEXT,
+                failures INTEGER,
+                since REAL,
+                retry_at REAL
+            )
+            """
+        )
+        await self.db.commit()
+        async with self.db.execute(
+            "SELECT host, reason, failures, since, retry_at FROM dead_hosts"
+        ) as cur:
+            self.hosts = {row[0]: DeadHost(*row) async for row in cur}
+        logger.debug(f"{len(self.hosts)} known dead hosts in {self.path}")
+
+    async def check(self, url: str) -> DeadHost | None:
+        """the dead host `url` is on, unless it is due to be probed again"""
+        await self.ensure_db()
+        dead = self.hosts.get(host_of(url))
+        if dead is None or self.clock() >= dead.retry_at:
+            return None
+        return dead
+
+    async def record(self, url: str, error: BaseException | None) -> None:
+        """record the outcome of fetching `url`, with `error` None if it succeeded"""
+        await self.ensure_db()
+        if self.db is None:
+            return
+        host = host_of(url)
+        if isinstance(error, HostUnavailableError):
+            # failed fast by the circuit breaker, which says nothing about the
+            # host unless the request had failed on its own before that
+            error = error.__cause__
+            if error is None:
+                return
+
+        if is_answer(error):
+            if self.hosts.pop(host, None) is not None:
+                logger.info(f"{host} is reachable again")
+                await self.db.execute("DELETE FROM dead_hosts WHERE host = ?", (host,))
+                await self.db.commit()
+            return
+        if not is_dead_host_error(error) or host in self.recorded:
+            return
+        self.recorded.add(host)
+        now = self.clock()
+        previous = self.hosts.get(host)
+        failures = previous.failures + 1 if previous is not None else 1
+        dead = DeadHost(
+            host=host,
+            reason=f"{type(error).__name__}: {error}",
+            failures=failures,
+            since=previous.since if previous is not None else now,
+            retry_at=now + probe_interval(failures),
+        )
+        self.hosts[host] = dead
+        await self.db.execute(
+            "INSERT OR REPLACE INTO dead_hosts (host, reason, failures, since, retry_at) VALUES (?, ?, ?, ?, ?)",
+            (dead.host, dead.reason, dead.failures, dead.since, dead.retry_at),
+        )
+        await self.db.commit()
+
+    def next_run(self) -> None:
+        """start counting failures afresh, for a crawler that stays running between runs"""
+        self.recorded.clear()
+
+    async def close(self) -> None:
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def get_dead_hosts() -> DeadHosts:
+    # recording and replaying should see every request the crawl makes
+    for var in ("WEBCHAIN_NO_CACHE", "WEBCHAIN_RECORD", "WEBCHAIN_REPLAY"):
+        if os.environ.get(var):
+            return DeadHosts(path=None)
+    return DeadHosts(get_db_path())
@@ -20,3 +20,13 @@ class RobotsExclusionError(WebchainError):
 
 class ParentNotCrawledError(WebchainError):
     pass
+
+
+class HostUnavailableError(WebchainError):
+    def __init__(self, host: str, failures: int):
+        super().__init__(f"{host} failed {failures} times in a row, not trying it for now")
+        self.host = host
+
+
+class DeadHostError(WebchainError):
+    """the host was unreachable in a previous run and isn't due to be tried again yet"""
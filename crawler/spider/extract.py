@@ -0,0 +1,176 @@
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup, Tag
+from bs4.element import PageElement
+from ordered_set import OrderedSet
+
+from spider.contracts import DocumentExtraction, HtmlMetadata
+
+EXTRACTION_VERSION = 1
+"""
+bump whenever extraction logic changes, so that results persisted by
+ExtractionCache under the previous logic are discarded
+"""
+
+
+def validate_uri(x: str) -> bool:
+    """check if a string is a valid uri with both scheme (http/https) and netloc (domain)."""
+    try:
+        result = urlparse(x)
+        return all([result.scheme, result.netloc])
+    except AttributeError:
+        return False
+
+
+def is_valid_nomination(tag: Tag) -> bool:
+    if not isinstance(tag, Tag) or tag.name != "link":
+        return False
+
+    rel = tag.get("rel")
+    assert isinstance(rel, str)  # is always a string with multi_valued_attributes=None
+
+    if rel != "webchain-nomination":
+        return False
+
+    href = tag.get("href")
+
+    if isinstance(href, str) and validate_uri(href):
+        return True
+
+    return False
+
+
+def handle_meta_element(node: Tag | PageElement | None) -> str | None:
+    if isinstance(node, Tag) and node.get("content"):
+        content = str(node.get("content"))
+        return content.replace("\n", " ").strip()
+
+    return None
+
+
+def find_webchain_href(soup: BeautifulSoup) -> str | None:
+    # look for the webchain declaration link in the html. we're permissive, so
+    # we search the entire document, not just the head.
+    webchain_tag = soup.find(name="link", attrs={"rel": "webchain"})
+    return str(webchain_tag.get("href")) if isinstance(webchain_tag, Tag) else None
+
+
+def find_nominations(soup: BeautifulSoup) -> list[str]:
+    hrefs: OrderedSet[str] = OrderedSet([])
+
+    for tag in soup.find_all(is_valid_nomination):
+        if not isinstance(tag, Tag):
+            continue
+        href = tag.get("href")
+        if isinstance(href, str):
+            hrefs.add(href)
+
+    return list(hrefs)
+
+
+def find_nominations_limit(soup: BeautifulSoup) -> int | None:
+    if not soup.head:
+        return None
+
+    limit_element = soup.find("meta", attrs={"name": "webchain-nominations-limit"})
+    limit_str = handle_meta_element(limit_element)
+
+    if limit_str is None:
+        return None
+
+    try:
+        limit = int(limit_str)
+        if limit < 0:
+            return None
+        return limit
+    except ValueError:
+        return None
+
+
+def find_html_metadata(soup: BeautifulSoup) -> HtmlMetadata | None:
+    if not soup.head:
+        return None
+
+    metadata = HtmlMetadata(title=None, description=None, theme_color=None)
+
+    title_element = soup.head.title
+    metadata.title = title_element.string if title_element else None
+    if not metadata.title:
+        metadata.title = handle_meta_element(soup.head.find("meta", attrs={"property": "og:title"}))
+    if not metadata.title:
+        metadata.title = handle_meta_element(
+            soup.head.find("meta", attrs={"name": "twitter:title"})
+        )
+
+    if metadata.title:
+        metadata.title = str(metadata.title).replace("\n", " ").strip()
+
+    metadata.description = handle_meta_element(
+        soup.head.find("meta", attrs={"name": "description"})
+    )
+    if not metadata.description:
+        metadata.description = handle_meta_element(
+            soup.head.find("meta", attrs={"property": "og:description"})
+        )
+    if not metadata.description:
+        metadata.description = handle_meta_element(
+            soup.head.find("meta", attrs={"name": "twitter:description"})
+        )
+
+    metadata.theme_color = handle_meta_element(
+        soup.head.find("meta", attrs={"name": "theme-color"})
+    )
+
+    return metadata
+
+
+def find_feed_hrefs(soup: BeautifulSoup) -> list[str]:
+    if not soup.head:
+        return []
+
+    syndication_links = soup.head.find_all(
+        "link", attrs={"type": ["application/rss+xml", "application/atom+xml"]}
+    )
+
+    return list(
+        dict.fromkeys(
+            str(link.get("href")) for link in syndication_links if link.get("href") is not None
+        )
+    )
+
+
+def extract_document(html: str | bytes, encoding: str | None = None) -> DocumentExtraction:
+    """
+    parse `html` once and extract everything the crawler and the metadata
+    enricher need from it.
+
+    raw bytes are decoded by lxml while it parses them, as `encoding` (the
+    charset of the Content-Type header) or else the charset the document
+    declares in a <meta> tag, rather than being decoded up front.
+    """
+    if isinstance(html, str):
+        encoding = None  # already decoded
+    soup = BeautifulSoup(html, "lxml", from_encoding=encoding, multi_valued_attributes=None)
+
+    return DocumentExtraction(
+        webchain_href=find_webchain_href(soup),
+        nominations=find_nominations(soup),
+        nominations_limit=find_nominations_limit(soup),
+        html_metadata=find_html_metadata(soup),
+        feed_hrefs=find_feed_hrefs(soup),
+    )
+
+
+def nominations_for_seed(doc: DocumentExtraction, seed: str) -> OrderedSet[str]:
+    """
+    valid nominations of `doc`, provided it declares itself part of the
+    webchain at `seed`
+    """
+
+    def normalize_url(url: str) -> str:
+        return url.rstrip("/")
+
+    if doc.webchain_href is None or normalize_url(doc.webchain_href) != normalize_url(seed):
+        return OrderedSet([])
+
+    return OrderedSet(doc.nominations)
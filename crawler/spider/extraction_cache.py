@@ -0,0 +1,184 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import aiosqlite
+
+from spider.cached_session import get_db_path as get_http_cache_db_path
+from spider.contracts import DocumentExtraction, HtmlMetadata
+from spider.extract import EXTRACTION_VERSION, extract_document
+
+logger = logging.getLogger(__name__)
+
+
+def get_db_path() -> Path:
+    if "WEBCHAIN_EXTRACTION_CACHE_DB" in os.environ:
+        return Path(os.environ["WEBCHAIN_EXTRACTION_CACHE_DB"])
+    return get_http_cache_db_path().with_name("extraction-cache.sqlite")
+
+
+MAX_UNUSED_AGE = 60 * 60 * 24 * 30
+"""entries not used for this many seconds are pruned"""
+
+FLUSH_EVERY = 100
+"""saves and lookups kept in memory before they are written to sqlite together"""
+
+
+def to_json(doc: DocumentExtraction) -> str:
+    return json.dumps(dataclasses.asdict(doc))
+
+
+def from_json(data: str) -> DocumentExtraction:
+    obj = json.loads(data)
+    if obj.get("html_metadata") is not None:
+        obj["html_metadata"] = HtmlMetadata(**obj["html_metadata"])
+    return DocumentExtraction(**obj)
+
+
+class ExtractionCache:
+    """
+    maps the fingerprint of an html body to what was extracted from it, so that
+    unchanged documents are never parsed twice
+
+    results are kept in memory for the lifetime of the cache, and persisted in
+    sqlite unless `path` is None. entries written by a different
+    EXTRACTION_VERSION are discarded. new entries and the use of existing ones
+    are written in batches of FLUSH_EVERY, one transaction each, and the rest
+    by `next_run` or `close`.
+    """
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self.db: Optional[aiosqlite.Connection] = None
+        self.memory: dict[str, DocumentExtraction] = {}
+        self.used: set[str] = set()
+        """fingerprints looked up or saved since `next_run`"""
+        self.unsaved: dict[str, DocumentExtraction] = {}
+        self.touched: set[str] = set()
+        """fingerprints found since the last flush, whose entries are used again"""
+        self.lock = asyncio.Lock()
+
+    async def ensure_db(self) -> None:
+        if self.db is not None or self.path is None:
+            return
+        async with self.lock:
+            if self.db is None:
+                await self.connect()
+
+    async def connect(self) -> None:
+        self.db = await aiosqlite.connect(self.path)
+        # shared by the workers of a sharded crawl, like the http cache
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        await self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                content_hash TEXT PRIMARY KEY,
+                version INTEGER,
+                data TEXT,
+                used_at REAL
+            )
+            """
+        )
+        await self.db.execute(
+            "DELETE FROM extractions WHERE version != ? OR used_at < ?",
+            (EXTRACTION_VERSION, time.time() - MAX_UNUSED_AGE),
+        )
+        await self.db.commit()
+        logger.debug(f"using extraction cache db at {self.path}")
+
+    async def get(self, content_hash: str) -> Optional[DocumentExtraction]:
+        self.used.add(content_hash)
+        doc = self.memory.get(content_hash)
+        if doc is None:
+            await self.ensure_db()
+            if self.db is None:
+                return None
+
+            rows = await self.db.execute_fetchall(
+                "SELECT data FROM extractions WHERE content_hash = ? AND version = ?",
+                (content_hash, EXTRACTION_VERSION),
+            )
+            if not rows:
+                return None
+            doc = from_json(rows[0][0])
+            self.memory[content_hash] = doc
+
+        if self.path is not None:
+            self.touched.add(content_hash)
+            await self.flush_if_due()
+        return doc
+
+    async def save(self, content_hash: str, doc: DocumentExtraction) -> None:
+        self.memory[content_hash] = doc
+        self.used.add(content_hash)
+        if self.path is not None:
+            self.unsaved[content_hash] = doc
+            await self.flush_if_due()
+
+    async def flush_if_due(self) -> None:
+        if len(self.unsaved) + len(self.touched) >= FLUSH_EVERY:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """write the saved entries and the use of the found ones, in one transaction"""
+        if not self.unsaved and not self.touched:
+            return
+        await self.ensure_db()
+        unsaved, self.unsaved = self.unsaved, {}
+        touched, self.touched = self.touched - unsaved.keys(), set()
+        now = time.time()
+        await self.db.executemany(
+            "INSERT OR REPLACE INTO extractions (content_hash, version, data, used_at) VALUES (?, ?, ?, ?)",
+            [(h, EXTRACTION_VERSION, to_json(doc), now) for h, doc in unsaved.items()],
+        )
+        await self.db.executemany(
+            "UPDATE extractions SET used_at = ? WHERE content_hash = ?",
+            [(now, h) for h in touched],
+        )
+        await self.db.commit()
+
+    async def extract(
+        self, html: str | bytes, content_hash: str, encoding: str | None = None
+    ) -> DocumentExtraction:
+        """extract `html`, reusing a previous result for the same body if there is one"""
+        doc = await self.get(content_hash)
+        if doc is not None:
+            logger.debug(f"extraction cache hit: {content_hash}")
+            return doc
+
+        doc = extract_document(html, encoding)
+        await self.save(content_hash, doc)
+        return doc
+
+    async def next_run(self) -> None:
+        """
+        write out the last run, and forget the documents it didn't use, so
+        that a crawler that stays running between runs doesn't hold on to
+        every page it ever saw
+        """
+        await self.flush()
+        self.memory = {h: doc for h, doc in self.memory.items() if h in self.used}
+        self.used.clear()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    if os.environ.get("WEBCHAIN_NO_CACHE"):
+        return ExtractionCache(path=None)
+    return ExtractionCache(get_db_path())
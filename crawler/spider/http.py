@@ -1,13 +1,18 @@
 import logging
 import os
-import socket
+from time import perf_counter
 
 import aiohttp
 import tenacity
 
-from spider.error import InvalidStatusCode
+from spider.body import Body, BodyLimit, IncompleteBodyError, read_body
+from spider.circuit import CircuitBreaker, RetryBudget, backoff
+from spider.error import HostUnavailableError, InvalidStatusCode
 from spider.cached_session import CachedClientSession
-from spider.contracts import OnRetry, OnCacheHit
+from spider.replay import RecordingClientSession, ReplayClientSession
+from spider.contracts import OnRetry, OnCacheHit, OnSpan, RequestTiming
+from spider.transport import get_transport
+from spider.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -15,21 +20,33 @@ UA = "WebchainSpider (+https://github.com/furudean/webchain)"
 
 
 def get_session() -> aiohttp.ClientSession:
-    connector = (
-        aiohttp.TCPConnector(family=socket.AF_INET)
-        if os.environ.get("WEBCHAIN_IPV4")
-        else None
-    )
-    kwargs = dict(
-        headers={"User-Agent": UA, "Accept-Language": "en-US, *;q=0.5"},
-        raise_for_status=True,
-        cookie_jar=aiohttp.DummyCookieJar(),
-        trust_env=True,
-        connector=connector,
+    if os.environ.get("WEBCHAIN_REPLAY"):
+        return ReplayClientSession(
+            os.environ["WEBCHAIN_REPLAY"],
+            latency=bool(os.environ.get("WEBCHAIN_REPLAY_LATENCY")),
+            raise_for_status=True,
+        )
+
+    transport = get_transport(
+        headers={
+            "User-Agent": UA,
+            "Accept-Language": "en-US, *;q=0.5",
+        }
     )
+    if os.environ.get("WEBCHAIN_RECORD"):
+        # recording bypasses the cache, so that it captures what the network
+        # actually returned
+        return RecordingClientSession(os.environ["WEBCHAIN_RECORD"], transport)
     if os.environ.get("WEBCHAIN_NO_CACHE"):
-        return aiohttp.ClientSession(**kwargs)
-    return CachedClientSession(**kwargs)
+        return transport
+    return CachedClientSession(transport)
+
+
+def is_host_failure(e: BaseException) -> bool:
+    """true if `e` suggests the host is down, rather than something wrong with one page"""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientConnectionError, TimeoutError))
 
 
 async def get(
@@ -38,21 +55,59 @@ async def get(
     referrer: str | None = None,
     on_retry: OnRetry | None = None,
     on_cache_hit: OnCacheHit | None = None,
-) -> str:
+    timing: RequestTiming | None = None,
+    on_span: OnSpan | None = None,
+    breaker: CircuitBreaker | None = None,
+    retry_budget: RetryBudget | None = None,
+    limit: BodyLimit | None = None,
+) -> Body:
+    """
+    GET `url` and return its body, undecoded, retrying transient failures.
+
+    if `timing` is given, it is filled in with where the time went, and
+    `on_span` is called with each attempt. with `breaker`, requests to hosts
+    that keep failing fail fast with HostUnavailableError, and with
+    `retry_budget` retries stop once the run has used up its budget. with
+    `limit`, the body is only read until the limit is reached.
+    """
+
     async def run():
         headers = {}
         if referrer is not None:
             headers["Referer"] = referrer
 
-        try:
+        if timing is not None:
+            timing.attempts += 1
+        metrics.inc("webchain_requests_total")
+
+        async def request() -> Body:
             async with session.get(
-                url, timeout=aiohttp.ClientTimeout(total=10), headers=headers
+                url,
+                timeout=aiohttp.ClientTimeout(total=10),
+                headers=headers,
+                trace_request_ctx=timing,
             ) as response:
-                result = await response.text()
-                logger.debug(f"got {url}")
-                if on_cache_hit and getattr(response, "from_cache", False):
+                t0 = perf_counter()
+                body = await read_body(response, limit, timing)
+                logger.debug(f"got {url}" + (f" ({body.truncated})" if body.truncated else ""))
+                from_cache = getattr(response, "from_cache", False)
+                if timing is not None:
+                    timing.transfer = (timing.transfer or 0.0) + perf_counter() - t0
+                    timing.cache_hit = from_cache
+                    timing.not_modified = getattr(response, "not_modified", False)
+                if on_cache_hit and from_cache:
                     on_cache_hit(url)
-            return result
+                return body
+
+        try:
+            try:
+                return await request()
+            except IncompleteBodyError:
+                # the cache only kept the start of the body, which isn't
+                # enough for this read
+                logger.debug(f"cached body of {url} is truncated, fetching it again")
+                headers["Cache-Control"] = "no-cache"
+                return await request()
 
         except aiohttp.InvalidURL as e:
             logger.info(f"invalid url {url}: " + type(e).__name__)
@@ -73,13 +128,18 @@ async def get(
             raise
 
     def before_sleep(retry_state: tenacity.RetryCallState) -> None:
+        metrics.inc("webchain_retries_total")
         if on_retry:
             on_retry(url, retry_state.attempt_number)
 
     attempts = int(os.environ.get("WEBCHAIN_NETWORK_ATTEMPTS", "5"))
+    stop = tenacity.stop_after_attempt(attempts)
+    if retry_budget is not None:
+        # checked last, so that only retries that would happen spend the budget
+        stop = tenacity.stop_any(stop, retry_budget.stop)
     retrying = tenacity.AsyncRetrying(
-        wait=tenacity.wait_exponential(),
-        stop=tenacity.stop_after_attempt(attempts),
+        wait=backoff(),
+        stop=stop,
         retry=tenacity.retry_if_exception(
             lambda e: isinstance(e, (
                 aiohttp.ClientResponseError,
@@ -92,6 +152,34 @@ async def get(
         reraise=True,
         before_sleep=before_sleep,
     )
+    last_error: Exception | None = None
     async for attempt in retrying:
         with attempt:
-            return await run()
+            probing = False
+            if breaker is not None:
+                try:
+                    probing = breaker.before_request(url)
+                except HostUnavailableError as e:
+                    # caused by this request's own failure, if it had one
+                    raise e from last_error
+            t0 = perf_counter()
+            try:
+                result = await run()
+            except Exception as e:
+                last_error = e
+                if breaker is not None:
+                    breaker.record(url, failed=is_host_failure(e))
+                raise
+            except BaseException:
+                # cancelled, so the host neither answered nor failed
+                if probing:
+                    breaker.release(url)
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record(url, failed=False)
+                return result
+            finally:
+                if on_span:
+                    attempt_number = attempt.retry_state.attempt_number
+                    on_span(url, f"attempt {attempt_number}", t0, perf_counter())
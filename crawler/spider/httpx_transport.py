@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import socket
+import ssl
+from contextlib import asynccontextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from importlib.util import find_spec
+from time import perf_counter
+from typing import AsyncIterator
+
+import aiohttp
+import httpx
+from multidict import CIMultiDict
+
+from spider.body import charset
+from spider.contracts import RequestTiming
+from spider.replay import rebuild_error, response_error
+from spider.timing import add_duration
+from spider.transport import accept_encoding
+
+# every request is logged at info otherwise
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+
+def as_aiohttp_error(url: str, e: httpx.HTTPError) -> Exception:
+    """the aiohttp exception aiohttp would have raised in place of `e`"""
+    causes = []
+    cause: BaseException | None = e
+    while cause is not None:
+        causes.append(cause)
+        cause = cause.__cause__ or cause.__context__
+
+    def caused_by(error_type: type[BaseException]) -> bool:
+        return any(isinstance(c, error_type) for c in causes)
+
+    match e:
+        case httpx.TimeoutException():
+            error_type = "TimeoutError"
+        case httpx.ConnectError() if caused_by(socket.gaierror) or "name resolution" in str(e):
+            error_type = "ClientConnectorDNSError"
+        case httpx.ConnectError() if caused_by(ssl.SSLCertVerificationError):
+            error_type = "ClientConnectorCertificateError"
+        case httpx.ConnectError() if caused_by(ssl.SSLError):
+            error_type = "ClientConnectorSSLError"
+        case httpx.ConnectError():
+            error_type = "ClientConnectorError"
+        case httpx.RemoteProtocolError():
+            error_type = "ServerDisconnectedError"
+        case httpx.DecodingError():
+            error_type = "ClientPayloadError"
+        case httpx.InvalidURL() | httpx.UnsupportedProtocol():
+            error_type = "InvalidURL"
+        case _:
+            error_type = type(e).__name__
+    return rebuild_error(url, error_type, str(e))
+
+
+def tracer(timing: RequestTiming):
+    """
+    httpcore trace extension that fills in `timing` like aiohttp's trace
+    config does. dns lookups are part of connecting.
+    """
+    started: dict[str, float] = {}
+
+    async def trace(name: str, info: dict) -> None:
+        event, _, stage = name.rpartition(".")
+        step = event.split(".", 1)[-1]
+        if stage == "started":
+            started[step] = perf_counter()
+            return
+        if stage != "complete":
+            return
+        if step in ("connect_tcp", "connect_unix_socket", "start_tls") and step in started:
+            add_duration(timing, "connect", perf_counter() - started[step])
+        elif step == "receive_response_headers" and "send_request_headers" in started:
+            add_duration(timing, "ttfb", perf_counter() - started["send_request_headers"])
+
+    return trace
+
+
+class HttpxBody:
+    def __init__(self, url: str, response: httpx.Response):
+        self.url = url
+        self.response = response
+        self.eof = False
+
+    async def iter_chunked(self, n: int) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.aiter_bytes(n):
+                yield chunk
+        except httpx.HTTPError as e:
+            raise as_aiohttp_error(self.url, e) from e
+        self.eof = True
+
+    def at_eof(self) -> bool:
+        return self.eof
+
+    @property
+    def total_raw_bytes(self) -> int:
+        return self.response.num_bytes_downloaded
+
+
+class HttpxResponse:
+    def __init__(self, url: str, response: httpx.Response):
+        self.status = response.status_code
+        self.headers = CIMultiDict(response.headers.multi_items())
+        self.content = HttpxBody(url, response)
+
+    async def read(self) -> bytes:
+        chunks = [chunk async for chunk in self.content.iter_chunked(64 * 1024)]
+        return b"".join(chunks)
+
+    async def text(self, encoding: str | None = None) -> str:
+        encoding = encoding or charset(self.headers.get("Content-Type", "")) or "utf-8"
+        return (await self.read()).decode(encoding, errors="replace")
+
+
+class HttpxTransport:
+    """
+    transport on httpx, which speaks http/2 to the servers that offer it and
+    then sends every request to a host over a single connection, instead of
+    opening one per concurrent request like aiohttp.
+    """
+
+    def __init__(self, headers: dict[str, str], ipv4: bool = False, http2: bool = True):
+        # httpx decodes them with whichever of these packages is installed
+        encodings = accept_encoding(
+            brotli=bool(find_spec("brotli") or find_spec("brotlicffi")),
+            zstd=bool(find_spec("zstandard")),
+        )
+        self.client = httpx.AsyncClient(
+            headers={**headers, "Accept-Encoding": encodings},
+            http2=http2,
+            transport=httpx.AsyncHTTPTransport(
+                http2=http2, local_address="0.0.0.0" if ipv4 else None
+            ),
+            # like aiohttp's defaults, except cookies, which aren't kept at all
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+            follow_redirects=True,
+            max_redirects=10,
+            # the total timeout of `get` is the only one, as with aiohttp
+            timeout=httpx.Timeout(None),
+            cookies=CookieJar(DefaultCookiePolicy(allowed_domains=[])),
+            trust_env=True,
+        )
+
+    @asynccontextmanager
+    async def get(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        timeout: aiohttp.ClientTimeout | None = None,
+        trace_request_ctx: RequestTiming | None = None,
+    ) -> AsyncIterator[HttpxResponse]:
+        total = timeout.total if timeout is not None else None
+        extensions = {}
+        if isinstance(trace_request_ctx, RequestTiming):
+            extensions["trace"] = tracer(trace_request_ctx)
+
+        # httpx only has timeouts per operation, so the total is enforced
+        # around the whole request, reading the body included
+        async with asyncio.timeout(total):
+            request = self.client.build_request("GET", url, headers=headers, extensions=extensions)
+            try:
+                response = await self.client.send(request, stream=True)
+            except httpx.HTTPError as e:
+                raise as_aiohttp_error(url, e) from e
+            try:
+                if response.status_code >= 400:
+                    raise response_error(url, response.status_code, dict(response.headers))
+                yield HttpxResponse(url, response)
+            finally:
+                await response.aclose()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -1,16 +1,20 @@
 import asyncio
 import dataclasses
+from contextlib import AsyncExitStack
 from logging import getLogger
 from urllib.parse import urljoin, urlparse
 
 import aiohttp
-from bs4 import BeautifulSoup
 import feedparser
 
-from spider.robots import allowed_by_robots_txt
-from spider.http import UA, get_session, get
-from spider.crawl import CrawlResponse, handle_meta_element
-from spider.contracts import CrawledNode, HtmlMetadata, SyndicationFeed
+from spider.body import BodyLimit
+from spider.robots import RobotsChecker
+from spider.http import get
+from spider.crawl import CrawlResponse, Resources, content_fingerprint, open_resources
+from spider.contracts import CrawledNode, DocumentExtraction, HtmlMetadata, SyndicationFeed
+from spider.extract import extract_document
+from spider.extraction_cache import ExtractionCache
+from spider.metrics import metrics
 
 logger = getLogger(__name__)
 
@@ -26,120 +30,187 @@ def as_absolute_url(href: str, domain: str) -> str:
         return urljoin(domain, href)
 
 
-def get_html_metadata(html: str, at: str) -> HtmlMetadata | None:
-    soup = BeautifulSoup(html, "lxml", multi_valued_attributes=None)
+def get_html_metadata(html: str | bytes, at: str | None = None) -> HtmlMetadata | None:
+    return extract_document(html).html_metadata
 
-    if not soup.head:
-        return None
 
-    metadata = HtmlMetadata(title=None, description=None, theme_color=None)
+def parse_syndication_feed(
+    xml: str | bytes, url: str, encoding: str | None = None
+) -> SyndicationFeed:
+    # feedparser decodes bytes itself, preferring the charset of the header
+    headers = {"content-type": f"application/xml; charset={encoding}"} if encoding else None
+    d = feedparser.parse(xml, response_headers=headers)
 
-    title_element = soup.head.title
-    metadata.title = title_element.string if title_element else None
-    if not metadata.title:
-        metadata.title = handle_meta_element(soup.head.find("meta", attrs={"property": "og:title"}))
-    if not metadata.title:
-        metadata.title = handle_meta_element(
-            soup.head.find("meta", attrs={"name": "twitter:title"})
-        )
+    return SyndicationFeed(
+        url=url,
+        title=d.feed.get("title"),
+        description=d.feed.get("description"),
+        published=d.feed.get("published"),
+        updated=d.feed.get("updated"),
+        version=d.get("version"),
+        content_hash=content_fingerprint(xml),
+    )
 
-    if metadata.title:
-        metadata.title = metadata.title.replace("\n", " ").strip()
 
-    metadata.description = handle_meta_element(
-        soup.head.find("meta", attrs={"name": "description"})
-    )
-    if not metadata.description:
-        metadata.description = handle_meta_element(
-            soup.head.find("meta", attrs={"property": "og:description"})
-        )
-    if not metadata.description:
-        metadata.description = handle_meta_element(
-            soup.head.find("meta", attrs={"name": "twitter:description"})
-        )
-
-    metadata.theme_color = handle_meta_element(
-        soup.head.find("meta", attrs={"name": "theme-color"})
-    )
+async def fetch_syndication_feeds(
+    urls: list[str],
+    at: str,
+    session: aiohttp.ClientSession,
+    previous_feeds: list[SyndicationFeed] | None = None,
+) -> list[SyndicationFeed]:
+    """
+    fetch and parse the feeds at `urls`. feeds whose fingerprint matches one in
+    `previous_feeds` are carried forward without being parsed again.
+    """
+    previous_by_url = {feed.url: feed for feed in previous_feeds or []}
 
-    return metadata
+    async def fetch_feed(url: str) -> SyndicationFeed:
+        xml = await get(url, session=session, referrer=at, limit=BodyLimit.from_env(html=False))
+        previous = previous_by_url.get(url)
+        if previous is not None and previous.content_hash == content_fingerprint(xml.data):
+            return previous
+        return parse_syndication_feed(xml.data, url=url, encoding=xml.encoding)
+
+    return list(await asyncio.gather(*[fetch_feed(url) for url in urls]))
+
+
+def get_syndication_urls(doc: DocumentExtraction, at: str) -> list[str]:
+    return list(dict.fromkeys(as_absolute_url(href, domain=at) for href in doc.feed_hrefs))
 
 
 async def get_syndication_feeds(
-    html: str, at: str, session: aiohttp.ClientSession
+    html: str | bytes,
+    at: str,
+    session: aiohttp.ClientSession,
+    previous_feeds: list[SyndicationFeed] | None = None,
 ) -> list[SyndicationFeed]:
-    def parse_syndication_feed(xml: str, url: str) -> SyndicationFeed | None:
-        d = feedparser.parse(xml)
-
-        return SyndicationFeed(
-            url=url,
-            title=d.feed.get("title"),
-            description=d.feed.get("description"),
-            published=d.feed.get("published"),
-            updated=d.feed.get("updated"),
-            version=d.get("version"),
-        )
-
-    async def fetch_pair(url, session):
-        xml = await get(url, session=session, referrer=at)
-        return (url, xml)
-
-    soup = BeautifulSoup(html, "lxml", multi_valued_attributes=None)
-
-    syndication_links = soup.head.find_all(
-        "link", attrs={"type": ["application/rss+xml", "application/atom+xml"]}
-    )
-
-    syndication_urls = list(
-        dict.fromkeys(as_absolute_url(link.get("href"), domain=at) for link in syndication_links)
+    return await fetch_syndication_feeds(
+        get_syndication_urls(extract_document(html), at),
+        at=at,
+        session=session,
+        previous_feeds=previous_feeds,
     )
 
-    syndication_data = await asyncio.gather(*[fetch_pair(url, session) for url in syndication_urls])
 
-    return [parse_syndication_feed(xml, url=url) for url, xml in syndication_data]
+def can_reuse_metadata(content_hash: str | None, previous: CrawledNode | None) -> bool:
+    """
+    true if `previous` was enriched from a byte-identical page, meaning its
+    metadata can be carried forward as-is.
+    """
+    return (
+        content_hash is not None
+        and previous is not None
+        and previous.content_hash == content_hash
+        and previous.html_metadata is not None
+    )
 
 
 async def fetch_and_update_metadata(
-    node: CrawledNode, session: aiohttp.ClientSession, check_robots_txt=False
+    node: CrawledNode,
+    session: aiohttp.ClientSession,
+    robots: RobotsChecker | None = None,
+    previous: CrawledNode | None = None,
+    extraction_cache: ExtractionCache | None = None,
 ) -> CrawledNode:
     """Returns a new CrawledNode with updated metadata"""
 
-    node_copy = CrawledNode(**dataclasses.asdict(node))
+    node_copy = dataclasses.replace(node)
 
-    if check_robots_txt and not (
-        await allowed_by_robots_txt(node.at, user_agent=UA, session=session)
-    ):
-        logger.info(f"disallowed by robots.txt: {node.at}")
+    if not node.indexed:
         return node_copy
 
-    if node.indexed:
-        try:
-            html = await get(node.at, referrer=node.parent, session=session)
+    try:
+        reuse = can_reuse_metadata(node.content_hash, previous)
+        # the page is requested while robots.txt is checked, the feeds only once it allowed it
+        page = None
+        if not reuse:
+            page = asyncio.ensure_future(
+                get(node.at, referrer=node.parent, session=session, limit=BodyLimit.from_env())
+            )
+        if robots is not None and not await robots.allowed(node.at):
+            logger.info(f"disallowed by robots.txt: {node.at}")
+            if page is not None:
+                page.cancel()
+                await asyncio.gather(page, return_exceptions=True)
+            return node_copy
+
+        if reuse:
+            # the crawl already fingerprinted this page and it hasn't
+            # changed, so there is no need to fetch or parse it again.
+            # feeds are still refetched since they change independently.
+            logger.debug(f"page unchanged, reusing metadata: {node.at}")
+            metrics.inc("webchain_metadata_reused_total")
+            node_copy.html_metadata = previous.html_metadata
+            node_copy.syndication_feeds = await fetch_syndication_feeds(
+                [feed.url for feed in previous.syndication_feeds],
+                at=node.at,
+                session=session,
+                previous_feeds=previous.syndication_feeds,
+            )
+            return node_copy
+
+        body = await page
 
-            if html:
-                node_copy.html_metadata = get_html_metadata(html, at=node.at)
-                node_copy.syndication_feeds = await get_syndication_feeds(
-                    html, at=node.at, session=session
+        if body.data:
+            node_copy.content_hash = content_fingerprint(body.data)
+            if extraction_cache is not None:
+                doc = await extraction_cache.extract(
+                    body.data, node_copy.content_hash, body.encoding
                 )
-        except Exception as e:
-            logger.warning(f"failed to fetch metadata for {node.at}: " + type(e).__name__)
-            raise e
+            else:
+                doc = extract_document(body.data, body.encoding)
+            if can_reuse_metadata(node_copy.content_hash, previous):
+                metrics.inc("webchain_metadata_reused_total")
+                node_copy.html_metadata = previous.html_metadata
+            else:
+                node_copy.html_metadata = doc.html_metadata
+            node_copy.syndication_feeds = await fetch_syndication_feeds(
+                get_syndication_urls(doc, at=node.at),
+                at=node.at,
+                session=session,
+                previous_feeds=previous.syndication_feeds if previous else None,
+            )
+    except Exception as e:
+        logger.warning(f"failed to fetch metadata for {node.at}: " + type(e).__name__)
+        metrics.inc("webchain_errors_total", phase="enrich", error=type(e).__name__)
+        raise e
 
     return node_copy
 
 
 async def enrich_with_metadata(
-    crawl_response: CrawlResponse, check_robots_txt=False
+    crawl_response: CrawlResponse,
+    check_robots_txt=False,
+    previous: CrawlResponse | None = None,
+    resources: Resources | None = None,
 ) -> CrawlResponse:
-    async with get_session() as session:
+    """
+    fetch html metadata and syndication feeds for every indexed node.
+
+    if `previous` is given, nodes whose page fingerprint matches the one in the
+    previous crawl keep their previous metadata instead of being parsed again.
+    `resources` are used instead of opening a session and caches, like in `crawl`.
+    """
+    previous_by_at = {node.at: node for node in previous.nodes} if previous else {}
+
+    async with AsyncExitStack() as stack:
+        if resources is None:
+            resources = await stack.enter_async_context(open_resources(check_robots_txt))
+        robots = resources.robots if check_robots_txt else None
         tasks = []
         for node in crawl_response.nodes:
+            if robots is not None and node.indexed:
+                # every site's robots.txt is requested up front
+                robots.prefetch(node.at)
             tasks.append(
-                fetch_and_update_metadata(node, check_robots_txt=check_robots_txt, session=session)
+                fetch_and_update_metadata(
+                    node,
+                    robots=robots,
+                    session=resources.session,
+                    previous=previous_by_at.get(node.at),
+                    extraction_cache=resources.extraction_cache,
+                )
             )
-
         nodes = await asyncio.gather(*tasks)
 
-    crawl_response_dict = dataclasses.asdict(crawl_response)
-    crawl_response_dict["nodes"] = nodes
-    return CrawlResponse(**crawl_response_dict)
+    return dataclasses.replace(crawl_response, nodes=list(nodes))
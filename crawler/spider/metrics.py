@@ -0,0 +1,215 @@
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+Labels = tuple[tuple[str, str], ...]
+
+METRICS: dict[str, tuple[str, str]] = {
+    "webchain_nodes_total": ("counter", "nodes crawled, by whether they were indexed"),
+    "webchain_errors_total": ("counter", "nodes that failed, by phase and exception class"),
+    "webchain_requests_total": ("counter", "http requests made, including retries"),
+    "webchain_retries_total": ("counter", "http requests retried after a transient failure"),
+    "webchain_cache_requests_total": (
+        "counter",
+        "requests through the http cache, by result: hit, revalidated (304) or miss",
+    ),
+    "webchain_breaker_opened_total": (
+        "counter",
+        "times a host's circuit opened after too many consecutive failures",
+    ),
+    "webchain_breaker_rejections_total": (
+        "counter",
+        "requests failed fast because their host's circuit was open",
+    ),
+    "webchain_dead_hosts_skipped_total": (
+        "counter",
+        "nodes not fetched because their host was unreachable in a previous run",
+    ),
+    "webchain_prefetches_total": (
+        "counter",
+        "pages of a previous crawl fetched ahead of the traversal, by whether the traversal"
+        " used them, fetched them itself (dropped) or didn't follow them (discarded)",
+    ),
+    "webchain_retry_budget_exhausted_total": (
+        "counter",
+        "retries skipped because the run's retry budget ran out",
+    ),
+    "webchain_bytes_received_total": (
+        "counter",
+        "response body bytes read from the network, compressed if the server compressed them",
+    ),
+    "webchain_bytes_decoded_total": (
+        "counter",
+        "response body bytes read from the network, after decompression",
+    ),
+    "webchain_responses_by_encoding_total": (
+        "counter",
+        "responses read from the network, by the content coding of their body",
+    ),
+    "webchain_bodies_truncated_total": (
+        "counter",
+        "response bodies whose download stopped early, at the end of the head or the size cap",
+    ),
+    "webchain_nodes_restored_total": (
+        "counter",
+        "nodes of a resumed crawl taken from its checkpoint instead of being crawled again",
+    ),
+    "webchain_metadata_reused_total": (
+        "counter",
+        "nodes whose metadata was carried over from a previous crawl",
+    ),
+    "webchain_watch_cycles_total": (
+        "counter",
+        "recrawls by `webchain watch`, by outcome: changed, unchanged or failed",
+    ),
+    "webchain_phase_duration_seconds_total": (
+        "counter",
+        "wall time spent in each phase, summed over the runs of a long running command",
+    ),
+    "webchain_cache_hit_ratio": (
+        "gauge",
+        "fraction of cacheable requests answered from the cache, including 304s",
+    ),
+    "webchain_run_duration_seconds": ("gauge", "wall time of the whole run"),
+    "webchain_run_timestamp_seconds": ("gauge", "unix time the run finished"),
+    "webchain_run_success": ("gauge", "1 if the run finished without an error"),
+}
+
+OnPhase = Callable[[str, bool], None]
+"""called with the phase name, and True when entering or False when leaving it"""
+
+
+def write_atomically(path: str | os.PathLike, data: str) -> None:
+    """
+    write `data` to `path` so that a reader sees either the old or the new
+    file, never a half written one
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def as_labels(labels: dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """
+    counters and gauges collected over a single cli run, written out once at
+    the end with `write`
+    """
+
+    def __init__(self):
+        self.values: dict[str, dict[Labels, float]] = defaultdict(dict)
+        self.phase_listeners: list[OnPhase] = []
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        series = self.values[name]
+        key = as_labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self.values[name][as_labels(labels)] = value
+
+    def get(self, name: str, **labels) -> float:
+        return self.values.get(name, {}).get(as_labels(labels), 0)
+
+    def merge(self, values: dict) -> None:
+        """add in the counters of another process, as given by its `to_json`"""
+        for name, series in values.items():
+            for sample in series:
+                self.inc(name, sample["value"], **sample["labels"])
+
+    def total(self, name: str) -> float:
+        return sum(self.values.get(name, {}).values())
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """time the enclosed block as `name`. nested phases are timed separately."""
+        for listener in self.phase_listeners:
+            listener(name, True)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("webchain_phase_duration_seconds_total", time.perf_counter() - t0, phase=name)
+            for listener in self.phase_listeners:
+                listener(name, False)
+
+    def finish(self, command: str, success: bool) -> None:
+        """record the run-level gauges"""
+        cached = self.total("webchain_cache_requests_total")
+        if cached:
+            hits = self.get("webchain_cache_requests_total", result="hit") + self.get(
+                "webchain_cache_requests_total", result="revalidated"
+            )
+            self.set("webchain_cache_hit_ratio", hits / cached)
+        now = time.time()
+        self.set("webchain_run_duration_seconds", now - self.started, command=command)
+        self.set("webchain_run_timestamp_seconds", now, command=command)
+        self.set("webchain_run_success", int(success), command=command)
+
+    def to_openmetrics(self) -> str:
+        """text exposition format, as read by the node_exporter textfile collector"""
+
+        def format_labels(labels: Labels) -> str:
+            if not labels:
+                return ""
+            escaped = (
+                (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for k, v in labels
+            )
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+        def format_value(value: float) -> str:
+            return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+        lines = []
+        for name, (kind, help) in METRICS.items():
+            series = self.values.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        return {
+            name: [
+                {"labels": dict(labels), "value": value} for labels, value in sorted(series.items())
+            ]
+            for name, series in self.values.items()
+            if series
+        }
+
+    def write(self, path: str | os.PathLike) -> None:
+        """
+        write to `path` atomically, so that a collector never reads a half
+        written file. `.json` paths get a json report, anything else the text
+        format.
+        """
+        path = Path(path)
+        if path.suffix == ".json":
+            data = json.dumps(self.to_json(), indent="\t") + "\n"
+        else:
+            data = self.to_openmetrics()
+        write_atomically(path, data)
+
+
+metrics = Metrics()
+"""metrics of the current run"""
@@ -0,0 +1,115 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Generic, Iterable, TypeVar
+
+from spider.contracts import CrawledNode
+from spider.metrics import metrics
+
+T = TypeVar("T")
+
+
+class PreviousTree:
+    """the nodes of a previous crawl, and which of them the traversal still follows"""
+
+    def __init__(self):
+        self.children: dict[str, list[str]] = {}
+        self.followed: set[str] = set()
+
+    def add(self, node: CrawledNode) -> None:
+        if node.parent is not None:
+            self.children.setdefault(node.parent, []).append(node.at)
+
+    def settle(self, parent: str, children: Iterable[str]) -> list[str]:
+        """
+        the nodes that were children of `parent` in the previous crawl, but
+        aren't followed from it or any node settled before it, since the
+        traversal is unlikely to reach them anymore. their previous
+        descendants aren't settled by anyone then, so they are included too,
+        down to those followed from elsewhere.
+        """
+        self.followed.update(children)
+        unfollowed = []
+        stack = self.children.pop(parent, [])
+        while stack:
+            at = stack.pop()
+            if at in self.followed:
+                continue
+            stack.extend(self.children.pop(at, []))
+            unfollowed.append(at)
+        return unfollowed
+
+
+class Prefetcher(Generic[T]):
+    """
+    fetches the nodes of a previous crawl before the traversal discovers them.
+
+    the traversal can only fetch a node once its parent has been fetched and
+    parsed, so its wall time grows with the depth of the tree. nodes that were
+    in the previous crawl are likely still there, so they are all fetched at
+    once, at most `concurrency` at a time, shallowest first. the traversal
+    `take`s a node's prefetch when it reaches the node. once it knows which
+    children it follows from a node, it `settle`s the node, and the prefetches
+    of the node's previous children it doesn't follow are cancelled, along
+    with their previous subtrees. a sharded crawl settles nodes in its
+    coordinator, which tells the workers what to `discard`. whatever is left
+    over is cancelled by `close`.
+    """
+
+    def __init__(self, fetch: Callable[[CrawledNode], Awaitable[T]], concurrency: int = 16):
+        self.fetch = fetch
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks: dict[str, asyncio.Task[T]] = {}
+        self.started: set[str] = set()
+        self.previous = PreviousTree()
+
+    @classmethod
+    def from_env(cls, fetch: Callable[[CrawledNode], Awaitable[T]]) -> "Prefetcher[T]":
+        return cls(fetch, int(os.environ.get("WEBCHAIN_PREFETCH_CONCURRENCY", "16")))
+
+    def start(self, nodes: Iterable[CrawledNode]) -> None:
+        for node in sorted(nodes, key=lambda node: node.depth):
+            if node.at not in self.tasks:
+                self.tasks[node.at] = asyncio.create_task(self.run(node))
+                self.previous.add(node)
+
+    async def run(self, node: CrawledNode) -> T:
+        async with self.semaphore:
+            self.started.add(node.at)
+            return await self.fetch(node)
+
+    def take(self, at: str) -> asyncio.Task[T] | None:
+        """
+        the prefetch of `at`, or None if there is none. a prefetch still
+        waiting for its turn is dropped, since the traversal fetching `at`
+        itself is quicker than waiting.
+        """
+        task = self.tasks.pop(at, None)
+        if task is None:
+            return None
+        if at not in self.started:
+            task.cancel()
+            metrics.inc("webchain_prefetches_total", result="dropped")
+            return None
+        metrics.inc("webchain_prefetches_total", result="used")
+        return task
+
+    def settle(self, parent: str, children: Iterable[str]) -> None:
+        """cancel the prefetches `PreviousTree.settle` finds unfollowed"""
+        self.discard(self.previous.settle(parent, children))
+
+    def discard(self, unfollowed: Iterable[str]) -> None:
+        """cancel the prefetches of nodes the traversal is unlikely to reach anymore"""
+        for at in unfollowed:
+            task = self.tasks.pop(at, None)
+            if task is not None:
+                task.cancel()
+                metrics.inc("webchain_prefetches_total", result="discarded")
+
+    async def close(self) -> None:
+        """cancel the prefetches of nodes the traversal didn't reach"""
+        for task in self.tasks.values():
+            task.cancel()
+        if self.tasks:
+            metrics.inc("webchain_prefetches_total", len(self.tasks), result="discarded")
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
@@ -0,0 +1,180 @@
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import Iterator
+
+from spider.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    samples the stacks of every thread, or only of `thread_id`, from a
+    background thread every `interval` seconds. each stack starts with the
+    name of its thread, so that a crawl running next to a ui loop shows up as
+    a tree of its own.
+
+    the event loop runs the current task's coroutines on the thread's own
+    stack, so sampling the thread running the loop attributes time to
+    whichever coroutine is executing, and time spent waiting on the network to
+    the selector.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int | None = None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == threading.get_ident():
+                continue
+            if self.thread_id is not None and thread_id != self.thread_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread {thread_id}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def collapsed(self) -> str:
+        """one `frame;frame;frame count` line per stack, as read by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@dataclass
+class PhaseAllocations:
+    phase: str
+    net: int
+    """bytes still allocated at the end of the phase that weren't at its start"""
+    peak: int
+    """highest traced memory during the phase"""
+    top: list[tracemalloc.StatisticDiff] = field(default_factory=list)
+
+
+class AllocationTracker:
+    """
+    takes tracemalloc snapshots when entering and leaving each metrics phase,
+    keeping the lines that allocated the most in between
+    """
+
+    def __init__(self, top: int = 25, frames: int = 1):
+        self.top = top
+        self.frames = frames
+        self.open: dict[str, tuple[tracemalloc.Snapshot, int]] = {}
+        self.phases: list[PhaseAllocations] = []
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ]
+        )
+
+    def on_phase(self, name: str, entering: bool) -> None:
+        if not tracemalloc.is_tracing():
+            return
+        if entering:
+            tracemalloc.reset_peak()
+            self.open[name] = (self.snapshot(), tracemalloc.get_traced_memory()[0])
+            return
+
+        if name not in self.open:
+            return
+        before, traced_before = self.open.pop(name)
+        traced, peak = tracemalloc.get_traced_memory()
+        diff = self.snapshot().compare_to(before, "lineno")
+        self.phases.append(
+            PhaseAllocations(
+                phase=name,
+                net=traced - traced_before,
+                peak=peak,
+                top=[stat for stat in diff if stat.size_diff > 0][: self.top],
+            )
+        )
+
+    def start(self) -> None:
+        tracemalloc.start(self.frames)
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+
+    def report(self) -> str:
+        def kib(x: int) -> str:
+            return f"{x / 1024:.1f} KiB"
+
+        lines = []
+        for phase in self.phases:
+            lines.append(f"phase {phase.phase}: net {kib(phase.net)}, peak {kib(phase.peak)}")
+            for stat in phase.top:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"  {kib(stat.size_diff):>12} {stat.count_diff:>+8} blocks"
+                    f"  {frame.filename}:{frame.lineno}"
+                )
+            lines.append("")
+        return "\n".join(lines)
+
+
+@contextmanager
+def profiled(prefix: str, interval: float = 0.005, top: int = 25) -> Iterator[None]:
+    """
+    profile the enclosed block, writing `{prefix}.collapsed` with sampled
+    stacks and `{prefix}.alloc.txt` with the top allocations of each phase
+    """
+    sampler = StackSampler(interval)
+    allocations = AllocationTracker(top)
+    metrics.phase_listeners.append(allocations.on_phase)
+    allocations.start()
+    sampler.start()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        allocations.stop()
+        metrics.phase_listeners.remove(allocations.on_phase)
+
+        with open(f"{prefix}.collapsed", "w") as f:
+            f.write(sampler.collapsed())
+        with open(f"{prefix}.alloc.txt", "w") as f:
+            f.write(allocations.report())
+        logger.warning(
+            f"profiled {time.perf_counter() - t0:.2f}s ({sampler.samples} samples), "
+            f"wrote {prefix}.collapsed and {prefix}.alloc.txt"
+        )
@@ -0,0 +1,172 @@
+import sys
+from dataclasses import dataclass
+from typing import Callable, TextIO
+
+from spider.contracts import CrawlResponse, CrawledNode
+
+Markup = list[str | tuple[str, str]]
+"""text as urwid markup: plain strings, or (attribute, string) pairs"""
+
+
+def error_name(error: Exception | str) -> str:
+    """class name of an index error, which reads back from json as "ClassName: message" """
+    if isinstance(error, str):
+        return error.split(":", 1)[0]
+    return type(error).__name__
+
+
+def node_markup(node: CrawledNode, nominations_limit: int, cached: bool = False) -> Markup:
+    """the row of a crawled node"""
+    parts: Markup = [node.at]
+    if node.depth == 0:
+        parts.append(("dim", f" (limit={nominations_limit})"))
+    if cached:
+        parts.append(("dim", " (cached)"))
+    elif node.fetch_duration is not None and node.fetch_duration > 3:
+        parts.append(("dim", f" (took {node.fetch_duration:.1f}s)"))
+    if node.index_error:
+        parts.append(("error", f" (not crawled: {error_name(node.index_error)})"))
+    return parts
+
+
+def pending_markup(at: str) -> Markup:
+    """the row of a node that is still being crawled"""
+    return [("dim", at)]
+
+
+def unqualified_markup(prefix: str, url: str) -> Markup:
+    return [("dim", prefix), ("unqualified", "unqualified "), url]
+
+
+def plain(markup: Markup) -> str:
+    return "".join(part if isinstance(part, str) else part[1] for part in markup)
+
+
+@dataclass
+class _Frame:
+    at: str | None
+    """None for the sentinel above the seed"""
+    depth: int
+    indent: str
+    """box drawing for the ancestors between the seed and this node"""
+    is_last: bool
+    written: bool = False
+    next_child: int = 0
+
+
+class TreeRenderer:
+    """
+    renders the crawl tree as plain text from crawl callbacks, in the same
+    layout as the tree view but without a terminal.
+
+    rows are written in display order as soon as they and every row above
+    them are final: a node's row once it completed, the rows of its
+    unqualified nominations once all of its children's subtrees have been
+    written. whatever is still pending is written by `finish`.
+
+    nodes at `recursion_limit` are leaves, since the crawl doesn't follow
+    their children.
+    """
+
+    def __init__(self, out: TextIO | None = None, recursion_limit: int = 1000):
+        self.out = out if out is not None else sys.stdout
+        self.recursion_limit = recursion_limit
+        self.markup: dict[str, Markup] = {}
+        self.completed: dict[str, CrawledNode] = {}
+        self.started: dict[str | None, list[str]] = {}
+        """children in the order they were started, by parent"""
+        self.cached: set[str] = set()
+        self.stack = [_Frame(None, -1, "", True, written=True)]
+
+    def on_node_start(self, at: str, parent: str | None, depth: int) -> None:
+        self.started.setdefault(parent, []).append(at)
+        self.advance()
+
+    def on_cache_hit(self, url: str) -> None:
+        self.cached.add(url.rstrip("/"))
+
+    def on_node_complete(self, node: CrawledNode, nominations_limit: int) -> None:
+        self.completed[node.at] = node
+        self.markup[node.at] = node_markup(node, nominations_limit, node.at in self.cached)
+        self.advance()
+
+    def callbacks(self) -> dict[str, Callable]:
+        """keyword arguments for `crawl`"""
+        return dict(
+            on_node_start=self.on_node_start,
+            on_node_complete=self.on_node_complete,
+            on_cache_hit=self.on_cache_hit,
+        )
+
+    def children(self, frame: _Frame, final: bool) -> list[str] | None:
+        """children of the node at `frame`, or None if they aren't known yet"""
+        if final or frame.at is None:
+            return self.started.get(frame.at, [])
+        if frame.depth >= self.recursion_limit:
+            return []
+        node = self.completed.get(frame.at)
+        return node.children if node is not None else None
+
+    def write(self, markup: Markup) -> None:
+        self.out.write(plain(markup) + "\n")
+
+    def advance(self, final: bool = False) -> None:
+        """write every row that is final, or with `final` every remaining row"""
+        wrote = False
+        while self.stack:
+            frame = self.stack[-1]
+            if not frame.written:
+                if frame.at not in self.markup and not final:
+                    break
+                prefix = ""
+                if frame.depth > 0:
+                    prefix = frame.indent + ("└── " if frame.is_last else "├── ")
+                self.write([prefix, *self.markup.get(frame.at, pending_markup(frame.at))])
+                frame.written = wrote = True
+
+            children = self.children(frame, final)
+            if children is None:
+                break
+            indent = frame.indent + ("    " if frame.is_last else "│   ") if frame.depth > 0 else ""
+            if frame.next_child < len(children):
+                at = children[frame.next_child]
+                frame.next_child += 1
+                is_last = frame.next_child == len(children)
+                self.stack.append(_Frame(at, frame.depth + 1, indent, is_last))
+                continue
+
+            if frame.at is None and not final:
+                # the seed is the only root, but nothing says so
+                break
+            node = self.completed.get(frame.at)
+            for url in node.unqualified if node is not None else []:
+                self.write(unqualified_markup(indent + "    ", url))
+                wrote = True
+            self.stack.pop()
+
+        if wrote:
+            self.out.flush()
+
+    def finish(self) -> None:
+        self.advance(final=True)
+
+
+def replay(response: CrawlResponse, callbacks: dict[str, Callable]) -> None:
+    """call the `crawl` callbacks in `callbacks` for every node of a finished crawl, in order"""
+    on_node_start = callbacks.get("on_node_start")
+    on_node_complete = callbacks.get("on_node_complete")
+    on_cache_hit = callbacks.get("on_cache_hit")
+    for node in response.nodes:
+        if on_node_start:
+            on_node_start(node.at, node.parent, node.depth)
+        if on_cache_hit and node.timing is not None and node.timing.cache_hit:
+            on_cache_hit(node.at)
+        if on_node_complete:
+            on_node_complete(node, response.nominations_limit)
+
+
+def render_response(response: CrawlResponse, out: TextIO | None = None) -> None:
+    """write the tree of an already finished crawl"""
+    renderer = TreeRenderer(out)
+    replay(response, renderer.callbacks())
+    renderer.finish()
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+import ssl
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from http import HTTPStatus
+from pathlib import Path
+from typing import AsyncContextManager, NamedTuple, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+import aiosqlite
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from spider.cached_session import CachedResponse
+from spider.transport import Transport
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayMissError(aiohttp.ClientError):
+    """the requested url is not part of the capture being replayed"""
+
+
+@dataclass
+class Exchange:
+    """a single recorded request, either a response or the error raised instead"""
+
+    status: Optional[int]
+    headers: dict[str, str]
+    body: Optional[bytes]
+    error_type: Optional[str]
+    error_message: Optional[str]
+    elapsed: float
+
+
+class Capture:
+    """
+    sqlite store of every exchange made during a crawl, in request order per url
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db: Optional[aiosqlite.Connection] = None
+        self.lock = asyncio.Lock()
+        self.seq: dict[str, int] = {}
+
+    async def ensure_db(self) -> aiosqlite.Connection:
+        async with self.lock:
+            if self.db is None:
+                self.db = await aiosqlite.connect(self.path)
+                await self.db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS exchanges (
+                        url TEXT,
+                        seq INTEGER,
+                        status INTEGER,
+                        headers TEXT,
+                        body BLOB,
+                        error_type TEXT,
+                        error_message TEXT,
+                        elapsed REAL,
+                        recorded_at REAL,
+                        PRIMARY KEY (url, seq)
+                    )
+                    """
+                )
+                await self.db.commit()
+                logger.debug(f"using capture at {self.path}")
+        return self.db
+
+    async def save(self, url: str, exchange: Exchange) -> None:
+        db = await self.ensure_db()
+        async with self.lock:
+            if url not in self.seq:
+                # append to earlier recordings of the same url, e.g. a crawl
+                # followed by an enrich
+                async with db.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM exchanges WHERE url = ?", (url,)
+                ) as cur:
+                    row = await cur.fetchone()
+                self.seq[url] = row[0]
+            seq = self.seq[url]
+            self.seq[url] += 1
+        await db.execute(
+            "INSERT OR REPLACE INTO exchanges (url, seq, status, headers, body, error_type, error_message, elapsed, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                url,
+                seq,
+                exchange.status,
+                json.dumps(exchange.headers),
+                exchange.body,
+                exchange.error_type,
+                exchange.error_message,
+                exchange.elapsed,
+                time.time(),
+            ),
+        )
+        await db.commit()
+
+    async def load(self, url: str) -> list[Exchange]:
+        db = await self.ensure_db()
+        async with db.execute(
+            "SELECT status, headers, body, error_type, error_message, elapsed FROM exchanges WHERE url = ? ORDER BY seq",
+            (url,),
+        ) as cur:
+            rows = await cur.fetchall()
+        return [
+            Exchange(
+                status=status,
+                headers=json.loads(headers) if headers else {},
+                body=body,
+                error_type=error_type,
+                error_message=error_message,
+                elapsed=elapsed or 0.0,
+            )
+            for status, headers, body, error_type, error_message, elapsed in rows
+        ]
+
+    async def close(self) -> None:
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+
+def response_error(url: str, status: int, headers: dict[str, str]) -> aiohttp.ClientResponseError:
+    request_info = aiohttp.RequestInfo(URL(url), "GET", CIMultiDictProxy(CIMultiDict()), URL(url))
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    return aiohttp.ClientResponseError(
+        request_info, (), status=status, message=reason, headers=CIMultiDict(headers)
+    )
+
+
+class ReplayedConnectionKey(NamedTuple):
+    host: str
+    port: Optional[int]
+    is_ssl: bool
+    ssl: bool
+    proxy: None
+    proxy_auth: None
+    proxy_headers_hash: None
+
+
+def rebuild_error(url: str, error_type: str, message: str) -> Exception:
+    """reconstruct the exception recorded for `url`, as closely as its type allows"""
+    parsed = urlparse(url)
+    is_ssl = parsed.scheme == "https"
+    key = ReplayedConnectionKey(
+        host=parsed.hostname or "",
+        port=parsed.port or (443 if is_ssl else 80),
+        is_ssl=is_ssl,
+        ssl=True,
+        proxy=None,
+        proxy_auth=None,
+        proxy_headers_hash=None,
+    )
+
+    match error_type:
+        case "ClientConnectorDNSError":
+            return aiohttp.ClientConnectorDNSError(key, OSError(None, message))
+        case "ClientConnectorCertificateError":
+            return aiohttp.ClientConnectorCertificateError(
+                key, ssl.SSLCertVerificationError(message)
+            )
+        case "ClientConnectorSSLError" | "ClientSSLError":
+            return aiohttp.ClientConnectorSSLError(key, ssl.SSLError(None, message))
+        case "ClientConnectorError":
+            return aiohttp.ClientConnectorError(key, OSError(None, message))
+        case (
+            "TimeoutError" | "ServerTimeoutError" | "ConnectionTimeoutError" | "SocketTimeoutError"
+        ):
+            return aiohttp.ServerTimeoutError(message)
+        case "ServerDisconnectedError":
+            return aiohttp.ServerDisconnectedError(message)
+        case "ClientPayloadError":
+            return aiohttp.ClientPayloadError(message)
+        case "InvalidURL" | "InvalidUrlClientError":
+            return aiohttp.InvalidURL(url)
+        case _:
+            return aiohttp.ClientConnectionError(f"{error_type}: {message}")
+
+
+class RecordingClientSession:
+    """
+    drop-in replacement for aiohttp.ClientSession, making requests with
+    `session`, any transport
+
+    records every response, including error statuses and exceptions, into a
+    Capture that ReplayClientSession can serve later
+    """
+
+    def __init__(self, path: Path, session: Transport):
+        self.session = session
+        self.capture = Capture(path)
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs) -> AsyncContextManager[CachedResponse]:
+        t0 = time.monotonic()
+        try:
+            async with self.session.get(url, **kwargs) as resp:
+                body = await resp.read()
+                headers = {k: v for k, v in resp.headers.items()}
+                status = resp.status
+        except aiohttp.ClientResponseError as e:
+            # transports raise for error statuses, which are recorded as responses
+            headers = {k: v for k, v in (e.headers or {}).items()}
+            await self.capture.save(
+                url, Exchange(e.status, headers, b"", None, None, time.monotonic() - t0)
+            )
+            raise
+        except Exception as e:
+            message = getattr(e, "strerror", None) or str(e)
+            await self.capture.save(
+                url,
+                Exchange(None, {}, None, type(e).__name__, message, time.monotonic() - t0),
+            )
+            raise
+
+        await self.capture.save(
+            url, Exchange(status, headers, body, None, None, time.monotonic() - t0)
+        )
+        yield CachedResponse(status, headers, body)
+
+    async def close(self):
+        await self.session.close()
+        await self.capture.close()
+
+    async def __aenter__(self):
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.__aexit__(exc_type, exc, tb)
+        await self.capture.close()
+
+
+class ReplayClientSession:
+    """
+    drop-in replacement for aiohttp.ClientSession
+
+    serves every request from a Capture without touching the network. repeated
+    requests for the same url are answered in recorded order, repeating the
+    last exchange once the recording runs out.
+    """
+
+    def __init__(self, path: Path, latency: bool = False, raise_for_status: bool = False):
+        if not Path(path).exists():
+            raise FileNotFoundError(f"no capture at {path}")
+        self.capture = Capture(path)
+        self.latency = latency
+        self.raise_for_status = raise_for_status
+        self.exchanges: dict[str, list[Exchange]] = {}
+        self.served: dict[str, int] = {}
+
+    async def next_exchange(self, url: str) -> Exchange:
+        if url not in self.exchanges:
+            self.exchanges[url] = await self.capture.load(url)
+        exchanges = self.exchanges[url]
+        if not exchanges:
+            raise ReplayMissError(f"{url} was not recorded")
+        i = self.served.get(url, 0)
+        self.served[url] = i + 1
+        return exchanges[min(i, len(exchanges) - 1)]
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs) -> AsyncContextManager[CachedResponse]:
+        exchange = await self.next_exchange(url)
+
+        if self.latency:
+            await asyncio.sleep(exchange.elapsed)
+
+        if exchange.error_type is not None:
+            raise rebuild_error(url, exchange.error_type, exchange.error_message or "")
+
+        assert exchange.status is not None
+        if self.raise_for_status and exchange.status >= 400:
+            raise response_error(url, exchange.status, exchange.headers)
+
+        yield CachedResponse(exchange.status, exchange.headers, exchange.body or b"")
+
+    async def close(self):
+        await self.capture.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.capture.close()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 from urllib import robotparser
@@ -6,6 +7,8 @@ from urllib.parse import urljoin
 import aiohttp
 import tenacity
 
+from spider.circuit import backoff
+
 logger = logging.getLogger(__name__)
 
 
@@ -35,28 +38,72 @@ async def get_robots_txt(
         return None
 
 
+async def fetch_robots_txt(url: str, session: aiohttp.ClientSession) -> str | None:
+    """robots.txt of the site `url` is on, or None if there is none or it couldn't be fetched"""
+    attempts = int(os.environ.get("WEBCHAIN_NETWORK_ATTEMPTS", "5"))
+    retrying = tenacity.AsyncRetrying(
+        wait=backoff(),
+        stop=tenacity.stop_after_attempt(attempts),
+        retry_error_callback=lambda retry_state: None,  # if all attempts fail, assume its ok
+    )
+    async for attempt in retrying:
+        with attempt:
+            return await get_robots_txt(url, session)
+
+    return None
+
+
+def can_fetch(robots_txt: str | None, user_agent: str, url: str) -> bool:
+    if robots_txt is None:
+        return True  # assume allowed if we can't fetch robots.txt
+
+    rp = robotparser.RobotFileParser()
+    rp.parse(robots_txt.splitlines())
+    return rp.can_fetch(user_agent, url)
+
+
 async def allowed_by_robots_txt(
     url: str,
     user_agent: str,
     session: aiohttp.ClientSession,
 ) -> bool:
-    async def run() -> bool:
-        robots_txt = await get_robots_txt(url, session)
-        if robots_txt is None:
-            return True  # assume allowed if we can't fetch robots.txt
+    return can_fetch(await fetch_robots_txt(url, session), user_agent, url)
 
+
+class RobotsChecker:
+    """
+    checks urls against robots.txt, fetching it only once per site.
+
+    `prefetch` starts fetching a site's robots.txt in the background, so
+    that it can be requested as soon as the site is discovered and be ready,
+    or at least underway, by the time a page on it is checked.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, user_agent: str):
+        self.session = session
+        self.user_agent = user_agent
+        self.sites: dict[str, asyncio.Task[robotparser.RobotFileParser | None]] = {}
+
+    async def fetch(self, url: str) -> robotparser.RobotFileParser | None:
+        robots_txt = await fetch_robots_txt(url, self.session)
+        if robots_txt is None:
+            return None
         rp = robotparser.RobotFileParser()
         rp.parse(robots_txt.splitlines())
-        return rp.can_fetch(user_agent, url)
+        return rp
 
-    attempts = int(os.environ.get("WEBCHAIN_NETWORK_ATTEMPTS", "5"))
-    retrying = tenacity.AsyncRetrying(
-        wait=tenacity.wait_exponential(),
-        stop=tenacity.stop_after_attempt(attempts),
-        retry_error_callback=lambda retry_state: True,  # if all attempts fail, assume its ok
-    )
-    async for attempt in retrying:
-        with attempt:
-            return await run()
+    def prefetch(self, url: str) -> asyncio.Task[robotparser.RobotFileParser | None]:
+        site = urljoin(url, "/")
+        if site not in self.sites:
+            self.sites[site] = asyncio.create_task(self.fetch(url))
+        return self.sites[site]
+
+    async def allowed(self, url: str) -> bool:
+        # shielded, since many pages wait on the same site
+        rp = await asyncio.shield(self.prefetch(url))
+        return rp is None or rp.can_fetch(self.user_agent, url)
 
-    return True
+    async def close(self) -> None:
+        for task in self.sites.values():
+            task.cancel()
+        await asyncio.gather(*self.sites.values(), return_exceptions=True)
@@ -2,7 +2,13 @@ import dataclasses
 import json
 import logging
 
-from spider.crawl import CrawlResponse, CrawledNode
+from spider.contracts import (
+    CrawlResponse,
+    CrawledNode,
+    HtmlMetadata,
+    RequestTiming,
+    SyndicationFeed,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,13 +41,28 @@ def serialize(crawled: CrawlResponse, **kwargs) -> str:
     return json.dumps(data, **kwargs)
 
 
+def from_dict(cls, obj: dict):
+    """construct dataclass `cls` from `obj`, ignoring unknown keys"""
+    allowed_fields = {field.name for field in dataclasses.fields(cls)}
+    return cls(**{k: v for k, v in obj.items() if k in allowed_fields})
+
+
+def deserialize_node(obj: dict) -> CrawledNode:
+    node = from_dict(CrawledNode, obj)
+    if isinstance(node.html_metadata, dict):
+        node.html_metadata = from_dict(HtmlMetadata, node.html_metadata)
+    node.syndication_feeds = [
+        from_dict(SyndicationFeed, feed) if isinstance(feed, dict) else feed
+        for feed in node.syndication_feeds
+    ]
+    if isinstance(node.timing, dict):
+        node.timing = from_dict(RequestTiming, node.timing)
+    return node
+
+
 def deserialize(data: str) -> CrawlResponse:
     obj = json.loads(data)
-    allowed_fields = {field.name for field in dataclasses.fields(CrawledNode)}
-    nodes = [
-        CrawledNode(**{k: v for k, v in node.items() if k in allowed_fields})
-        for node in obj["nodes"]
-    ]
+    nodes = [deserialize_node(node) for node in obj["nodes"]]
 
     return CrawlResponse(
         nodes=nodes,
@@ -0,0 +1,564 @@
+"""
+crawling with several worker processes, possibly on several machines.
+
+a single crawl runs on one event loop, so parsing and tls handshakes cap its
+throughput whatever the network could do. here the coordinator owns the
+graph: which urls have been claimed, what the nominations limit is, and
+the nodes crawled so far. workers only fetch and parse. every host belongs
+to one shard, picked by a hash of the host, and every shard to one worker,
+so a host's connections, robots.txt and circuit breaker stay in one process.
+
+workers talk to the coordinator over tcp, one json message per line:
+
+    worker       coordinator
+    hello     ->                  with the coordinator's token
+              <-  welcome         the shard, seed, previous nodes of the shard,
+                                  recursion limit and share of the retry budget
+              <-  visit           a url to crawl, with its parent and depth
+              <-  discard         previous nodes no longer followed, not to prefetch
+    visited   ->                  the node, and its nominations in page order
+              <-  done            nothing left to crawl
+    bye       ->                  the worker's metrics
+
+a node's nominations are claimed by the coordinator when it is visited, the
+first node nominating a url becomes its parent. if a worker goes away, the
+visits it hadn't finished are handed to the next worker taking its shard.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import sys
+from dataclasses import dataclass, field
+from time import time
+
+from ordered_set import OrderedSet
+
+from spider.checkpoint import Checkpoint, Progress
+from spider.circuit import RetryBudget, host_of
+from spider.contracts import CrawlResponse, CrawledNode, OnNodeComplete, OnNodeStart
+from spider.crawl import (
+    Fetched,
+    Fetcher,
+    crawled_node,
+    node_nominations,
+    qualify,
+    to_iso_timestamp,
+    without_trailing_slash,
+)
+from spider.dead_hosts import get_dead_hosts
+from spider.extraction_cache import get_extraction_cache
+from spider.http import UA, get_session
+from spider.metrics import metrics
+from spider.prefetch import Prefetcher, PreviousTree
+from spider.robots import RobotsChecker
+from spider.serialize import deserialize_node, safe_asdict
+from spider.timing import format_timing_summary, summarize_timings
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 64 * 1024 * 1024
+"""longest message line, a node with all of its nominations"""
+
+
+class ShardedCrawlError(Exception):
+    pass
+
+
+def shard_of(url: str, shards: int) -> int:
+    """the shard the host of `url` belongs to, the same in every process"""
+    digest = hashlib.blake2b(host_of(url).encode(), digest_size=8).digest()
+    return int.from_bytes(digest) % shards
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"expected an address like 127.0.0.1:8700, not {address!r}")
+    return host.strip("[]"), int(port)
+
+
+async def send(writer: asyncio.StreamWriter, message: dict) -> None:
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+async def receive(reader: asyncio.StreamReader) -> dict | None:
+    """the next message, or None once the other side has closed the connection"""
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+@dataclass
+class Visit:
+    url: str
+    parent: str | None
+    depth: int
+
+    @property
+    def at(self) -> str:
+        return without_trailing_slash(self.url)
+
+
+@dataclass
+class Shard:
+    writer: asyncio.StreamWriter | None = None
+    """the worker's connection, None while no worker has the shard"""
+    waiting: list[Visit] = field(default_factory=list)
+    """visits for when a worker takes the shard"""
+    sent: dict[str, Visit] = field(default_factory=dict)
+    """visits the worker hasn't finished"""
+
+
+class Coordinator:
+    """
+    hands out the urls of a crawl to `shards` workers, and puts the nodes
+    they crawl together into one CrawlResponse, as `crawl` would return it
+    """
+
+    def __init__(
+        self,
+        seed_url: str,
+        shards: int,
+        token: str,
+        recursion_limit: int = 1000,
+        check_robots_txt: bool = False,
+        on_node_start: OnNodeStart | None = None,
+        on_node_complete: OnNodeComplete | None = None,
+        previous: CrawlResponse | None = None,
+        checkpoint: Checkpoint | None = None,
+        resume: bool = False,
+    ):
+        self.seed_url = seed_url
+        self.token = token
+        self.recursion_limit = recursion_limit
+        self.check_robots_txt = check_robots_txt
+        self.on_node_start = on_node_start
+        self.on_node_complete = on_node_complete
+        self.previous = previous
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.shards = [Shard() for _ in range(shards)]
+        self.seen: set[str] = set()
+        self.nominations_limit: int = sys.maxsize * 2 + 1
+        self.nodes: dict[str, CrawledNode] = {}
+        self.outstanding = 0
+        self.finished: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.connections: set[asyncio.Task] = set()
+        self.server: asyncio.Server | None = None
+        self.start = time()
+        self.retry_budget = RetryBudget.from_env().remaining
+        self.previous_tree = PreviousTree()
+        self.discarded: set[str] = set()
+        for node in previous.nodes if previous is not None else []:
+            if node.depth <= recursion_limit:
+                self.previous_tree.add(node)
+
+    async def listen(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """start accepting workers, returning the address they connect to"""
+        self.server = await asyncio.start_server(self.accept, host, port, limit=MESSAGE_LIMIT)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        progress = None
+        if self.checkpoint is not None:
+            progress = (
+                self.checkpoint.load(self.seed_url, self.recursion_limit) if self.resume else None
+            )
+            self.start = progress.start if progress is not None else time()
+            self.checkpoint.open(
+                self.seed_url, self.start, self.recursion_limit, resume=progress is not None
+            )
+        else:
+            self.start = time()
+        self.restore(progress)
+        return f"{host}:{port}"
+
+    def restore(self, progress: Progress | None) -> None:
+        """
+        claim the seed, or with the `progress` of an interrupted crawl, the
+        children of its nodes that weren't crawled yet
+        """
+        restored = progress.nodes if progress is not None else {}
+        if progress is not None and progress.nominations_limit is not None:
+            self.nominations_limit = progress.nominations_limit
+        stack = [Visit(self.seed_url, None, 0)]
+        while stack:
+            visit = stack.pop()
+            node = restored.get(visit.at)
+            if node is None:
+                self.claim(visit)
+                continue
+            self.seen.add(node.at)
+            self.nodes[node.at] = node
+            metrics.inc("webchain_nodes_restored_total")
+            if self.on_node_start:
+                self.on_node_start(node.at, node.parent, node.depth)
+            if self.on_node_complete:
+                self.on_node_complete(node, self.nominations_limit)
+            if self.previous is not None:
+                self.settle(node)
+            if node.depth < self.recursion_limit:
+                stack.extend(
+                    Visit(child, node.at, node.depth + 1) for child in reversed(node.children)
+                )
+        if self.outstanding == 0:
+            self.finished.set_result(None)
+
+    def claim(self, visit: Visit) -> None:
+        self.seen.add(visit.at)
+        self.outstanding += 1
+        if self.on_node_start:
+            self.on_node_start(visit.at, visit.parent, visit.depth)
+        shard = self.shards[shard_of(visit.url, len(self.shards))]
+        if shard.writer is None:
+            shard.waiting.append(visit)
+        else:
+            self.dispatch(shard, visit)
+
+    def dispatch(self, shard: Shard, visit: Visit) -> None:
+        shard.sent[visit.at] = visit
+        message = {"op": "visit", "url": visit.url, "parent": visit.parent, "depth": visit.depth}
+        shard.writer.write(json.dumps(message).encode() + b"\n")
+
+    def fail(self, error: Exception) -> None:
+        if not self.finished.done():
+            self.finished.set_exception(error)
+
+    def visited(self, shard: Shard, message: dict) -> None:
+        node = deserialize_node(message["node"])
+        visit = shard.sent.pop(node.at, None)
+        if visit is None or node.at in self.nodes:
+            # a visit handed out again, after its first worker went away
+            return
+
+        if node.depth == 0:
+            if not message["reachable"]:
+                self.fail(ValueError(f"starting url {self.seed_url} is unreachable"))
+                return
+            if message["nominations_limit"] is not None:
+                self.nominations_limit = message["nominations_limit"]
+
+        nominations = OrderedSet(message["nominations"])
+        node.children, node.unqualified = qualify(nominations, self.seen, self.nominations_limit)
+        self.nodes[node.at] = node
+        if self.checkpoint is not None:
+            self.checkpoint.record(node, self.nominations_limit)
+        if self.on_node_complete:
+            self.on_node_complete(node, self.nominations_limit)
+
+        if node.depth < self.recursion_limit:
+            for child in node.children:
+                self.claim(Visit(child, node.at, node.depth + 1))
+        if self.previous is not None:
+            self.settle(node)
+
+        self.outstanding -= 1
+        if self.outstanding == 0 and not self.finished.done():
+            self.finished.set_result(None)
+
+    def settle(self, node: CrawledNode) -> None:
+        """tell the workers which prefetches the traversal no longer follows after `node`"""
+        followed = node.children if node.depth < self.recursion_limit else []
+        unfollowed = self.previous_tree.settle(node.at, followed)
+        self.discarded.update(unfollowed)
+        by_shard: dict[int, list[str]] = {}
+        for at in unfollowed:
+            by_shard.setdefault(shard_of(at, len(self.shards)), []).append(at)
+        for index, discarded in by_shard.items():
+            writer = self.shards[index].writer
+            if writer is not None:
+                writer.write(json.dumps({"op": "discard", "at": discarded}).encode() + b"\n")
+
+    def retry_budget_share(self, index: int) -> int | None:
+        """the retries the worker on shard `index` may spend, None is unlimited"""
+        if self.retry_budget is None:
+            return None
+        share, rest = divmod(self.retry_budget, len(self.shards))
+        return share + (index < rest)
+
+    async def accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            await self.serve(reader, writer)
+        except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"worker connection failed: {type(e).__name__} {e}")
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        hello = await receive(reader)
+        if hello is None or not hmac.compare_digest(
+            str(hello.get("token", "")).encode(), self.token.encode()
+        ):
+            logger.warning("worker rejected, wrong token")
+            return
+        free = [i for i, shard in enumerate(self.shards) if shard.writer is None]
+        if not free or self.finished.done():
+            await send(writer, {"op": "done"})
+            return
+
+        index = free[0]
+        shard = self.shards[index]
+        shard.writer = writer
+        # without the nodes crawled or discarded while no worker had the shard
+        previous = [
+            {"at": node.at, "parent": node.parent, "depth": node.depth}
+            for node in (self.previous.nodes if self.previous else [])
+            if shard_of(node.at, len(self.shards)) == index
+            and node.at not in self.nodes
+            and node.at not in self.discarded
+        ]
+        logger.info(f"worker {hello.get('name')} took shard {index}")
+        await send(
+            writer,
+            {
+                "op": "welcome",
+                "shard": index,
+                "seed": self.seed_url,
+                "check_robots_txt": self.check_robots_txt,
+                "previous": previous,
+                "recursion_limit": self.recursion_limit,
+                "retry_budget": self.retry_budget_share(index),
+            },
+        )
+        waiting, shard.waiting = shard.waiting, []
+        for visit in waiting:
+            self.dispatch(shard, visit)
+
+        try:
+            while (message := await receive(reader)) is not None:
+                if message["op"] == "visited":
+                    self.visited(shard, message)
+                elif message["op"] == "failed":
+                    self.fail(ShardedCrawlError(f"{message['url']}: {message['error']}"))
+                elif message["op"] == "bye":
+                    metrics.merge(message["metrics"])
+                    return
+                await writer.drain()
+        finally:
+            shard.writer = None
+            if shard.sent:
+                logger.warning(
+                    f"worker on shard {index} went away with {len(shard.sent)} visits unfinished"
+                )
+            shard.waiting.extend(shard.sent.values())
+            shard.sent.clear()
+
+    def response(self) -> CrawlResponse:
+        """the crawled nodes in the order `crawl` returns them, depth first from the seed"""
+        nodes = []
+        stack = [without_trailing_slash(self.seed_url)]
+        while stack:
+            node = self.nodes[stack.pop()]
+            nodes.append(node)
+            stack.extend(
+                reversed(
+                    [
+                        child
+                        for child in node.children
+                        if child in self.nodes and self.nodes[child].parent == node.at
+                    ]
+                )
+            )
+        return CrawlResponse(
+            nodes=nodes,
+            nominations_limit=self.nominations_limit,
+            start=to_iso_timestamp(self.start),
+            end=to_iso_timestamp(time()),
+        )
+
+    async def finish(self) -> CrawlResponse:
+        """wait for the crawl to finish, then let the workers go"""
+        try:
+            await self.finished
+            if self.checkpoint is not None:
+                self.checkpoint.close(done=True)
+            response = self.response()
+            for shard in self.shards:
+                if shard.writer is not None:
+                    await send(shard.writer, {"op": "done"})
+        except BaseException:
+            # hanging up stops the workers too
+            for shard in self.shards:
+                if shard.writer is not None:
+                    shard.writer.close()
+            raise
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+            self.server.close()
+            # the workers hang up after sending their metrics
+            if self.connections:
+                await asyncio.wait(self.connections, timeout=30)
+            for task in self.connections:
+                task.cancel()
+        logger.info("timing summary:\n" + format_timing_summary(summarize_timings(response.nodes)))
+        return response
+
+
+async def run_worker(address: str, token: str, name: str | None = None) -> None:
+    """crawl the visits the coordinator at `address` hands out, until it is done"""
+    host, port = parse_address(address)
+    reader, writer = await asyncio.open_connection(host, port, limit=MESSAGE_LIMIT)
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    await send(writer, {"op": "hello", "token": token, "name": name})
+    welcome = await receive(reader)
+    if welcome is None or welcome["op"] != "welcome":
+        writer.close()
+        return
+    seed_url = welcome["seed"]
+    lock = asyncio.Lock()
+    tasks: set[asyncio.Task] = set()
+
+    async def visit(fetcher: Fetcher, prefetcher: Prefetcher[Fetched], message: dict) -> None:
+        url, parent, depth = message["url"], message["parent"], message["depth"]
+        at = without_trailing_slash(url)
+        try:
+            prefetched = prefetcher.take(at)
+            if prefetched is not None:
+                fetched = await prefetched
+            else:
+                fetched = await fetcher.fetch(url, parent, depth)
+            doc = await fetcher.parse(at, fetched)
+            node = crawled_node(at, parent, depth, fetched, children=[], unqualified=[])
+            reply = {
+                "op": "visited",
+                "node": safe_asdict(node),
+                "nominations": list(node_nominations(doc, seed_url)) if doc else [],
+                "reachable": fetched.body is not None,
+                "nominations_limit": doc.nominations_limit if doc else None,
+            }
+        except Exception as e:
+            # fails the crawl, like an exception in `crawl` would
+            logger.exception(f"crawling {url} failed")
+            reply = {"op": "failed", "url": url, "error": f"{type(e).__name__}: {e}"}
+        async with lock:
+            await send(writer, reply)
+
+    async with (
+        get_session() as session,
+        get_extraction_cache() as extraction_cache,
+        get_dead_hosts() as dead_hosts,
+    ):
+        robots = RobotsChecker(session, user_agent=UA) if welcome["check_robots_txt"] else None
+        fetcher = Fetcher(
+            session,
+            extraction_cache,
+            dead_hosts,
+            robots,
+            retry_budget=RetryBudget(welcome["retry_budget"]),
+        )
+        prefetcher = Prefetcher.from_env(
+            lambda node: fetcher.fetch(node.at, node.parent, node.depth)
+        )
+        prefetcher.start(
+            CrawledNode(
+                at=n["at"], parent=n["parent"], children=[], depth=n["depth"], indexed=False
+            )
+            for n in welcome["previous"]
+            if n["depth"] <= welcome["recursion_limit"]
+        )
+        try:
+            while (message := await receive(reader)) is not None:
+                if message["op"] == "done":
+                    break
+                if message["op"] == "discard":
+                    prefetcher.discard(message["at"])
+                    continue
+                task = asyncio.create_task(visit(fetcher, prefetcher, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await prefetcher.close()
+            if robots is not None:
+                await robots.close()
+
+    try:
+        await send(writer, {"op": "bye", "metrics": metrics.to_json()})
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+def worker_process(address: str, token: str, name: str) -> None:
+    level = logging._nameToLevel.get(os.environ.get("LOG_LEVEL", "").upper(), logging.INFO)
+    logging.basicConfig(level=level, format=f"{name}: %(filename)s: %(message)s")
+    asyncio.run(run_worker(address, token, name))
+
+
+async def crawl_sharded(
+    seed_url: str,
+    workers: int,
+    recursion_limit: int = 1000,
+    check_robots_txt: bool = False,
+    on_node_start: OnNodeStart | None = None,
+    on_node_complete: OnNodeComplete | None = None,
+    previous: CrawlResponse | None = None,
+    listen: str | None = None,
+    token: str | None = None,
+    checkpoint: Checkpoint | None = None,
+    resume: bool = False,
+) -> CrawlResponse:
+    """
+    crawl like `crawl`, split over `workers` worker processes.
+
+    by default the workers are started on this machine. with `listen`, an
+    address like 0.0.0.0:8700, none are started, and instead `workers`
+    workers are expected to connect with `webchain worker ADDRESS`, giving
+    the same `token`.
+    """
+    token = token or secrets.token_urlsafe(16)
+    coordinator = Coordinator(
+        seed_url,
+        workers,
+        token,
+        recursion_limit=recursion_limit,
+        check_robots_txt=check_robots_txt,
+        on_node_start=on_node_start,
+        on_node_complete=on_node_complete,
+        previous=previous,
+        checkpoint=checkpoint,
+        resume=resume,
+    )
+    address = await coordinator.listen(*parse_address(listen or "127.0.0.1:0"))
+
+    processes = []
+    if listen is None:
+        context = multiprocessing.get_context("spawn")
+        for i in range(workers):
+            process = context.Process(
+                target=worker_process, args=(address, token, f"worker-{i}"), daemon=True
+            )
+            process.start()
+            processes.append(process)
+    else:
+        logger.warning(f"waiting for {workers} workers at {address}")
+
+    async def watch(process) -> None:
+        await asyncio.to_thread(process.join)
+        if process.exitcode != 0:
+            coordinator.fail(
+                ShardedCrawlError(f"{process.name} exited with status {process.exitcode}")
+            )
+
+    watchers = [asyncio.create_task(watch(process)) for process in processes]
+    try:
+        return await coordinator.finish()
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+        await asyncio.gather(*watchers, return_exceptions=True)
@@ -1,7 +1,7 @@
 import dataclasses
 from typing import Set
 from spider.error import ParentNotCrawledError
-from spider.crawl import CrawlResponse, CrawledNode
+from spider.contracts import CrawlResponse, CrawledNode
 import logging
 from enum import IntFlag
 
@@ -0,0 +1,140 @@
+from collections import Counter, defaultdict
+from time import perf_counter
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import aiohttp
+
+from spider.contracts import CrawledNode, RequestTiming
+from spider.metrics import metrics
+
+PHASES = ("robots", "queued", "dns", "connect", "ttfb", "transfer", "parse")
+
+
+def add_duration(timing: RequestTiming, phase: str, duration: float) -> None:
+    setattr(timing, phase, (getattr(timing, phase) or 0.0) + duration)
+
+
+def make_trace_config() -> aiohttp.TraceConfig:
+    """
+    trace config that fills in the RequestTiming passed as `trace_request_ctx`
+    to a request. durations add up over retries of the same request.
+    """
+
+    def timing_of(ctx: SimpleNamespace) -> RequestTiming | None:
+        timing = ctx.trace_request_ctx
+        return timing if isinstance(timing, RequestTiming) else None
+
+    def start(name: str):
+        async def handler(session, ctx: SimpleNamespace, params) -> None:
+            setattr(ctx, name, perf_counter())
+
+        return handler
+
+    def end(name: str, phase: str):
+        async def handler(session, ctx: SimpleNamespace, params) -> None:
+            timing = timing_of(ctx)
+            started = getattr(ctx, name, None)
+            if timing is not None and started is not None:
+                add_duration(timing, phase, perf_counter() - started)
+
+        return handler
+
+    async def on_response_chunk_received(session, ctx: SimpleNamespace, params) -> None:
+        metrics.inc("webchain_bytes_received_total", len(params.chunk))
+        timing = timing_of(ctx)
+        if timing is not None:
+            timing.bytes_received += len(params.chunk)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(start("queued_start"))
+    trace_config.on_connection_queued_end.append(end("queued_start", "queued"))
+    trace_config.on_dns_resolvehost_start.append(start("dns_start"))
+    trace_config.on_dns_resolvehost_end.append(end("dns_start", "dns"))
+    trace_config.on_connection_create_start.append(start("connect_start"))
+    trace_config.on_connection_create_end.append(end("connect_start", "connect"))
+    trace_config.on_request_headers_sent.append(start("headers_sent"))
+    trace_config.on_request_end.append(end("headers_sent", "ttfb"))
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize_timings(nodes: list[CrawledNode], slowest: int = 5) -> dict:
+    """totals, percentiles and the slowest hosts of a crawl"""
+    timings = [node.timing for node in nodes if node.timing is not None]
+    durations = [node.fetch_duration for node in nodes if node.fetch_duration is not None]
+
+    by_host: dict[str, dict] = defaultdict(lambda: {"nodes": 0, "fetch": 0.0, "retries": 0})
+    for node in nodes:
+        host = urlparse(node.at).netloc
+        by_host[host]["nodes"] += 1
+        by_host[host]["fetch"] += node.fetch_duration or 0.0
+        if node.timing is not None:
+            by_host[host]["retries"] += max(0, node.timing.attempts - 1)
+
+    return {
+        "nodes": len(nodes),
+        "totals": {
+            phase: sum(getattr(timing, phase) or 0.0 for timing in timings) for phase in PHASES
+        },
+        "fetch": {
+            "p50": percentile(durations, 50),
+            "p90": percentile(durations, 90),
+            "p99": percentile(durations, 99),
+            "max": max(durations, default=None),
+        },
+        "bytes_received": sum(timing.bytes_received for timing in timings),
+        "bytes_decoded": sum(timing.bytes_decoded for timing in timings),
+        "encodings": dict(
+            Counter(
+                timing.content_encoding or "identity" for timing in timings if timing.bytes_decoded
+            ).most_common()
+        ),
+        "requests": sum(timing.attempts for timing in timings),
+        "retries": sum(max(0, timing.attempts - 1) for timing in timings),
+        "cache_hits": sum(timing.cache_hit for timing in timings),
+        "not_modified": sum(timing.not_modified for timing in timings),
+        "slowest_hosts": sorted(
+            ({"host": host, **stats} for host, stats in by_host.items()),
+            key=lambda x: x["fetch"],
+            reverse=True,
+        )[:slowest],
+    }
+
+
+def format_timing_summary(summary: dict) -> str:
+    def s(x: float | None) -> str:
+        return "-" if x is None else f"{x:.2f}s"
+
+    lines = [
+        f"{summary['nodes']} nodes, {summary['requests']} requests "
+        f"({summary['retries']} retries), {summary['cache_hits']} from cache "
+        f"({summary['not_modified']} revalidated), {summary['bytes_received']} bytes received",
+    ]
+    if summary["bytes_decoded"]:
+        saved = 1 - summary["bytes_received"] / summary["bytes_decoded"]
+        lines.append(
+            f"{summary['bytes_decoded']} bytes decoded ({saved:.0%} saved by compression), "
+            + ", ".join(f"{encoding} {n}" for encoding, n in summary["encodings"].items())
+        )
+    lines += [
+        "time spent: "
+        + ", ".join(f"{phase} {s(total)}" for phase, total in summary["totals"].items()),
+        "fetch duration: " + ", ".join(f"{k} {s(v)}" for k, v in summary["fetch"].items()),
+    ]
+    if summary["slowest_hosts"]:
+        lines.append("slowest hosts:")
+        for host in summary["slowest_hosts"]:
+            lines.append(
+                f"  {host['host']}: {s(host['fetch'])} over {host['nodes']} nodes, "
+                f"{host['retries']} retries"
+            )
+    return "\n".join(lines)
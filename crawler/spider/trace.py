@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+from time import perf_counter
+from typing import Callable
+from urllib.parse import urlparse
+
+from spider.contracts import CrawledNode
+
+
+def combine(*callbacks: Callable | None) -> Callable | None:
+    """a callback calling each of `callbacks` that isn't None, in order"""
+    present = [callback for callback in callbacks if callback is not None]
+    if not present:
+        return None
+    if len(present) == 1:
+        return present[0]
+
+    def combined(*args, **kwargs) -> None:
+        for callback in present:
+            callback(*args, **kwargs)
+
+    return combined
+
+
+def combine_callbacks(*callbacks: dict[str, Callable]) -> dict[str, Callable]:
+    """merge keyword arguments for `crawl`, calling every callback given for the same name"""
+    names = dict.fromkeys(name for group in callbacks for name in group)
+    return {name: combine(*(group.get(name) for group in callbacks)) for name in names}
+
+
+class TraceRecorder:
+    """
+    collects crawl callbacks into a chrome trace event file, viewable in
+    https://ui.perfetto.dev or chrome://tracing
+
+    every host gets its own process track and every node a thread track
+    within it. a node's span covers on_node_start to on_node_complete, with
+    robots, fetch attempts and parse nested inside, and a flow arrow from
+    each parent to its children. the chain of nodes that finished last is
+    repeated on a separate "critical path" track.
+    """
+
+    def __init__(self):
+        self.t0 = perf_counter()
+        self.lock = threading.Lock()
+        self.events: list[dict] = []
+        self.pids: dict[str, int] = {}
+        self.tids: dict[str, tuple[int, int]] = {}
+        self.started: dict[str, float] = {}
+        self.completed: dict[str, float] = {}
+        self.parents: dict[str, str | None] = {}
+
+    def us(self, t: float) -> float:
+        return round((t - self.t0) * 1_000_000, 3)
+
+    def track(self, at: str) -> tuple[int, int]:
+        """(pid, tid) of the node at `at`, creating its tracks when first seen"""
+        if at in self.tids:
+            return self.tids[at]
+        host = urlparse(at).netloc or at
+        if host not in self.pids:
+            self.pids[host] = len(self.pids) + 1
+            self.events.append(
+                {"ph": "M", "name": "process_name", "pid": self.pids[host], "args": {"name": host}}
+            )
+        pid = self.pids[host]
+        tid = len(self.tids) + 1
+        self.tids[at] = (pid, tid)
+        self.events.append(
+            {
+                "ph": "M",
+                "name": "thread_name",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": urlparse(at).path or "/"},
+            }
+        )
+        return pid, tid
+
+    def span(self, at: str, name: str, start: float, end: float, **args) -> None:
+        with self.lock:
+            pid, tid = self.track(at)
+            event = {
+                "ph": "X",
+                "name": name,
+                "cat": "crawl",
+                "ts": self.us(start),
+                "dur": max(0.0, self.us(end) - self.us(start)),
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = args
+            self.events.append(event)
+
+    def instant(self, at: str, name: str, **args) -> None:
+        with self.lock:
+            pid, tid = self.track(at)
+            self.events.append(
+                {
+                    "ph": "i",
+                    "s": "t",
+                    "name": name,
+                    "cat": "crawl",
+                    "ts": self.us(perf_counter()),
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+
+    def on_node_start(self, at: str, parent: str | None, depth: int) -> None:
+        now = perf_counter()
+        with self.lock:
+            self.started[at] = now
+            self.parents[at] = parent
+            self.track(at)
+        self.instant(at, "on_node_start", parent=parent, depth=depth)
+
+    def on_node_complete(self, node: CrawledNode, nominations_limit: int) -> None:
+        now = perf_counter()
+        self.instant(node.at, "on_node_complete")
+        with self.lock:
+            self.completed[node.at] = now
+        args = {"depth": node.depth, "indexed": node.indexed, "children": len(node.children)}
+        if node.index_error is not None:
+            args["error"] = f"{type(node.index_error).__name__}: {node.index_error}"
+        self.span(node.at, "node", self.started.get(node.at, now), now, **args)
+
+    def on_span(self, at: str, name: str, start: float, end: float) -> None:
+        self.span(at.rstrip("/"), name, start, end)
+
+    def on_retry(self, url: str, attempt: int) -> None:
+        self.instant(url.rstrip("/"), "retry", attempt=attempt)
+
+    def on_cache_hit(self, url: str) -> None:
+        self.instant(url.rstrip("/"), "cache hit")
+
+    def callbacks(self) -> dict[str, Callable]:
+        """keyword arguments for `crawl`"""
+        return dict(
+            on_node_start=self.on_node_start,
+            on_node_complete=self.on_node_complete,
+            on_retry=self.on_retry,
+            on_cache_hit=self.on_cache_hit,
+            on_span=self.on_span,
+        )
+
+    def flows(self) -> list[dict]:
+        """arrows from the end of each parent's span to the start of its children's"""
+        events = []
+        for i, (at, parent) in enumerate(self.parents.items()):
+            if parent is None or parent not in self.completed or at not in self.started:
+                continue
+            parent_pid, parent_tid = self.tids[parent]
+            pid, tid = self.tids[at]
+            # the flow start binds to the slice enclosing its timestamp, so keep
+            # it just inside the parent's span
+            ts = max(self.us(self.started[parent]), self.us(self.completed[parent]) - 1)
+            common = {"name": "nomination", "cat": "nomination", "id": i}
+            events.append({"ph": "s", "ts": ts, "pid": parent_pid, "tid": parent_tid, **common})
+            events.append(
+                {
+                    "ph": "f",
+                    "bp": "e",
+                    "ts": self.us(self.started[at]),
+                    "pid": pid,
+                    "tid": tid,
+                    **common,
+                }
+            )
+        return events
+
+    def critical_path(self) -> list[str]:
+        """nodes from the seed to the one that completed last"""
+        if not self.completed:
+            return []
+        at: str | None = max(self.completed, key=lambda x: self.completed[x])
+        path = []
+        while at is not None and at not in path:
+            path.append(at)
+            at = self.parents.get(at)
+        return list(reversed(path))
+
+    def critical_path_events(self) -> list[dict]:
+        pid = len(self.pids) + 1
+        events = [
+            {"ph": "M", "name": "process_name", "pid": pid, "args": {"name": "critical path"}},
+            {"ph": "M", "name": "process_sort_index", "pid": pid, "args": {"sort_index": -1}},
+        ]
+        for at in self.critical_path():
+            if at not in self.started or at not in self.completed:
+                continue
+            events.append(
+                {
+                    "ph": "X",
+                    "name": at,
+                    "cat": "critical path",
+                    "ts": self.us(self.started[at]),
+                    "dur": self.us(self.completed[at]) - self.us(self.started[at]),
+                    "pid": pid,
+                    "tid": 1,
+                }
+            )
+        return events
+
+    def to_json(self) -> dict:
+        with self.lock:
+            events = [*self.events, *self.flows(), *self.critical_path_events()]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str | os.PathLike) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f)
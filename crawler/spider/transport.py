@@ -0,0 +1,92 @@
+"""
+the http clients requests can be made with.
+
+a transport is anything with the `get` of aiohttp.ClientSession: an async
+context manager yielding a response with `status`, `headers`, a `content`
+stream and `read` and `text`. it raises aiohttp's exceptions, including
+ClientResponseError for error statuses, since that is what the retry logic,
+the circuit breaker and the dead host list look at. the cache, recording and
+replay sessions wrap a transport in turn, so the rest of the crawler only
+ever sees that shape.
+"""
+
+import os
+import socket
+from contextlib import AbstractAsyncContextManager
+from typing import AsyncIterator, Mapping, Protocol
+
+import aiohttp
+from aiohttp.compression_utils import HAS_BROTLI, HAS_ZSTD
+
+from spider.timing import make_trace_config
+
+TRANSPORTS = ("aiohttp", "httpx")
+
+
+class BodyContent(Protocol):
+    def iter_chunked(self, n: int) -> AsyncIterator[bytes]: ...
+
+    def at_eof(self) -> bool: ...
+
+
+class Response(Protocol):
+    status: int
+    headers: Mapping[str, str]
+
+    @property
+    def content(self) -> BodyContent: ...
+
+    async def read(self) -> bytes: ...
+
+    async def text(self) -> str: ...
+
+
+class Transport(Protocol):
+    def get(self, url: str, **kwargs) -> AbstractAsyncContextManager[Response]: ...
+
+    async def close(self) -> None: ...
+
+    async def __aenter__(self) -> "Transport": ...
+
+    async def __aexit__(self, exc_type, exc, tb) -> None: ...
+
+
+def accept_encoding(brotli: bool, zstd: bool) -> str:
+    """
+    the content codings a client with the given decoders can decompress, the
+    ones that compress best first
+    """
+    codings = []
+    if brotli:
+        codings.append("br")
+    if zstd:
+        codings.append("zstd")
+    codings.append("gzip")
+    return ", ".join(codings)
+
+
+def get_transport(headers: dict[str, str], name: str | None = None) -> Transport:
+    """the transport named by `name` or WEBCHAIN_TRANSPORT, aiohttp by default"""
+    name = name or os.environ.get("WEBCHAIN_TRANSPORT", "aiohttp")
+    ipv4 = bool(os.environ.get("WEBCHAIN_IPV4"))
+
+    if name == "aiohttp":
+        return aiohttp.ClientSession(
+            # zstd from the standard library since python 3.14
+            headers={**headers, "Accept-Encoding": accept_encoding(HAS_BROTLI, HAS_ZSTD)},
+            raise_for_status=True,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trust_env=True,
+            connector=aiohttp.TCPConnector(family=socket.AF_INET) if ipv4 else None,
+            trace_configs=[make_trace_config()],
+        )
+    if name == "httpx":
+        try:
+            from spider.httpx_transport import HttpxTransport
+        except ImportError as e:
+            raise RuntimeError(
+                "the httpx transport needs httpx[http2], install webchain-spider[http2]"
+            ) from e
+        return HttpxTransport(headers, ipv4=ipv4)
+
+    raise ValueError(f"unknown transport {name!r}, expected one of {', '.join(TRANSPORTS)}")
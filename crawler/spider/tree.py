@@ -3,153 +3,266 @@ from datetime import datetime
 import os
 import queue
 import threading
+import time
+from typing import Callable
+
 import urwid
 
-from spider.crawl import crawl
-from spider.contracts import CrawledNode
+from spider.contracts import CrawlResponse, CrawledNode
+from spider.render import node_markup, pending_markup, replay, unqualified_markup
+from spider.trace import TraceRecorder, combine_callbacks
+from spider.tree_model import CrawlTreeModel, RowKey
 
 
 _PALETTE = [
     ("dim", "dark gray", "default"),
     ("error", "light red", "default"),
     ("unqualified", "yellow", "default"),
+    ("focus", "standout", "default"),
 ]
+_FOCUS_MAP = {None: "focus", "dim": "focus", "error": "focus", "unqualified": "focus"}
+
+MAX_CACHED_ROWS = 1000
+"""row widgets kept around for reuse, well beyond what fits on a screen"""
+
+
+class TreeRow(urwid.Text):
+    """a row that can take focus, so that it can be collapsed or expanded"""
+
+    _selectable = True
+
+    def keypress(self, size, key: str) -> str:
+        return key
+
+
+class CrawlTreeWalker(urwid.ListWalker):
+    """
+    list walker over the visible rows of a CrawlTreeModel. positions are
+    RowKeys, so the focus stays on its row as rows are added above it. row
+    widgets are only built when the list box asks for them, which it only
+    does for the rows on screen.
+    """
+
+    def __init__(self, model: CrawlTreeModel, markup):
+        self.model = model
+        self.markup = markup
+        self.focus: RowKey | None = None
+        self.widgets: dict[RowKey, tuple[list, urwid.AttrMap]] = {}
+
+    def __len__(self) -> int:
+        return len(self.model)
+
+    def __getitem__(self, key: RowKey) -> urwid.AttrMap:
+        markup = self.markup(key)
+        cached = self.widgets.get(key)
+        if cached is None:
+            if len(self.widgets) >= MAX_CACHED_ROWS:
+                self.widgets.clear()
+            widget = urwid.AttrMap(TreeRow(markup), None, focus_map=_FOCUS_MAP)
+        else:
+            previous, widget = cached
+            if previous != markup:
+                widget.original_widget.set_text(markup)
+        self.widgets[key] = (markup, widget)
+        return widget
+
+    def get_focus(self):
+        if self.focus is None and len(self.model):
+            self.focus = self.model.row(0)
+        return super().get_focus()
+
+    def set_focus(self, key: RowKey) -> None:
+        self.focus = key
+        self._modified()
+
+    def next_position(self, key: RowKey) -> RowKey:
+        return self.model.row(self.model.index(key) + 1)
+
+    def prev_position(self, key: RowKey) -> RowKey:
+        i = self.model.index(key)
+        if i == 0:
+            raise IndexError(key)
+        return self.model.row(i - 1)
+
+    def positions(self, reverse: bool = False):
+        rows = range(len(self.model))
+        for i in reversed(rows) if reverse else rows:
+            yield self.model.row(i)
+
+    def index(self, key: RowKey) -> int:
+        return self.model.index(key)
+
+
+class CrawlTreeListBox(urwid.ListBox):
+    """list box that finds its scroll position without walking every row above it"""
+
+    def get_first_visible_pos(self, size: tuple[int, int], focus: bool = False) -> int:
+        if not len(self.body):
+            return 0
+        visible = self.calculate_visible(size, focus)
+        if visible.top.fill:
+            return self.body.index(visible.top.fill[-1].position)
+        return self.body.index(self.focus_position)
 
 
 class TreeCrawlUI:
-    def __init__(self, url: str, robots_txt: bool, exit_when_done: bool = False) -> None:
+    def __init__(
+        self,
+        url: str,
+        robots_txt: bool,
+        trace: TraceRecorder | None = None,
+        refresh_rate: float = 30,
+        response: CrawlResponse | None = None,
+    ) -> None:
+        """with `response`, show that finished crawl instead of crawling `url`"""
         self.url = url
         self.robots_txt = robots_txt
-        self.exit_when_done = exit_when_done
-        self._widgets: dict[str, urwid.Text] = {}
+        self.trace = trace
+        self.response = response
+        self.refresh_interval = 1 / refresh_rate if refresh_rate > 0 else 0
+        self._model = CrawlTreeModel()
         self._content: dict[str, list] = {}
-        self._depth: dict[str, int] = {}
-        self._parent: dict[str, str | None] = {}
-        self._children: dict[str, list[str]] = {}
         self._cached: set[str] = set()
         self._inflight: list[str] = []
         self.result = None
         self.error: Exception | None = None
 
-        self._walker = urwid.SimpleFocusListWalker([])
-        self._status = urwid.Text("crawling...")
+        self._walker = CrawlTreeWalker(self._model, self._markup)
+        self._status_markup = "crawling..."
+        self._status = urwid.Text(self._status_markup)
         self._queue: queue.SimpleQueue = queue.SimpleQueue()
         self._pipe_write: int | None = None
+        self._wake_pending = False
+        self._last_flush = 0.0
+        self._flush_scheduled = False
+        self._rows_changed = False
+        self._inflight_changed = False
         self._main_loop: urwid.MainLoop | None = None
 
-    def _make_unqualified_prefix(self, at: str) -> str:
-        """indentation for unqualified items"""
-        path: list[str] = []
-        cur = at
-        while self._depth.get(cur, 0) > 0:
-            path.append(cur)
-            cur = self._parent.get(cur) or ""
-        path.reverse()
-        prefix = ""
-        for node in path:
-            prefix += "    " if self._is_last(node) else "│   "
-        prefix += "    "
-        return prefix
-
-    def _is_last(self, at: str) -> bool:
-        siblings = self._children.get(self._parent.get(at) or "", [])
-        return bool(siblings) and siblings[-1] == at
-
-    def _make_prefix(self, at: str) -> str:
-        if self._depth.get(at, 0) == 0:
-            return ""
-        path: list[str] = []
-        cur = at
-        while self._depth.get(cur, 0) > 0:
-            path.append(cur)
-            cur = self._parent.get(cur) or ""
-        path.reverse()
-        prefix = ""
-        for ancestor in path[:-1]:
-            prefix += "    " if self._is_last(ancestor) else "│   "
-        prefix += "└── " if self._is_last(at) else "├── "
-        return prefix
-
-    def _subtree_size(self, at: str) -> int:
-        if at not in self._widgets:
-            return 0
-        return 1 + sum(self._subtree_size(c) for c in self._children.get(at, []))
+    def _markup(self, key: RowKey) -> list:
+        node, unqualified = key
+        if unqualified is not None:
+            prefix = self._model.unqualified_prefix(node)
+            return unqualified_markup(prefix, node.unqualified[unqualified])
+        prefix = self._model.prefix(node)
+        content = self._content.get(node.at, [node.at])
+        if node.collapsed and node.hidden:
+            content = content + [("dim", f" (+{node.hidden} collapsed)")]
+        return ([("dim", prefix)] if prefix else []) + content
 
-    def _redraw(self, at: str) -> None:
-        w = self._widgets.get(at)
-        if w is None:
+    def _enqueue(self, fn) -> None:
+        """
+        queue `fn` to run on the ui thread. the ui is only woken up when
+        nothing is pending yet, everything queued in the meantime is applied
+        in the same batch.
+        """
+        if self._pipe_write is None:
+            fn()
+            self._apply_changes()
             return
-        prefix = self._make_prefix(at)
-        content = self._content.get(at, [at])
-        markup = ([("dim", prefix)] if prefix else []) + content
-        w.set_text(markup)
-        for child in self._children.get(at, []):
-            self._redraw(child)
 
-    def _enqueue(self, fn) -> None:
-        if self._pipe_write is not None:
-            self._queue.put(fn)
+        self._queue.put(fn)
+        if not self._wake_pending:
+            self._wake_pending = True
             try:
                 os.write(self._pipe_write, b"\x00")
             except OSError:
                 pass
-        else:
-            fn()
 
-    def _flush_queue(self, _data: bytes) -> None:
-        while not self._queue.empty():
+    def _on_wake(self, _data: bytes) -> None:
+        # batches are applied at most once every refresh_interval, each one
+        # followed by a single redraw
+        wait = self._last_flush + self.refresh_interval - time.monotonic()
+        if wait > 0:
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self._main_loop.set_alarm_in(wait, lambda *_: self._flush_queue())
+            return
+        self._flush_queue()
+
+    def _flush_queue(self) -> None:
+        self._flush_scheduled = False
+        self._last_flush = time.monotonic()
+        # cleared before draining, so that anything queued from here on wakes
+        # the ui up again
+        self._wake_pending = False
+        while True:
             try:
-                self._queue.get_nowait()()
+                fn = self._queue.get_nowait()
             except queue.Empty:
                 break
+            fn()
+        self._apply_changes()
+
+    def _apply_changes(self) -> None:
+        if self._rows_changed:
+            self._rows_changed = False
+            self._walker._modified()
+        if self._inflight_changed and self.result is None and self.error is None:
+            self._inflight_changed = False
+            self._set_status("crawling... " + " ".join(self._inflight))
+
+    def _set_status(self, markup) -> None:
+        if markup != self._status_markup:
+            self._status_markup = markup
+            self._status.set_text(markup)
+
+    def _set_collapsed(self, collapsed: bool | None) -> None:
+        """collapse, expand or (with None) toggle the focused node"""
+        if self._walker.focus is None:
+            return
+        node, _ = self._walker.focus
+        self._model.set_collapsed(node, not node.collapsed if collapsed is None else collapsed)
+        # an unqualified row of a collapsed node is hidden, so focus the node
+        self._walker.set_focus((node, None))
 
     def _handle_input(self, key: str) -> None:
         if key in ("q", "Q"):
             raise urwid.ExitMainLoop()
+        elif key in ("enter", " "):
+            self._set_collapsed(None)
+        elif key in ("left", "-"):
+            self._set_collapsed(True)
+        elif key in ("right", "+"):
+            self._set_collapsed(False)
 
     def run(self) -> None:
         self._main_loop = urwid.MainLoop(
             urwid.Frame(
-                body=urwid.ScrollBar(urwid.ListBox(self._walker)),
+                body=urwid.ScrollBar(CrawlTreeListBox(self._walker)),
                 footer=urwid.Pile([urwid.Divider("─"), self._status]),
             ),
             palette=_PALETTE,
             unhandled_input=self._handle_input,
         )
-        self._pipe_write = self._main_loop.watch_pipe(self._flush_queue)
-        threading.Thread(target=lambda: asyncio.run(self._crawl()), daemon=True).start()
+        if self.response is not None:
+            # nothing to wait for, so the rows are added before the first draw
+            self.result = self.response
+            replay(self.response, self._callbacks())
+            self._set_status(self._summary())
+        else:
+            self._pipe_write = self._main_loop.watch_pipe(self._on_wake)
+            threading.Thread(target=lambda: asyncio.run(self._crawl()), daemon=True).start()
         self._main_loop.run()
 
-    async def _crawl(self) -> None:
-        max_attempts = os.environ.get("WEBCHAIN_NETWORK_ATTEMPTS")
+    def _summary(self) -> str:
+        duration = datetime.fromisoformat(self.result.end) - datetime.fromisoformat(
+            self.result.start
+        )
+        return (
+            f"crawled {len(self.result.nodes)} nodes in {duration.total_seconds():.2f}s — q to quit"
+        )
 
-        def _update_status() -> None:
-            self._status.set_text("crawling... " + " ".join(self._inflight))
+    def _callbacks(self) -> dict[str, Callable]:
+        """`crawl` callbacks that update the view from the ui thread"""
+        max_attempts = os.environ.get("WEBCHAIN_NETWORK_ATTEMPTS")
 
         def on_node_start(at: str, parent: str | None, depth: int) -> None:
             def _update() -> None:
-                self._parent[at] = parent
-                self._depth[at] = depth
-                existing = self._children.get(parent or "", [])
-                prev_last = existing[-1] if existing else None
-
-                if parent and parent in self._widgets:
-                    parent_idx = self._walker.index(self._widgets[parent])
-                    offset = sum(self._subtree_size(c) for c in existing)
-                    insert_pos = parent_idx + 1 + offset
-                else:
-                    insert_pos = len(self._walker)
-
-                self._children.setdefault(parent or "", []).append(at)
-                self._content[at] = [("dim", at)]
-                w = urwid.Text("")
-                self._widgets[at] = w
-                self._walker.insert(insert_pos, w)
-                self._redraw(at)
-                if prev_last:
-                    self._redraw(prev_last)
+                self._content[at] = pending_markup(at)
+                self._model.add(at, parent)
                 self._inflight.append(at)
-                _update_status()
+                self._rows_changed = self._inflight_changed = True
 
             self._enqueue(_update)
 
@@ -158,30 +271,16 @@ class TreeCrawlUI:
 
         def on_node_complete(node: CrawledNode, nominations_limit: int) -> None:
             def _update() -> None:
-                if node.at not in self._widgets:
+                if node.at not in self._model:
                     return
-                parts: list = [node.at]
-                if node.depth == 0:
-                    parts.append(("dim", f" (limit={nominations_limit})"))
-                if node.at in self._cached:
-                    parts.append(("dim", " (cached)"))
-                elif node.fetch_duration is not None and node.fetch_duration > 3:
-                    parts.append(("dim", f" (took {node.fetch_duration:.1f}s)"))
-                if node.index_error:
-                    parts.append(("error", f" (not crawled: {type(node.index_error).__name__})"))
-                self._content[node.at] = parts
-                self._redraw(node.at)
+                self._content[node.at] = node_markup(
+                    node, nominations_limit, node.at in self._cached
+                )
                 if node.unqualified:
-                    prefix = self._make_unqualified_prefix(node.at)
-                    node_idx = self._walker.index(self._widgets[node.at])
-                    insert_pos = node_idx + self._subtree_size(node.at)
-                    for url in node.unqualified:
-                        w = urwid.Text([("dim", prefix), ("unqualified", "unqualified "), url])
-                        self._walker.insert(insert_pos, w)
-                        insert_pos += 1
+                    self._model.set_unqualified(node.at, node.unqualified)
                 if node.at in self._inflight:
                     self._inflight.remove(node.at)
-                _update_status()
+                self._rows_changed = self._inflight_changed = True
 
             self._enqueue(_update)
 
@@ -189,44 +288,34 @@ class TreeCrawlUI:
             at = url.rstrip("/")
 
             def _update() -> None:
-                if at not in self._widgets:
+                if at not in self._model:
                     return
                 self._content[at] = [("dim", at), ("dim", f" (attempt {attempt}/{max_attempts})")]
-                self._redraw(at)
+                self._rows_changed = True
 
             self._enqueue(_update)
 
+        return dict(
+            on_node_start=on_node_start,
+            on_node_complete=on_node_complete,
+            on_retry=on_retry,
+            on_cache_hit=on_cache_hit,
+        )
+
+    async def _crawl(self) -> None:
+        from spider.crawl import crawl
+
+        callbacks = self._callbacks()
+        if self.trace is not None:
+            callbacks = combine_callbacks(callbacks, self.trace.callbacks())
+
         try:
-            self.result = await crawl(
-                self.url,
-                check_robots_txt=self.robots_txt,
-                on_node_start=on_node_start,
-                on_node_complete=on_node_complete,
-                on_retry=on_retry,
-                on_cache_hit=on_cache_hit,
-            )
+            self.result = await crawl(self.url, check_robots_txt=self.robots_txt, **callbacks)
         except Exception as e:
             self.error = e
             msg = f"error: {e} — q to quit"
-            self._enqueue(lambda: self._status.set_text(("error", msg)))
+            self._enqueue(lambda: self._set_status(("error", msg)))
             return
 
-        duration = datetime.fromisoformat(self.result.end) - datetime.fromisoformat(
-            self.result.start
-        )
-        summary = (
-            f"crawled {len(self.result.nodes)} nodes in {duration.total_seconds():.2f}s — q to quit"
-        )
-
-        def _done() -> None:
-            if self.exit_when_done:
-                raise urwid.ExitMainLoop()
-            self._status.set_text(summary)
-
-        self._enqueue(_done)
-
-
-def print_tree(ui: TreeCrawlUI) -> None:
-    for w in ui._walker:
-        text, _ = w.get_text()
-        print(text if isinstance(text, str) else text.decode())
+        summary = self._summary()
+        self._enqueue(lambda: self._set_status(summary))
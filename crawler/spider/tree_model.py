@@ -0,0 +1,218 @@
+from typing import Iterator
+
+
+class Fenwick:
+    """
+    binary indexed tree over a growing list of non-negative integers, with
+    O(log n) append, update, prefix sums and search by prefix sum
+    """
+
+    def __init__(self):
+        self.tree: list[int] = [0]
+        self.values: list[int] = []
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def prefix(self, i: int) -> int:
+        """sum of the first `i` values"""
+        s = 0
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def append(self, value: int) -> None:
+        i = len(self.tree)
+        # the new node covers (i - lowbit(i), i], of which only i is new
+        self.tree.append(self.prefix(i - 1) - self.prefix(i - (i & -i)) + value)
+        self.values.append(value)
+        self.total += value
+
+    def add(self, index: int, delta: int) -> None:
+        self.values[index] += delta
+        self.total += delta
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, target: int) -> tuple[int, int]:
+        """
+        index of the value containing position `target` when the values are
+        laid end to end, and the offset of `target` within it
+        """
+        pos = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return pos, target
+
+
+class TreeNode:
+    __slots__ = ("at", "parent", "depth", "index", "children", "sizes", "unqualified", "collapsed")
+
+    def __init__(self, at: str, parent: "TreeNode | None", depth: int, index: int):
+        self.at = at
+        self.parent = parent
+        self.depth = depth
+        self.index = index
+        """position among the parent's children"""
+        self.children: list[TreeNode] = []
+        self.sizes = Fenwick()
+        """visible rows in each child's subtree"""
+        self.unqualified: list[str] = []
+        self.collapsed = False
+
+    @property
+    def hidden(self) -> int:
+        """rows below the node itself: its children's subtrees, then its unqualified nominations"""
+        return self.sizes.total + len(self.unqualified)
+
+    @property
+    def size(self) -> int:
+        """visible rows in this subtree"""
+        return 1 if self.collapsed else 1 + self.hidden
+
+    @property
+    def is_last(self) -> bool:
+        return self.parent is not None and self.index == len(self.parent.children) - 1
+
+
+RowKey = tuple[TreeNode, int | None]
+"""a node, and None for the node's own row or the index of one of its unqualified nominations"""
+
+
+class CrawlTreeModel:
+    """
+    the rows of the crawl tree, in display order, as nodes are discovered.
+
+    each node keeps the visible row counts of its children's subtrees in a
+    Fenwick tree, so finding, inserting and looking up rows costs O(depth *
+    log fanout) instead of scanning the rows. rows below a collapsed node are
+    not visible, but are still counted within it so that expanding it again
+    is as cheap as collapsing it.
+
+    a row is identified by a `RowKey`, which unlike its position doesn't
+    change as rows are added above it.
+    """
+
+    def __init__(self):
+        self.root = TreeNode("", None, -1, 0)
+        """sentinel parent of the seed, it has no row of its own"""
+        self.nodes: dict[str, TreeNode] = {}
+
+    def __len__(self) -> int:
+        return self.root.sizes.total
+
+    def __contains__(self, at: str) -> bool:
+        return at in self.nodes
+
+    def __getitem__(self, at: str) -> TreeNode:
+        return self.nodes[at]
+
+    def resize(self, node: TreeNode, delta: int) -> None:
+        """propagate a change in the number of visible rows of `node`'s subtree"""
+        while node.parent is not None:
+            node.parent.sizes.add(node.index, delta)
+            if node.parent.collapsed:
+                return
+            node = node.parent
+
+    def add(self, at: str, parent: str | None) -> TreeNode:
+        """append `at` as the last child of `parent`, or as a root if `parent` is unknown"""
+        parent_node = self.nodes.get(parent) if parent is not None else None
+        if parent_node is None:
+            parent_node = self.root
+        node = TreeNode(at, parent_node, parent_node.depth + 1, len(parent_node.children))
+        parent_node.children.append(node)
+        parent_node.sizes.append(0)
+        self.nodes[at] = node
+        self.resize(node, 1)
+        return node
+
+    def set_unqualified(self, at: str, unqualified: list[str]) -> None:
+        node = self.nodes[at]
+        delta = len(unqualified) - len(node.unqualified)
+        node.unqualified = list(unqualified)
+        if not node.collapsed:
+            self.resize(node, delta)
+
+    def set_collapsed(self, node: TreeNode, collapsed: bool) -> None:
+        if node.collapsed == collapsed:
+            return
+        node.collapsed = collapsed
+        self.resize(node, -node.hidden if collapsed else node.hidden)
+
+    def is_visible(self, node: TreeNode) -> bool:
+        """false if any ancestor of `node` is collapsed"""
+        return not any(ancestor.collapsed for ancestor in self.ancestors(node))
+
+    def position(self, node: TreeNode) -> int:
+        """row of `node`, which must be visible"""
+        pos = 0
+        while node.parent is not None:
+            pos += node.parent.sizes.prefix(node.index)
+            if node.parent is not self.root:
+                pos += 1
+            node = node.parent
+        return pos
+
+    def row(self, i: int) -> RowKey:
+        """
+        the node at row `i`, and None if the row is the node itself or the
+        index of the unqualified nomination of that node shown in the row
+        """
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        node = self.root
+        while True:
+            if node is not self.root:
+                if i == 0:
+                    return node, None
+                i -= 1
+            if i < node.sizes.total and not node.collapsed:
+                index, i = node.sizes.find(i)
+                node = node.children[index]
+            else:
+                return node, i - node.sizes.total
+
+    def rows(self, start: int = 0) -> Iterator[RowKey]:
+        for i in range(start, len(self)):
+            yield self.row(i)
+
+    def index(self, key: RowKey) -> int:
+        """position of the visible row `key`"""
+        node, unqualified = key
+        i = self.position(node)
+        if unqualified is not None:
+            i += 1 + node.sizes.total + unqualified
+        return i
+
+    def ancestors(self, node: TreeNode) -> list[TreeNode]:
+        """the path from the seed down to, but excluding, `node`"""
+        path = []
+        node = node.parent
+        while node is not None and node is not self.root:
+            path.append(node)
+            node = node.parent
+        path.reverse()
+        return path
+
+    def prefix(self, node: TreeNode) -> str:
+        """box drawing in front of a node's row"""
+        if node.depth == 0:
+            return ""
+        path = self.ancestors(node)[1:]
+        prefix = "".join("    " if ancestor.is_last else "│   " for ancestor in path)
+        return prefix + ("└── " if node.is_last else "├── ")
+
+    def unqualified_prefix(self, node: TreeNode) -> str:
+        """indentation in front of the unqualified nominations of `node`"""
+        path = self.ancestors(node)[1:] + ([node] if node.depth > 0 else [])
+        return "".join("    " if n.is_last else "│   " for n in path) + "    "
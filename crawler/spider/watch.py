@@ -0,0 +1,210 @@
+"""
+a crawler that stays running, recrawling on a schedule.
+
+a cron job running `json`, `enrich` and `patch` starts python, opens the
+caches, reads the current crawl and connects to every site afresh on every
+run. `Watch` does that once and keeps it between crawls: the session with its
+connection pool and dns cache, the http and extraction caches, the dead hosts,
+robots.txt and the current crawl itself. every cycle crawls and enriches with
+those, patches the current crawl in memory and only writes it out if it
+changed.
+
+SIGHUP reopens everything and rereads the output, starting a cycle right away.
+SIGTERM and SIGINT stop once the cycle in progress is written out, a second
+one stops at once.
+"""
+
+import asyncio
+import json
+import logging
+import signal
+from contextlib import AsyncExitStack
+from pathlib import Path
+from time import monotonic
+
+from spider.contracts import CrawlResponse
+from spider.crawl import Resources, crawl, open_resources
+from spider.http import UA
+from spider.metadata import enrich_with_metadata
+from spider.metrics import metrics, write_atomically
+from spider.robots import RobotsChecker
+from spider.serialize import deserialize, serialize
+from spider.state import patch_state
+
+logger = logging.getLogger(__name__)
+
+ROBOTS_MAX_AGE = 60 * 60 * 24
+"""seconds a robots.txt is used for before it is fetched again, the most rfc 9309 allows"""
+
+
+class Watch:
+    """
+    recrawls `seed_url` every `interval` seconds, keeping the crawl in `out`
+    up to date and writing the start and end of every crawl to `heartbeat`
+    """
+
+    def __init__(
+        self,
+        seed_url: str,
+        out: str | Path,
+        interval: float,
+        heartbeat: str | Path | None = None,
+        check_robots_txt: bool = False,
+        metrics_out: str | Path | None = None,
+    ):
+        self.seed_url = seed_url
+        self.out = Path(out)
+        self.interval = interval
+        self.heartbeat = Path(heartbeat) if heartbeat is not None else None
+        self.check_robots_txt = check_robots_txt
+        self.metrics_out = metrics_out
+
+        self.current: CrawlResponse | None = None
+        self.resources: Resources | None = None
+        self.robots_since = 0.0
+        self.stack = AsyncExitStack()
+        self.cycle: asyncio.Task[bool] | None = None
+        self.wake = asyncio.Event()
+        self.stopping = False
+        self.reloading = False
+
+    def load(self) -> None:
+        """read the current crawl from `out`, if there is one yet"""
+        try:
+            self.current = deserialize(self.out.read_text())
+        except FileNotFoundError:
+            self.current = None
+            return
+        logger.info(f"loaded {len(self.current.nodes)} nodes from {self.out}")
+
+    async def open(self) -> None:
+        self.resources = await self.stack.enter_async_context(open_resources(self.check_robots_txt))
+        self.robots_since = monotonic()
+
+    async def close(self) -> None:
+        await self.stack.aclose()
+        self.resources = None
+
+    async def __aenter__(self) -> "Watch":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def recrawl(self) -> bool:
+        """crawl, enrich and patch the current crawl once, true if it changed"""
+        resources = self.resources
+        if resources.robots is not None and monotonic() - self.robots_since > ROBOTS_MAX_AGE:
+            await resources.robots.close()
+            resources.robots = RobotsChecker(resources.session, user_agent=UA)
+            self.robots_since = monotonic()
+        resources.dead_hosts.next_run()
+        await resources.extraction_cache.next_run()
+
+        previous = self.current
+        with metrics.phase("crawl"):
+            crawled = await crawl(
+                self.seed_url,
+                check_robots_txt=self.check_robots_txt,
+                previous=previous,
+                resources=resources,
+            )
+        with metrics.phase("enrich"):
+            enriched = await enrich_with_metadata(
+                crawled,
+                check_robots_txt=self.check_robots_txt,
+                previous=previous,
+                resources=resources,
+            )
+        with metrics.phase("patch"):
+            # against nothing, the first crawl is all new and gets its first_seen
+            patched = patch_state(
+                previous or CrawlResponse(nodes=[], nominations_limit=0, start="", end=""),
+                enriched,
+            )
+
+        if patched:
+            with metrics.phase("serialize"):
+                write_atomically(self.out, serialize(patched, indent="\t") + "\n")
+            self.current = patched
+            logger.info(f"crawl changed, wrote {len(patched.nodes)} nodes to {self.out}")
+        else:
+            logger.info("no changes detected")
+        if self.heartbeat is not None:
+            heartbeat = {"start": crawled.start, "end": crawled.end}
+            write_atomically(self.heartbeat, json.dumps(heartbeat, indent="\t") + "\n")
+        return bool(patched)
+
+    async def guarded_recrawl(self) -> bool:
+        """`recrawl`, logging and counting a failure instead of raising it"""
+        success = False
+        try:
+            changed = await self.recrawl()
+            success = True
+        except Exception:
+            logger.exception("recrawl failed, keeping the current crawl")
+            changed = False
+        outcome = "failed" if not success else "changed" if changed else "unchanged"
+        metrics.inc("webchain_watch_cycles_total", outcome=outcome)
+        if self.metrics_out is not None:
+            metrics.finish("watch", success)
+            metrics.write(self.metrics_out)
+        return changed
+
+    async def reload(self) -> None:
+        logger.info("reloading")
+        await self.close()
+        self.stack = AsyncExitStack()
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f"{self.out} not valid crawl json, keeping the crawl in memory: {e}")
+        await self.open()
+
+    def request_reload(self) -> None:
+        self.reloading = True
+        self.wake.set()
+
+    def request_stop(self) -> None:
+        if self.stopping and self.cycle is not None:
+            logger.info("stopping without finishing the crawl")
+            self.cycle.cancel()
+        elif not self.stopping:
+            logger.info("stopping once the crawl in progress is done")
+        self.stopping = True
+        self.wake.set()
+
+    async def run(self) -> None:
+        """recrawl on schedule until stopped, reloading on SIGHUP"""
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self.request_reload)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.request_stop)
+        try:
+            while not self.stopping:
+                if self.reloading:
+                    self.reloading = False
+                    await self.reload()
+                # cycles start every `interval`, or right after one that ran over
+                due = monotonic() + self.interval
+                self.cycle = asyncio.create_task(self.guarded_recrawl())
+                try:
+                    await self.cycle
+                except asyncio.CancelledError:
+                    if not self.stopping:
+                        raise
+                    break
+                finally:
+                    self.cycle = None
+
+                self.wake.clear()
+                if self.stopping or self.reloading:
+                    continue
+                try:
+                    await asyncio.wait_for(self.wake.wait(), max(due - monotonic(), 0))
+                except TimeoutError:
+                    pass
+        finally:
+            for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
@@ -0,0 +1,88 @@
+import socket
+from dataclasses import dataclass, field
+
+import pytest
+from aiohttp import web
+
+
+@dataclass
+class Webchain:
+    """
+    a local webchain of `graph`, a page name -> the names it nominates, where
+    "" is the seed. names that are urls are nominated as they are. pages are
+    spread over `hosts`, the seed on the first.
+    """
+
+    graph: dict[str, list[str]]
+    hosts: tuple[str, ...]
+    port: int
+    nominations_limit: int
+    requested: list[str] = field(default_factory=list)
+    """names of the pages requested, in order"""
+
+    @property
+    def seed(self) -> str:
+        return self.url("")
+
+    def url(self, name: str) -> str:
+        if "://" in name:
+            return name
+        host = self.hosts[sum(map(ord, name)) % len(self.hosts)]
+        return f"http://{host}:{self.port}" + (f"/{name}" if name else "")
+
+    def page(self, name: str) -> str:
+        links = "".join(
+            f'<link rel="webchain-nomination" href="{self.url(n)}">' for n in self.graph[name]
+        )
+        limit = (
+            f'<meta name="webchain-nominations-limit" content="{self.nominations_limit}">'
+            if not name
+            else ""
+        )
+        return (
+            f'<html><head><title>{name or "seed"}</title><link rel="webchain" '
+            f'href="{self.seed}">{limit}{links}</head></html>'
+        )
+
+
+@pytest.fixture
+async def serve_webchain(monkeypatch):
+    """serves a `Webchain` of the graph it is called with, until the test is done"""
+    monkeypatch.setenv("WEBCHAIN_NO_CACHE", "1")
+    runners = []
+
+    async def serve(
+        graph: dict[str, list[str]],
+        nominations_limit: int = 3,
+        hosts: tuple[str, ...] = ("127.0.0.1",),
+    ) -> Webchain:
+        monkeypatch.setenv("NO_PROXY", ",".join(hosts))
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        chain = Webchain(graph, hosts, port, nominations_limit)
+
+        async def page(request: web.Request) -> web.Response:
+            name = request.match_info["name"]
+            chain.requested.append(name)
+            if name not in chain.graph:
+                raise web.HTTPNotFound()
+            return web.Response(text=chain.page(name), content_type="text/html")
+
+        app = web.Application()
+        app.router.add_get("/{name:.*}", page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        runners.append(runner)
+        for host in hosts:
+            await web.TCPSite(runner, host, port).start()
+        return chain
+
+    yield serve
+    for runner in runners:
+        await runner.cleanup()
+
+
+def shape(nodes):
+    """what two crawls of the same graph have in common"""
+    return [(n.at, n.parent, n.depth, n.children, n.unqualified, n.indexed) for n in nodes]
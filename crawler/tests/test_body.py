@@ -0,0 +1,101 @@
+import gzip
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from spider.body import CHUNK_SIZE, BodyLimit, IncompleteBodyError, read_body
+from spider.cached_session import CachedClientSession, CachedResponse
+from spider.contracts import RequestTiming
+from spider.http import get, get_session
+
+HEAD = b"<html><head><script>var a = '</head>';</script><link rel=webchain href=x></head>"
+PAGE = HEAD + b"<body>" + b"<p>filler</p>" * 10_000 + b"</body></html>"
+
+
+async def test_read_stops_at_head_end_or_cap():
+    response = CachedResponse(200, {}, PAGE)
+
+    body = await read_body(response, BodyLimit(until_head_end=True))
+    assert body.truncated == "head"
+    assert body.data.startswith(HEAD)
+    assert len(body.data) < len(PAGE)
+
+    body = await read_body(response, BodyLimit(max_bytes=100))
+    assert body == type(body)(PAGE[:100], "cap")
+
+    body = await read_body(response, BodyLimit(max_bytes=None))
+    assert body.data is PAGE and body.truncated is None
+
+
+@pytest.mark.parametrize("size", [100, CHUNK_SIZE, 2 * CHUNK_SIZE])
+async def test_body_of_exactly_the_cap_is_complete(size):
+    response = CachedResponse(200, {}, PAGE[:size])
+    body = await read_body(response, BodyLimit(max_bytes=size))
+    assert body.data == PAGE[:size] and body.truncated is None
+
+    response = CachedResponse(200, {}, PAGE[: size + 1])
+    body = await read_body(response, BodyLimit(max_bytes=size))
+    assert body == type(body)(PAGE[:size], "cap")
+
+
+async def test_truncated_body_in_cache_is_only_served_if_enough(tmp_path, monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_CACHE_DB", str(tmp_path / "cache.sqlite"))
+    requests = []
+
+    async def page(request: web.Request) -> web.Response:
+        requests.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304, headers={"ETag": '"v1"'})
+        return web.Response(body=PAGE, content_type="text/html", headers={"ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/", page)
+    async with (
+        TestServer(app) as server,
+        CachedClientSession(aiohttp.ClientSession(raise_for_status=True)) as session,
+    ):
+        url = str(server.make_url("/"))
+        head_only = BodyLimit(until_head_end=True)
+
+        body = await get(url, session=session, limit=head_only)
+        assert len(body.data) < len(PAGE)
+        entry = await session.get_cached(url)
+        assert not entry["complete"] and len(entry["body"]) < len(PAGE)
+
+        # revalidated, and the stored start of the page is enough
+        assert (await get(url, session=session, limit=head_only)).data == body.data
+        assert requests[-1]["If-None-Match"] == '"v1"'
+
+        # not enough for a full read, which fetches the page again
+        async with session.get(url) as response:
+            with pytest.raises(IncompleteBodyError):
+                await read_body(response)
+        assert (await get(url, session=session)).data == PAGE
+        assert "If-None-Match" not in requests[-1]
+        assert (await session.get_cached(url))["complete"]
+
+
+async def test_compressed_bytes_are_counted(monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_NO_CACHE", "1")
+    compressed = gzip.compress(PAGE)
+    accepted = []
+
+    async def page(request: web.Request) -> web.Response:
+        accepted.append(request.headers["Accept-Encoding"])
+        return web.Response(
+            body=compressed, content_type="text/html", headers={"Content-Encoding": "gzip"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/", page)
+    async with TestServer(app) as server, get_session() as session:
+        timing = RequestTiming()
+        body = await get(str(server.make_url("/")), session=session, timing=timing)
+
+    assert body.data == PAGE
+    assert "br" in accepted[0] and "gzip" in accepted[0]
+    assert timing.content_encoding == "gzip"
+    assert timing.bytes_received == len(compressed)
+    assert timing.bytes_decoded == len(PAGE)
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from conftest import shape
+
+from spider.checkpoint import Checkpoint, CheckpointError
+from spider.crawl import crawl
+from spider.shard import Coordinator, run_worker
+
+GRAPH = {
+    "": ["a", "b", "c"],
+    "a": ["b", "d", "e"],
+    "b": ["f"],
+    "c": ["g", "a"],
+    "d": [],
+    "e": ["h"],
+    "f": [],
+    "g": [],
+    "h": [],
+}
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+async def chain(serve_webchain):
+    return await serve_webchain(GRAPH)
+
+
+async def interrupted_crawl(seed: str, checkpoint: Checkpoint, after: int) -> None:
+    completed = []
+
+    def on_node_complete(node, nominations_limit):
+        completed.append(node)
+        if len(completed) == after:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        await crawl(seed, checkpoint=checkpoint, on_node_complete=on_node_complete)
+    # the crash also cut the line being written short
+    with checkpoint.path.open("a") as f:
+        f.write('{"node": {"at": ')
+
+
+async def test_resumed_crawl_matches_uninterrupted(chain, tmp_path):
+    seed, requested = chain.seed, chain.requested
+    expected = await crawl(seed)
+    requested.clear()
+
+    checkpoint = Checkpoint(tmp_path / "crawl.checkpoint", interval=0)
+    await interrupted_crawl(seed, checkpoint, after=4)
+    done = checkpoint.load(seed, 1000).nodes
+    assert len(done) >= 4
+    requested.clear()
+
+    resumed = await crawl(seed, checkpoint=checkpoint, resume=True)
+    assert shape(resumed.nodes) == shape(expected.nodes)
+    assert resumed.nominations_limit == 3
+    # only the rest of the graph was crawled, and the checkpoint is gone
+    assert sorted(f"{seed}/{name}".rstrip("/") for name in requested) == sorted(
+        n.at for n in expected.nodes if n.at not in done
+    )
+    assert not checkpoint.path.exists()
+
+
+async def test_sharded_crawl_resumes_a_checkpoint(chain, tmp_path):
+    seed, requested = chain.seed, chain.requested
+    expected = await crawl(seed)
+    checkpoint = Checkpoint(tmp_path / "crawl.checkpoint", interval=0)
+    await interrupted_crawl(seed, checkpoint, after=6)
+    done = checkpoint.load(seed, 1000).nodes
+    requested.clear()
+
+    coordinator = Coordinator(seed, shards=1, token="t", checkpoint=checkpoint, resume=True)
+    worker = asyncio.create_task(run_worker(await coordinator.listen(), "t"))
+    resumed = await coordinator.finish()
+    await worker
+
+    assert shape(resumed.nodes) == shape(expected.nodes)
+    assert len(requested) == len(GRAPH) - len(done)
+
+
+async def test_checkpoint_of_another_seed_is_refused(chain, tmp_path):
+    seed = chain.seed
+    checkpoint = Checkpoint(tmp_path / "crawl.checkpoint", interval=0)
+    await interrupted_crawl(seed, checkpoint, after=2)
+    with pytest.raises(CheckpointError):
+        await crawl(seed + "/a", checkpoint=checkpoint, resume=True)
+
+
+async def test_checkpoint_of_another_recursion_limit_is_refused(chain, tmp_path):
+    seed = chain.seed
+    checkpoint = Checkpoint(tmp_path / "crawl.checkpoint", interval=0)
+    await interrupted_crawl(seed, checkpoint, after=2)
+    with pytest.raises(CheckpointError, match="recursion limit"):
+        await crawl(seed, recursion_limit=1, checkpoint=checkpoint, resume=True)
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from spider.circuit import CircuitBreaker, RetryBudget
+from spider.error import HostUnavailableError
+from spider.http import get
+from spider.replay import Capture, Exchange, ReplayClientSession
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_and_probes_after_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, cooldown=10, clock=clock)
+
+    breaker.record("https://down.example/a", failed=True)
+    breaker.before_request("https://down.example/b")
+    breaker.record("https://down.example/b", failed=True)
+    with pytest.raises(HostUnavailableError):
+        breaker.before_request("https://down.example/c")
+    breaker.before_request("https://up.example/")
+
+    clock.now = 11
+    breaker.before_request("https://down.example/probe")
+    with pytest.raises(HostUnavailableError):
+        # only the probe goes through
+        breaker.before_request("https://down.example/c")
+    breaker.record("https://down.example/probe", failed=True)
+
+    clock.now = 15
+    with pytest.raises(HostUnavailableError):
+        breaker.before_request("https://down.example/c")
+
+    clock.now = 22
+    breaker.before_request("https://down.example/probe")
+    breaker.record("https://down.example/probe", failed=False)
+    breaker.before_request("https://down.example/c")
+
+
+def test_retry_budget():
+    budget = RetryBudget(2)
+    assert [budget.stop(None) for _ in range(3)] == [False, False, True]
+    assert RetryBudget(None).stop(None) is False
+
+
+async def test_get_fails_fast_once_the_host_is_down(tmp_path, monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_NETWORK_ATTEMPTS", "5")
+    monkeypatch.setenv("WEBCHAIN_RETRY_MAX_WAIT", "0")
+    capture = Capture(tmp_path / "capture.sqlite")
+    for url in ("https://down.example/a", "https://down.example/b"):
+        await capture.save(url, Exchange(None, {}, None, "TimeoutError", "", 0.1))
+    await capture.close()
+
+    breaker = CircuitBreaker(threshold=2)
+    budget = RetryBudget(10)
+    async with ReplayClientSession(tmp_path / "capture.sqlite", raise_for_status=True) as session:
+        with pytest.raises(HostUnavailableError):
+            await get("https://down.example/a", session, breaker=breaker, retry_budget=budget)
+        with pytest.raises(HostUnavailableError):
+            await get("https://down.example/b", session, breaker=breaker, retry_budget=budget)
+
+    # two failed attempts, then the third was refused without being made
+    assert budget.remaining == 8
+
+
+async def test_cancelled_probe_lets_another_through(tmp_path):
+    capture = Capture(tmp_path / "capture.sqlite")
+    await capture.save("https://down.example/", Exchange(200, {}, b"", None, None, 10))
+    await capture.close()
+
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=1, cooldown=10, clock=clock)
+    breaker.record("https://down.example/", failed=True)
+    clock.now = 11
+
+    async with ReplayClientSession(tmp_path / "capture.sqlite", latency=True) as session:
+        probe = asyncio.create_task(get("https://down.example/", session, breaker=breaker))
+        await asyncio.sleep(0.05)
+        assert breaker.circuits["down.example"].probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    assert not breaker.circuits["down.example"].probing
+    assert breaker.before_request("https://down.example/")
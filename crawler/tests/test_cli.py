@@ -0,0 +1,87 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from spider.contracts import CrawledNode, CrawlResponse
+from spider.serialize import serialize
+
+ROOT = Path(__file__).parent.parent
+
+HEAVY_MODULES = ("aiohttp", "aiosqlite", "bs4", "feedparser", "lxml", "tenacity", "urwid")
+
+IMPORT_BUDGET = 0.25
+"""seconds `import spider.cli` may take. it is well under 0.1s, and over 0.5s
+when the network and ui stacks get imported eagerly"""
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+
+def crawl_json(path: Path, children: list[str]) -> Path:
+    nodes = [CrawledNode(at="https://seed", parent=None, children=children, depth=0, indexed=True)]
+    nodes += [
+        CrawledNode(at=child, parent="https://seed", children=[], depth=1, indexed=True)
+        for child in children
+    ]
+    response = CrawlResponse(nodes=nodes, nominations_limit=3, start="0", end="1")
+    path.write_text(serialize(response))
+    return path
+
+
+def test_patch_does_not_import_network_or_ui(tmp_path):
+    old = crawl_json(tmp_path / "old.json", ["https://a"])
+    new = crawl_json(tmp_path / "new.json", ["https://a", "https://b"])
+
+    result = run_python(
+        "-c",
+        "import sys, json\n"
+        "from spider.cli import webchain\n"
+        f"webchain(['patch', {str(old)!r}, {str(new)!r}], standalone_mode=False)\n"
+        "print(json.dumps(sorted({m.split('.')[0] for m in sys.modules})))",
+    )
+
+    *patched, modules = result.stdout.splitlines()
+    assert "https://b" in "\n".join(patched)
+    assert not set(HEAVY_MODULES) & set(json.loads(modules))
+
+
+def test_cli_import_time():
+    result = run_python("-X", "importtime", "-c", "import spider.cli")
+
+    # the last line is the module itself, with its cumulative time in microseconds
+    cumulative = int(result.stderr.strip().splitlines()[-1].split("|")[1])
+    assert cumulative / 1_000_000 < IMPORT_BUDGET
+
+
+def test_tree_from_saved_crawl_does_not_crawl(tmp_path):
+    saved = crawl_json(tmp_path / "current.json", ["https://a", "https://b"])
+
+    result = run_python(
+        "-c",
+        "import sys, json\n"
+        "from spider.cli import webchain\n"
+        f"webchain(['tree', '--print', '--from', {str(saved)!r}], standalone_mode=False)\n"
+        "print(json.dumps(sorted({m.split('.')[0] for m in sys.modules})))",
+    )
+
+    *tree, modules = result.stdout.splitlines()
+    assert tree == ["https://seed (limit=3)", "├── https://a", "└── https://b"]
+    assert not set(HEAVY_MODULES) & set(json.loads(modules))
+
+
+def test_worker_rejects_options_the_coordinator_decides(monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_COORDINATOR_TOKEN", "secret")
+    for option in (["--no-robots-txt"], ["--retry-budget", "3"]):
+        result = subprocess.run(
+            [sys.executable, "-c", "from spider.cli import webchain; webchain()", "worker"]
+            + ["127.0.0.1:1", *option],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 2
+        assert "up to the coordinator" in result.stderr
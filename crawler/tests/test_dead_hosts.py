@@ -0,0 +1,91 @@
+import socket
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from spider.crawl import crawl
+from spider.dead_hosts import PROBE_INTERVAL, DeadHosts
+from spider.error import HostUnavailableError, InvalidStatusCode
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def test_dead_hosts_are_skipped_until_probed_again(tmp_path):
+    clock = Clock()
+    key = SimpleNamespace(host="down.example", port=443, ssl=True)
+    refused = aiohttp.ClientConnectorError(key, OSError(111, "Connection refused"))
+
+    async with DeadHosts(tmp_path / "cache.sqlite", clock) as dead_hosts:
+        await dead_hosts.record("https://down.example/a", refused)
+        # counted once per run, however many of its pages fail
+        await dead_hosts.record("https://down.example/b", TimeoutError())
+        # failing fast says nothing about the host, it doesn't make it reachable
+        await dead_hosts.record("https://down.example/c", HostUnavailableError("down.example", 2))
+        await dead_hosts.record("https://gone.example/", InvalidStatusCode(404))
+        assert await dead_hosts.check("https://gone.example/") is None
+
+    clock.now += PROBE_INTERVAL / 2
+    async with DeadHosts(tmp_path / "cache.sqlite", clock) as dead_hosts:
+        dead = await dead_hosts.check("https://DOWN.example/c")
+        assert dead is not None and dead.failures == 1
+        assert "ClientConnectorError" in dead.reason
+
+    clock.now += PROBE_INTERVAL
+    async with DeadHosts(tmp_path / "cache.sqlite", clock) as dead_hosts:
+        assert await dead_hosts.check("https://down.example/c") is None
+        await dead_hosts.record("https://down.example/c", TimeoutError())
+        assert dead_hosts.hosts["down.example"].retry_at == clock.now + 2 * PROBE_INTERVAL
+
+    clock.now += 2 * PROBE_INTERVAL
+    async with DeadHosts(tmp_path / "cache.sqlite", clock) as dead_hosts:
+        await dead_hosts.record("https://down.example/c", None)
+
+    async with DeadHosts(tmp_path / "cache.sqlite", clock) as dead_hosts:
+        assert await dead_hosts.check("https://down.example/c") is None
+        assert dead_hosts.hosts == {}
+
+
+async def test_without_a_path_nothing_is_remembered():
+    async with DeadHosts(None) as dead_hosts:
+        await dead_hosts.record("https://down.example/", TimeoutError())
+        assert await dead_hosts.check("https://down.example/") is None
+
+
+async def test_host_failed_fast_by_the_breaker_stays_dead(tmp_path, monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_CACHE_DB", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setenv("WEBCHAIN_NETWORK_ATTEMPTS", "3")
+    monkeypatch.setenv("WEBCHAIN_RETRY_MAX_WAIT", "0.05")
+    monkeypatch.setenv("WEBCHAIN_BREAKER_THRESHOLD", "2")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        down = f"http://127.0.0.1:{s.getsockname()[1]}"
+    dead_pages = [f"{down}/{i}" for i in range(4)]
+
+    async def seed(request: web.Request) -> web.Response:
+        links = "".join(f'<link rel="webchain-nomination" href="{url}">' for url in dead_pages)
+        html = (
+            f'<html><head><link rel="webchain" href="http://{request.host}">'
+            f'<meta name="webchain-nominations-limit" content="4">{links}</head></html>'
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/", seed)
+    async with TestServer(app) as server:
+        result = await crawl(str(server.make_url("")).rstrip("/"))
+    # the pages fail together, and their retries are failed fast by the breaker
+    errors = [type(n.index_error).__name__ for n in result.nodes[1:]]
+    assert errors == ["HostUnavailableError"] * len(dead_pages)
+
+    async with DeadHosts(tmp_path / "cache.sqlite") as dead_hosts:
+        dead = await dead_hosts.check(f"{down}/next")
+        assert dead is not None and dead.failures == 1
+        assert "ClientConnectorError" in dead.reason
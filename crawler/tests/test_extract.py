@@ -0,0 +1,85 @@
+import sqlite3
+from contextlib import closing
+
+from spider.contracts import DocumentExtraction, HtmlMetadata
+from spider.extract import extract_document
+from spider.extraction_cache import ExtractionCache
+import spider.extraction_cache
+
+
+HTML = """
+<html>
+<head>
+    <title>My Webchain Node</title>
+    <link rel="webchain" href="https://mychain.net">
+    <link rel="webchain-nomination" href="https://example.org">
+    <link rel="alternate" type="application/rss+xml" href="/feed.xml">
+    <meta name="webchain-nominations-limit" content="3">
+</head>
+</html>
+"""
+
+
+def test_extract_document():
+    doc = extract_document(HTML)
+
+    assert doc == DocumentExtraction(
+        webchain_href="https://mychain.net",
+        nominations=["https://example.org"],
+        nominations_limit=3,
+        html_metadata=HtmlMetadata(title="My Webchain Node", description=None, theme_color=None),
+        feed_hrefs=["/feed.xml"],
+    )
+
+
+def test_extract_document_decodes_bytes():
+    declared = '<meta charset="iso-8859-1"><title>caf\xe9</title>'.encode("latin-1")
+    assert extract_document(declared).html_metadata.title == "caf\xe9"
+
+    # the charset of the Content-Type header wins over the declared one
+    windows = '<meta charset="utf-8"><title>\u201ccaf\xe9\u201d</title>'.encode("cp1252")
+    assert extract_document(windows, "cp1252").html_metadata.title == "\u201ccaf\xe9\u201d"
+
+
+async def test_extraction_cache_persists(tmp_path):
+    path = tmp_path / "extraction-cache.sqlite"
+
+    async with ExtractionCache(path) as cache:
+        doc = await cache.extract(HTML, "abc")
+
+    async with ExtractionCache(path) as cache:
+        # a cached result is returned even though the body doesn't match
+        assert await cache.extract("<html></html>", "abc") == doc
+
+
+async def test_extraction_cache_version(tmp_path, monkeypatch):
+    path = tmp_path / "extraction-cache.sqlite"
+
+    async with ExtractionCache(path) as cache:
+        await cache.extract(HTML, "abc")
+
+    monkeypatch.setattr(spider.extraction_cache, "EXTRACTION_VERSION", -1)
+
+    async with ExtractionCache(path) as cache:
+        assert await cache.get("abc") is None
+
+
+async def test_extraction_cache_writes_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(spider.extraction_cache, "FLUSH_EVERY", 3)
+    path = tmp_path / "extraction-cache.sqlite"
+
+    def stored() -> int:
+        if not path.exists():
+            return 0
+        with closing(sqlite3.connect(path)) as db:
+            return db.execute("SELECT count(*) FROM extractions").fetchone()[0]
+
+    async with ExtractionCache(path) as cache:
+        await cache.extract(HTML, "a")
+        await cache.extract(HTML, "b")
+        assert stored() == 0
+        await cache.extract(HTML, "c")
+        assert stored() == 3
+        await cache.extract(HTML, "d")
+    # the rest is written out on close
+    assert stored() == 4
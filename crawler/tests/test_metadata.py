@@ -1,5 +1,7 @@
-from spider.metadata import get_html_metadata
-from spider.contracts import HtmlMetadata
+import dataclasses
+
+from spider.metadata import can_reuse_metadata, fetch_and_update_metadata, get_html_metadata
+from spider.contracts import CrawledNode, HtmlMetadata
 
 
 async def test_metadata():
@@ -72,3 +74,39 @@ async def test_metadata_twitter():
         description="twitter desc",
         theme_color=None,
     )
+
+
+async def test_reuse_metadata_for_unchanged_page():
+    previous = CrawledNode(
+        at="https://example.org",
+        parent=None,
+        children=[],
+        depth=0,
+        indexed=True,
+        html_metadata=HtmlMetadata(title="title", description=None, theme_color=None),
+        content_hash="abc",
+    )
+    node = dataclasses.replace(previous, html_metadata=None)
+
+    # no session: reusing metadata must not touch the network
+    result = await fetch_and_update_metadata(node, session=None, previous=previous)
+
+    assert result.html_metadata == previous.html_metadata
+    assert result.syndication_feeds == []
+
+
+async def test_no_reuse_for_changed_page():
+    previous = CrawledNode(
+        at="https://example.org",
+        parent=None,
+        children=[],
+        depth=0,
+        indexed=True,
+        html_metadata=HtmlMetadata(title="title", description=None, theme_color=None),
+        content_hash="abc",
+    )
+
+    assert can_reuse_metadata("abc", previous)
+    assert not can_reuse_metadata("def", previous)
+    assert not can_reuse_metadata(None, previous)
+    assert not can_reuse_metadata("abc", dataclasses.replace(previous, html_metadata=None))
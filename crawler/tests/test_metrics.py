@@ -0,0 +1,45 @@
+import json
+
+from spider.metrics import Metrics
+
+
+def test_openmetrics_format():
+    metrics = Metrics()
+    metrics.inc("webchain_nodes_total", indexed="true")
+    metrics.inc("webchain_nodes_total", indexed="true")
+    metrics.inc("webchain_errors_total", phase="crawl", error="InvalidStatusCode")
+    metrics.inc("webchain_cache_requests_total", result="hit")
+    metrics.inc("webchain_cache_requests_total", result="miss")
+    metrics.finish("json", success=True)
+
+    text = metrics.to_openmetrics()
+
+    assert "# TYPE webchain_nodes_total counter" in text
+    assert 'webchain_nodes_total{indexed="true"} 2\n' in text
+    assert 'webchain_errors_total{error="InvalidStatusCode",phase="crawl"} 1\n' in text
+    assert "webchain_cache_hit_ratio 0.5\n" in text
+    assert 'webchain_run_success{command="json"} 1\n' in text
+
+
+def test_phase_notifies_listeners():
+    metrics = Metrics()
+    events = []
+    metrics.phase_listeners.append(lambda name, entering: events.append((name, entering)))
+
+    with metrics.phase("patch"):
+        pass
+
+    assert events == [("patch", True), ("patch", False)]
+    assert metrics.get("webchain_phase_duration_seconds_total", phase="patch") > 0
+    assert "# TYPE webchain_phase_duration_seconds_total counter" in metrics.to_openmetrics()
+
+
+def test_write_json(tmp_path):
+    metrics = Metrics()
+    metrics.inc("webchain_retries_total", 3)
+    path = tmp_path / "metrics.json"
+
+    metrics.write(path)
+
+    assert json.loads(path.read_text())["webchain_retries_total"] == [{"labels": {}, "value": 3}]
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.json"]
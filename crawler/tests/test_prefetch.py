@@ -0,0 +1,86 @@
+import asyncio
+
+from spider.contracts import CrawledNode
+from spider.prefetch import Prefetcher
+
+
+def node(at: str, depth: int, parent: str | None = None) -> CrawledNode:
+    return CrawledNode(at=at, parent=parent, children=[], depth=depth, indexed=True)
+
+
+async def test_prefetch_is_taken_dropped_or_discarded():
+    fetched = []
+    release = asyncio.Event()
+
+    async def fetch(node: CrawledNode) -> str:
+        fetched.append(node.at)
+        await release.wait()
+        return node.at.upper()
+
+    prefetcher = Prefetcher(fetch, concurrency=2)
+    prefetcher.start([node("c", 2), node("a", 0), node("b", 1)])
+    await asyncio.sleep(0)
+    # shallowest first, and no more than `concurrency` at once
+    assert fetched == ["a", "b"]
+
+    # still waiting for its turn, so the traversal fetches it itself
+    assert prefetcher.take("c") is None
+    assert prefetcher.take("unknown") is None
+
+    task = prefetcher.take("a")
+    release.set()
+    assert await task == "A"
+    assert fetched == ["a", "b"]
+
+    await prefetcher.close()
+    assert prefetcher.tasks == {}
+
+
+async def test_prefetch_of_a_child_no_longer_followed_is_cancelled():
+    async def fetch(node: CrawledNode) -> str:
+        await asyncio.Event().wait()
+        return node.at
+
+    prefetcher = Prefetcher(fetch)
+    prefetcher.start([node("b", 1, "a"), node("c", 1, "a"), node("d", 1, "a"), node("e", 2, "b")])
+    await asyncio.sleep(0)
+    canceled = prefetcher.tasks["c"]
+
+    # a sibling settled first took d over, c isn't followed by anyone
+    prefetcher.settle("x", ["d"])
+    prefetcher.settle("a", ["b"])
+    assert set(prefetcher.tasks) == {"b", "d", "e"}
+    await asyncio.sleep(0)
+    assert canceled.cancelled()
+
+    # b is at the depth limit, so its children aren't followed
+    prefetcher.settle("b", [])
+    assert set(prefetcher.tasks) == {"b", "d"}
+    await prefetcher.close()
+
+
+async def test_prefetches_under_a_child_no_longer_followed_are_cancelled():
+    async def fetch(node: CrawledNode) -> str:
+        await asyncio.Event().wait()
+        return node.at
+
+    prefetcher = Prefetcher(fetch)
+    prefetcher.start(
+        [
+            node("b", 1, "a"),
+            node("c", 2, "b"),
+            node("d", 3, "c"),
+            node("e", 2, "b"),
+            node("f", 3, "e"),
+        ]
+    )
+    await asyncio.sleep(0)
+    canceled = prefetcher.tasks["d"]
+
+    # e moved under x, so its subtree is settled when the traversal gets there
+    prefetcher.settle("x", ["e"])
+    prefetcher.settle("a", [])
+    assert set(prefetcher.tasks) == {"e", "f"}
+    await asyncio.sleep(0)
+    assert canceled.cancelled()
+    await prefetcher.close()
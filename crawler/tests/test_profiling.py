@@ -0,0 +1,55 @@
+import threading
+import time
+
+from spider.metrics import Metrics
+from spider.profiling import AllocationTracker, StackSampler
+
+
+def busy_loop(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_stack_sampler_collapses_stacks():
+    sampler = StackSampler(interval=0.001, thread_id=threading.get_ident())
+    sampler.start()
+    busy_loop(0.1)
+    sampler.stop()
+
+    assert sampler.samples > 0
+    stack, count = sampler.stacks.most_common(1)[0]
+    assert "busy_loop (test_profiling.py:" in stack
+    assert f"{stack} {count}\n" in sampler.collapsed()
+
+
+def test_stack_sampler_samples_every_thread():
+    crawl = threading.Thread(target=busy_loop, args=(0.1,), name="crawl")
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    crawl.start()
+    crawl.join()
+    sampler.stop()
+
+    stacks = sampler.stacks.keys()
+    assert any(s.startswith("crawl;") and "busy_loop (test_profiling.py:" in s for s in stacks)
+    assert any(s.startswith("MainThread;") for s in stacks)
+
+
+def test_allocation_tracker_reports_phases():
+    metrics = Metrics()
+    allocations = AllocationTracker(top=5)
+    metrics.phase_listeners.append(allocations.on_phase)
+    allocations.start()
+    try:
+        with metrics.phase("parse"):
+            kept = [bytearray(1024) for _ in range(100)]
+    finally:
+        allocations.stop()
+
+    [phase] = allocations.phases
+    assert phase.phase == "parse"
+    assert phase.net >= 100 * 1024
+    assert any(stat.traceback[0].filename == __file__ for stat in phase.top)
+    assert allocations.report().startswith("phase parse: net")
+    del kept
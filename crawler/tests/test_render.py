@@ -0,0 +1,82 @@
+import io
+
+from spider.contracts import CrawlResponse, CrawledNode
+from spider.render import TreeRenderer, render_response
+
+
+def node(at: str, parent: str | None, depth: int, children=(), unqualified=()) -> CrawledNode:
+    return CrawledNode(
+        at=at,
+        parent=parent,
+        depth=depth,
+        children=list(children),
+        unqualified=list(unqualified),
+        indexed=True,
+    )
+
+
+def test_rows_stream_once_everything_above_them_is_final():
+    out = io.StringIO()
+    renderer = TreeRenderer(out)
+
+    renderer.on_node_start("seed", None, 0)
+    renderer.on_node_complete(node("seed", None, 0, ["a", "b"], ["x"]), 2)
+    assert out.getvalue() == "seed (limit=2)\n"
+
+    renderer.on_node_start("a", "seed", 1)
+    renderer.on_node_start("b", "seed", 1)
+    renderer.on_cache_hit("b/")
+    renderer.on_node_complete(node("b", "seed", 1), 2)
+    assert out.getvalue() == "seed (limit=2)\n"
+
+    renderer.on_node_complete(node("a", "seed", 1, ["c"]), 2)
+    renderer.on_node_start("c", "a", 2)
+    assert out.getvalue().splitlines()[1:] == ["├── a"]
+
+    renderer.on_node_complete(node("c", "a", 2, [], ["seed"]), 2)
+    renderer.finish()
+    assert out.getvalue().splitlines() == [
+        "seed (limit=2)",
+        "├── a",
+        "│   └── c",
+        "│           unqualified seed",
+        "└── b (cached)",
+        "    unqualified x",
+    ]
+
+
+def test_finish_writes_nodes_that_never_completed():
+    out = io.StringIO()
+    renderer = TreeRenderer(out)
+    renderer.on_node_start("seed", None, 0)
+    renderer.on_node_complete(node("seed", None, 0, ["a", "b"]), 2)
+    renderer.on_node_start("a", "seed", 1)
+    renderer.on_node_start("b", "seed", 1)
+    renderer.on_node_complete(node("b", "seed", 1), 2)
+    renderer.finish()
+    assert out.getvalue().splitlines() == ["seed (limit=2)", "├── a", "└── b"]
+
+
+def test_nodes_at_the_recursion_limit_are_leaves():
+    out = io.StringIO()
+    renderer = TreeRenderer(out, recursion_limit=1)
+    renderer.on_node_start("seed", None, 0)
+    renderer.on_node_complete(node("seed", None, 0, ["a", "b"]), 2)
+    renderer.on_node_start("a", "seed", 1)
+    renderer.on_node_start("b", "seed", 1)
+    # a's children aren't crawled, so b is written without waiting for them
+    renderer.on_node_complete(node("a", "seed", 1, ["c"]), 2)
+    renderer.on_node_complete(node("b", "seed", 1), 2)
+    assert out.getvalue().splitlines() == ["seed (limit=2)", "├── a", "└── b"]
+
+
+def test_render_response():
+    nodes = [
+        node("seed", None, 0, ["a", "b"]),
+        node("a", "seed", 1, ["c"]),
+        node("c", "a", 2),
+        node("b", "seed", 1),
+    ]
+    out = io.StringIO()
+    render_response(CrawlResponse(nodes=nodes, nominations_limit=2, start="", end=""), out)
+    assert out.getvalue().splitlines() == ["seed (limit=2)", "├── a", "│   └── c", "└── b"]
@@ -0,0 +1,54 @@
+import aiohttp
+import pytest
+
+from spider.replay import Capture, Exchange, ReplayClientSession, ReplayMissError
+
+
+@pytest.fixture
+async def capture_path(tmp_path):
+    path = tmp_path / "capture.sqlite"
+    capture = Capture(path)
+    await capture.save("https://ok.example", Exchange(200, {}, b"<html></html>", None, None, 0.1))
+    await capture.save("https://flaky.example", Exchange(None, {}, None, "TimeoutError", "", 5.0))
+    await capture.save("https://flaky.example", Exchange(200, {}, b"second", None, None, 0.1))
+    await capture.save("https://gone.example", Exchange(404, {}, b"", None, None, 0.1))
+    await capture.save(
+        "https://nxdomain.example",
+        Exchange(None, {}, None, "ClientConnectorDNSError", "Name or service not known", 0.1),
+    )
+    await capture.close()
+    return path
+
+
+async def test_replay_response(capture_path):
+    async with ReplayClientSession(capture_path, raise_for_status=True) as session:
+        async with session.get("https://ok.example") as response:
+            assert response.status == 200
+            assert await response.read() == b"<html></html>"
+
+
+async def test_replay_in_recorded_order(capture_path):
+    async with ReplayClientSession(capture_path, raise_for_status=True) as session:
+        with pytest.raises(TimeoutError):
+            async with session.get("https://flaky.example"):
+                pass
+        for _ in range(2):
+            # the last exchange repeats once the recording runs out
+            async with session.get("https://flaky.example") as response:
+                assert await response.read() == b"second"
+
+
+async def test_replay_errors(capture_path):
+    async with ReplayClientSession(capture_path, raise_for_status=True) as session:
+        with pytest.raises(aiohttp.ClientResponseError) as e:
+            async with session.get("https://gone.example"):
+                pass
+        assert e.value.status == 404
+
+        with pytest.raises(aiohttp.ClientConnectorDNSError):
+            async with session.get("https://nxdomain.example"):
+                pass
+
+        with pytest.raises(ReplayMissError):
+            async with session.get("https://unknown.example"):
+                pass
@@ -0,0 +1,40 @@
+import asyncio
+
+from spider import robots
+from spider.robots import RobotsChecker
+
+
+async def test_robots_txt_is_fetched_once_per_site(monkeypatch):
+    fetched = []
+    release = asyncio.Event()
+
+    async def fetch_robots_txt(url, session):
+        fetched.append(url)
+        await release.wait()
+        return "User-agent: *\nDisallow: /private\n"
+
+    monkeypatch.setattr(robots, "fetch_robots_txt", fetch_robots_txt)
+    checker = RobotsChecker(session=None, user_agent="webchain")
+
+    checker.prefetch("https://a.example/one")
+    first = asyncio.create_task(checker.allowed("https://a.example/private/two"))
+    second = asyncio.create_task(checker.allowed("https://a.example/three"))
+    await asyncio.sleep(0)
+    # one page giving up on the check doesn't cancel it for the others
+    first.cancel()
+    release.set()
+
+    assert await second
+    assert not await checker.allowed("https://a.example/private")
+    assert await checker.allowed("https://b.example/private") is False
+    assert fetched == ["https://a.example/one", "https://b.example/private"]
+    await checker.close()
+
+
+async def test_unreachable_robots_txt_allows_everything(monkeypatch):
+    async def fetch_robots_txt(url, session):
+        return None
+
+    monkeypatch.setattr(robots, "fetch_robots_txt", fetch_robots_txt)
+    checker = RobotsChecker(session=None, user_agent="webchain")
+    assert await checker.allowed("https://a.example/private")
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from conftest import shape
+
+from spider.contracts import CrawlResponse, CrawledNode
+from spider.crawl import crawl
+from spider.shard import Coordinator, run_worker
+
+HOSTS = ("127.0.0.1", "127.0.0.2", "127.0.0.3")
+
+# node -> nominations, with some nominated twice and one past the limit of 2
+GRAPH = {
+    "": ["a", "b", "c"],
+    "a": ["b", "d"],
+    "b": ["e", "a", "f"],
+    "d": ["e"],
+    "e": [],
+    "f": ["", "g"],
+    "g": [],
+}
+
+
+@pytest.fixture
+async def chain(serve_webchain):
+    # spread over the hosts, so that there is something to shard
+    return (await serve_webchain(GRAPH, nominations_limit=2, hosts=HOSTS)).seed
+
+
+async def test_sharded_crawl_matches_crawl(chain):
+    expected = await crawl(chain)
+
+    coordinator = Coordinator(chain, shards=2, token="secret")
+    address = await coordinator.listen()
+    workers = [asyncio.create_task(run_worker(address, "secret")) for _ in range(2)]
+    sharded = await coordinator.finish()
+    await asyncio.gather(*workers)
+
+    assert shape(sharded.nodes) == shape(expected.nodes)
+    assert sharded.nominations_limit == expected.nominations_limit == 2
+
+
+async def test_worker_with_wrong_token_gets_no_work(chain):
+    coordinator = Coordinator(chain, shards=1, token="secret")
+    address = await coordinator.listen()
+    await asyncio.wait_for(run_worker(address, "guess"), timeout=5)
+    assert not coordinator.nodes
+
+    worker = asyncio.create_task(run_worker(address, "secret"))
+    assert len((await coordinator.finish()).nodes) == len(GRAPH)
+    await worker
+
+
+async def test_unreachable_seed_fails_the_crawl(chain):
+    coordinator = Coordinator(chain + "/missing", shards=1, token="secret")
+    address = await coordinator.listen()
+    worker = asyncio.create_task(run_worker(address, "secret"))
+    with pytest.raises(ValueError, match="unreachable"):
+        await coordinator.finish()
+    await worker
+
+
+async def test_previous_nodes_no_longer_followed_are_discarded(chain, monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_RETRY_BUDGET", "5")
+    expected = await crawl(chain)
+    gone, under_gone = f"{chain}/gone", f"{chain}/gone/child"
+    previous = CrawlResponse(
+        nodes=expected.nodes
+        + [
+            CrawledNode(at=gone, parent=chain, children=[], depth=1, indexed=True),
+            CrawledNode(at=under_gone, parent=gone, children=[], depth=2, indexed=True),
+        ],
+        nominations_limit=2,
+        start=expected.start,
+        end=expected.end,
+    )
+
+    coordinator = Coordinator(chain, shards=2, token="secret", previous=previous)
+    # the run's retry budget is split between the workers
+    assert [coordinator.retry_budget_share(i) for i in range(2)] == [3, 2]
+    address = await coordinator.listen()
+    workers = [asyncio.create_task(run_worker(address, "secret")) for _ in range(2)]
+    sharded = await coordinator.finish()
+    await asyncio.gather(*workers)
+
+    # which of two nominations of a node is followed depends on which page is
+    # crawled first, and the previous nodes are prefetched
+    assert {n.at for n in sharded.nodes} == {n.at for n in expected.nodes}
+    assert coordinator.discarded == {gone, under_gone}
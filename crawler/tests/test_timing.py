@@ -0,0 +1,39 @@
+from spider.contracts import CrawledNode, RequestTiming
+from spider.timing import summarize_timings
+
+
+def test_summarize_timings():
+    nodes = [
+        CrawledNode(
+            at="https://fast.example",
+            parent=None,
+            children=[],
+            depth=0,
+            indexed=True,
+            fetch_duration=0.1,
+            timing=RequestTiming(dns=0.01, ttfb=0.05, attempts=1, cache_hit=True),
+        ),
+        CrawledNode(
+            at="https://slow.example/a",
+            parent="https://fast.example",
+            children=[],
+            depth=1,
+            indexed=False,
+            fetch_duration=3.0,
+            timing=RequestTiming(dns=0.5, attempts=3),
+        ),
+    ]
+
+    summary = summarize_timings(nodes)
+
+    assert summary["requests"] == 4
+    assert summary["retries"] == 2
+    assert summary["cache_hits"] == 1
+    assert summary["totals"]["dns"] == 0.51
+    assert summary["fetch"]["max"] == 3.0
+    assert summary["slowest_hosts"][0] == {
+        "host": "slow.example",
+        "nodes": 1,
+        "fetch": 3.0,
+        "retries": 2,
+    }
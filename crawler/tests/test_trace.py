@@ -0,0 +1,36 @@
+from time import perf_counter
+
+from spider.contracts import CrawledNode
+from spider.trace import TraceRecorder, combine
+
+
+def node(at: str, parent: str | None, depth: int) -> CrawledNode:
+    return CrawledNode(at=at, parent=parent, children=[], depth=depth, indexed=True)
+
+
+def test_trace_tracks_flows_and_critical_path():
+    trace = TraceRecorder()
+    trace.on_node_start("https://a.example", None, 0)
+    trace.on_span("https://a.example/", "fetch", perf_counter(), perf_counter())
+    trace.on_node_complete(node("https://a.example", None, 0), 2)
+    trace.on_node_start("https://b.example/x", "https://a.example", 1)
+    trace.on_node_start("https://a.example/y", "https://a.example", 1)
+    trace.on_retry("https://b.example/x/", 1)
+    trace.on_node_complete(node("https://a.example/y", "https://a.example", 1), 2)
+    trace.on_node_complete(node("https://b.example/x", "https://a.example", 1), 2)
+
+    events = trace.to_json()["traceEvents"]
+
+    processes = {e["args"]["name"] for e in events if e["name"] == "process_name"}
+    assert processes == {"a.example", "b.example", "critical path"}
+    spans = [(e["name"], e["tid"]) for e in events if e["ph"] == "X" and e["cat"] == "crawl"]
+    assert ("fetch", trace.tids["https://a.example"][1]) in spans
+    assert sum(e["ph"] == "s" for e in events) == 2
+    assert trace.critical_path() == ["https://a.example", "https://b.example/x"]
+
+
+def test_combine():
+    calls = []
+    assert combine(None, None) is None
+    combine(calls.append, None, lambda x: calls.append(x * 2))(1)
+    assert calls == [1, 2]
@@ -0,0 +1,72 @@
+import gzip
+
+import aiohttp
+import pytest
+
+pytest.importorskip("httpx")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from spider.cached_session import CachedClientSession
+from spider.contracts import RequestTiming
+from spider.error import InvalidStatusCode
+from spider.http import get
+from spider.transport import get_transport
+
+PAGE = b"<html><head><title>page</title></head><body>" + b"<p>filler</p>" * 1000 + b"</body>"
+
+
+@pytest.fixture
+async def server():
+    compressed = gzip.compress(PAGE)
+
+    async def page(request: web.Request) -> web.Response:
+        return web.Response(
+            body=compressed,
+            content_type="text/html",
+            headers={"Content-Encoding": "gzip", "ETag": '"v1"'},
+        )
+
+    async def moved(request: web.Request) -> web.Response:
+        raise web.HTTPFound("/")
+
+    app = web.Application()
+    app.router.add_get("/", page)
+    app.router.add_get("/moved", moved)
+    async with TestServer(app) as server:
+        yield server
+
+
+@pytest.mark.parametrize("name", ["aiohttp", "httpx"])
+async def test_transports_behave_alike(server, name, monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_NETWORK_ATTEMPTS", "1")
+    async with get_transport({"User-Agent": "test"}, name) as transport:
+        timing = RequestTiming()
+        body = await get(str(server.make_url("/moved")), session=transport, timing=timing)
+        assert body.data == PAGE
+        assert timing.content_encoding == "gzip"
+        assert timing.bytes_received == len(gzip.compress(PAGE))
+        assert timing.ttfb is not None
+
+        with pytest.raises(InvalidStatusCode) as e:
+            await get(str(server.make_url("/missing")), session=transport)
+        assert e.value.status == 404
+
+        with pytest.raises(aiohttp.ClientConnectorError):
+            await get("http://127.0.0.1:1/", session=transport)
+
+
+async def test_cache_wraps_any_transport(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("WEBCHAIN_CACHE_DB", str(tmp_path / "cache.sqlite"))
+    url = str(server.make_url("/"))
+    async with CachedClientSession(get_transport({}, "httpx")) as session:
+        assert (await get(url, session=session)).data == PAGE
+        assert (await session.get_cached(url))["body"] == PAGE
+
+
+async def test_httpx_has_no_timeouts_but_the_total():
+    import httpx
+
+    async with get_transport({}, "httpx") as transport:
+        assert transport.client.timeout == httpx.Timeout(None)
@@ -0,0 +1,91 @@
+import os
+
+import urwid
+
+from spider.tree import CrawlTreeListBox, CrawlTreeWalker, TreeCrawlUI
+from spider.tree_model import CrawlTreeModel
+
+
+def screen(listbox: CrawlTreeListBox, rows: int = 5) -> list[str]:
+    canvas = listbox.render((40, rows), focus=True)
+    return [line.decode().rstrip() for line in canvas.text]
+
+
+def make_walker(n: int) -> tuple[CrawlTreeModel, CrawlTreeWalker]:
+    model = CrawlTreeModel()
+    model.add("seed", None)
+    for i in range(n):
+        model.add(f"n{i}", "seed")
+        model.add(f"n{i}.child", f"n{i}")
+
+    def markup(key):
+        node, unqualified = key
+        return [model.prefix(node) + node.at + (" +" if node.collapsed else "")]
+
+    return model, CrawlTreeWalker(model, markup)
+
+
+def test_walker_builds_only_visible_rows():
+    model, walker = make_walker(10_000)
+    listbox = CrawlTreeListBox(walker)
+
+    assert screen(listbox) == ["seed", "├── n0", "│   └── n0.child", "├── n1", "│   └── n1.child"]
+    assert len(walker.widgets) <= 10
+    assert listbox.get_first_visible_pos((40, 5)) == 0
+
+
+def test_focus_stays_on_row_while_rows_are_added_above():
+    model, walker = make_walker(3)
+    listbox = CrawlTreeListBox(walker)
+    walker.set_focus(model.row(3))
+
+    model.add("n0.child2", "n0")
+    walker._modified()
+
+    assert walker.focus[0].at == "n1"
+    assert listbox.get_first_visible_pos((40, 5)) <= model.index(walker.focus)
+
+
+def test_collapse():
+    model, walker = make_walker(3)
+    listbox = CrawlTreeListBox(walker)
+
+    model.set_collapsed(model["n0"], True)
+    walker._modified()
+
+    assert len(model) == 6
+    assert screen(listbox)[:3] == ["seed", "├── n0 +", "├── n1"]
+
+    model.set_collapsed(model["n0"], False)
+    assert len(model) == 7
+
+
+def test_events_are_applied_in_batches():
+    ui = TreeCrawlUI("seed", robots_txt=False)
+    read, ui._pipe_write = os.pipe()
+    redraws = []
+    urwid.connect_signal(ui._walker, "modified", lambda: redraws.append(len(ui._model)))
+
+    def add(at: str, parent: str | None):
+        def _update() -> None:
+            ui._model.add(at, parent)
+            ui._inflight.append(at)
+            ui._rows_changed = ui._inflight_changed = True
+
+        return _update
+
+    ui._enqueue(add("seed", None))
+    for i in range(100):
+        ui._enqueue(add(f"n{i}", "seed"))
+
+    assert os.read(read, 1024) == b"\x00"
+    assert redraws == []
+
+    ui._flush_queue()
+    assert redraws == [101]
+    assert ui._status.text.startswith("crawling... seed n0 n1")
+
+    ui._enqueue(add("late", "seed"))
+    assert os.read(read, 1024) == b"\x00"
+    os.close(read)
+    os.close(ui._pipe_write)
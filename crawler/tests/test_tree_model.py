@@ -0,0 +1,88 @@
+import random
+
+from spider.tree_model import CrawlTreeModel, Fenwick
+
+
+def naive_rows(model: CrawlTreeModel) -> list[tuple[str, int | None]]:
+    rows = []
+
+    def visit(node):
+        rows.append((node.at, None))
+        if node.collapsed:
+            return
+        for child in node.children:
+            visit(child)
+        rows.extend((node.at, i) for i in range(len(node.unqualified)))
+
+    for root in model.root.children:
+        visit(root)
+    return rows
+
+
+def test_fenwick():
+    fenwick = Fenwick()
+    values = [3, 1, 4, 1, 5, 9, 2, 6]
+    for v in values:
+        fenwick.append(v)
+    fenwick.add(2, 2)
+    values[2] += 2
+
+    assert fenwick.total == sum(values)
+    assert [fenwick.prefix(i) for i in range(len(values) + 1)] == [
+        sum(values[:i]) for i in range(len(values) + 1)
+    ]
+    for target in range(sum(values)):
+        index, offset = fenwick.find(target)
+        assert sum(values[:index]) + offset == target
+        assert 0 <= offset < values[index]
+
+
+def test_rows_follow_discovery_order_and_collapsing():
+    rng = random.Random(0)
+    model = CrawlTreeModel()
+    model.add("seed", None)
+    for i in range(500):
+        parent = rng.choice(list(model.nodes))
+        roll = rng.random()
+        if roll < 0.2:
+            model.set_unqualified(parent, [f"u{i}-{j}" for j in range(rng.randint(0, 3))])
+        elif roll < 0.3:
+            model.set_collapsed(model[parent], not model[parent].collapsed)
+        else:
+            model.add(f"n{i}", parent)
+
+        if i % 50 == 0:
+            expected = naive_rows(model)
+            assert len(model) == len(expected)
+            assert [(node.at, unqualified) for node, unqualified in model.rows()] == expected
+            for key in model.rows():
+                assert model.row(model.index(key)) == key
+            for at, node in model.nodes.items():
+                if model.is_visible(node):
+                    assert expected[model.position(node)] == (at, None)
+
+
+def test_prefixes():
+    model = CrawlTreeModel()
+    model.add("seed", None)
+    model.add("a", "seed")
+    model.add("a1", "a")
+    model.add("b", "seed")
+    model.set_unqualified("a", ["x"])
+    model.set_unqualified("b", ["y"])
+
+    lines = []
+    for node, unqualified in model.rows():
+        if unqualified is None:
+            lines.append(model.prefix(node) + node.at)
+        else:
+            lines.append(model.unqualified_prefix(node) + node.unqualified[unqualified])
+
+    assert lines == [
+        "seed",
+        "├── a",
+        "│   └── a1",
+        "│       x",
+        "└── b",
+        "        y",
+    ]
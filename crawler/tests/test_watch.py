@@ -0,0 +1,64 @@
+import asyncio
+import json
+import os
+import signal
+
+import pytest
+
+from spider.metrics import metrics
+from spider.serialize import deserialize
+from spider.watch import Watch
+
+
+@pytest.fixture
+async def chain(serve_webchain):
+    return await serve_webchain({"": ["a", "b"], "a": [], "b": []})
+
+
+async def test_recrawl_writes_only_changes(chain, tmp_path):
+    seed, graph = chain.seed, chain.graph
+    out, heartbeat = tmp_path / "current.json", tmp_path / "heartbeat.json"
+
+    async with Watch(seed, out, interval=60, heartbeat=heartbeat) as watch:
+        session = watch.resources.session
+        assert await watch.recrawl()
+        first = deserialize(out.read_text())
+        assert [n.at for n in first.nodes] == [seed, f"{seed}/a", f"{seed}/b"]
+        assert all(n.first_seen and n.html_metadata for n in first.nodes)
+
+        written = out.stat().st_mtime_ns
+        assert not await watch.recrawl()
+        assert out.stat().st_mtime_ns == written
+        assert json.loads(heartbeat.read_text())["end"] > first.end
+
+        graph["b"] = ["c"]
+        graph["c"] = []
+        assert await watch.recrawl()
+        assert watch.current.nodes[-1].at == f"{seed}/c"
+        assert deserialize(out.read_text()).nodes == watch.current.nodes
+        assert watch.resources.session is session
+
+
+async def test_signals_reload_and_stop(chain, tmp_path):
+    seed = chain.seed
+    out = tmp_path / "current.json"
+    cycles = metrics.total("webchain_watch_cycles_total")
+
+    async def until(n: int) -> None:
+        while metrics.total("webchain_watch_cycles_total") < cycles + n:
+            await asyncio.sleep(0.01)
+
+    async with Watch(seed, out, interval=60) as watch:
+        run = asyncio.create_task(watch.run())
+        await asyncio.wait_for(until(1), timeout=5)
+        session = watch.resources.session
+
+        # a reload doesn't wait for the next cycle, and opens a new session
+        os.kill(os.getpid(), signal.SIGHUP)
+        await asyncio.wait_for(until(2), timeout=5)
+        assert watch.resources.session is not session
+
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(run, timeout=5)
+    assert metrics.get("webchain_watch_cycles_total", outcome="failed") == 0
+    assert len(deserialize(out.read_text()).nodes) == 3